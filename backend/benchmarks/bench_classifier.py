@@ -0,0 +1,118 @@
+"""Benchmark document type detection: the old keyword scan against doc_classifier.
+
+Runs both over a labeled corpus (by default benchmarks/fixtures/documents, one
+directory per expected type) and reports accuracy and microseconds per
+document, plus every misclassified file. The old classifier has no "mixed"
+type, so it can't be right on those documents. --pages N times each document
+repeated N times, as a stand-in for multi-page OCR output.
+
+    python benchmarks/bench_classifier.py [corpus_dir] [--repeat N] [--pages N]
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from doc_classifier import DocumentClassifier
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "documents")
+
+
+def legacy_identify(text):
+    """identify_document_type before doc_classifier: one substring scan per keyword"""
+    text_lower = text.lower()
+    prescription_keywords = [
+        'prescription', 'rx', 'rx#', 'dosage', 'take', 'medicine', 'medication',
+        'prescribed', 'pharmacy', 'refill', 'tablets', 'capsules', 'oral', 'topical',
+        'mg', 'mcg', 'ml', 'once daily', 'twice daily', 'three times daily',
+        'physician', 'dr\\.', 'doctor', 'dispense', 'substitution'
+    ]
+    lab_report_keywords = [
+        'laboratory', 'lab report', 'test results', 'specimen', 'reference range',
+        'blood test', 'urine test', 'cholesterol', 'glucose', 'wbc', 'rbc', 'hgb',
+        'hemoglobin', 'hba1c', 'creatinine', 'normal range', 'reference', 'panel',
+        'hematology', 'chemistry', 'lipid', 'thyroid', 'abnormal', 'elevated',
+        'complete blood count', 'metabolic panel'
+    ]
+    prescription_score = 0
+    lab_report_score = 0
+    for keyword in prescription_keywords:
+        if keyword in text_lower:
+            if keyword in ['prescription', 'rx', 'prescribed', 'dosage', 'pharmacy']:
+                prescription_score += 2
+            else:
+                prescription_score += 1
+    for keyword in lab_report_keywords:
+        if keyword in text_lower:
+            if keyword in ['laboratory', 'lab report', 'test results', 'reference range']:
+                lab_report_score += 2
+            else:
+                lab_report_score += 1
+    if re.search(r'take\s+\d+\s+tablet', text_lower) or re.search(r'\d+\s+times?\s+daily', text_lower):
+        prescription_score += 3
+    if re.search(r'\b\d+\s*[-–]\s*\d+\s*[a-zA-Z\/]+\b', text_lower) or re.search(r'reference range', text_lower):
+        lab_report_score += 3
+    if prescription_score > lab_report_score:
+        return "prescription"
+    elif lab_report_score > prescription_score:
+        return "lab_report"
+    else:
+        return "unknown"
+
+
+def load_corpus(directory):
+    documents = []
+    for label in sorted(os.listdir(directory)):
+        label_dir = os.path.join(directory, label)
+        if not os.path.isdir(label_dir):
+            continue
+        for filename in sorted(os.listdir(label_dir)):
+            with open(os.path.join(label_dir, filename), encoding="utf-8") as f:
+                documents.append((f"{label}/{filename}", label, f.read()))
+    return documents
+
+
+def timed(fn, text, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn(text)
+    return (time.perf_counter() - started) / repeat * 1e6, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("corpus", nargs="?", default=CORPUS_DIR)
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--pages", type=int, default=1, help="time each document repeated this many times")
+    args = parser.parse_args()
+
+    documents = load_corpus(args.corpus)
+    if not documents:
+        sys.exit("No labeled documents found")
+
+    classifier = DocumentClassifier.from_config()
+    new_identify = lambda text: classifier.classify(text).doc_type
+    results = {"legacy": [0, 0.0], "single pass": [0, 0.0]}
+    print(f"{'document':<40} {'legacy':>13} {'us':>6} {'single pass':>13} {'us':>6}  confidence")
+    for name, label, text in documents:
+        legacy_us, legacy_type = timed(legacy_identify, text * args.pages, args.repeat)
+        new_us, new_type = timed(new_identify, text * args.pages, args.repeat)
+        results["legacy"][0] += legacy_type == label
+        results["legacy"][1] += legacy_us
+        results["single pass"][0] += new_type == label
+        results["single pass"][1] += new_us
+        confidence = classifier.classify(text).confidence
+        flags = "".join(mark for mark, wrong in (("L", legacy_type != label), ("S", new_type != label)) if wrong)
+        print(f"{name:<40} {legacy_type:>13} {legacy_us:>6.1f} {new_type:>13} {new_us:>6.1f}  {confidence:.2f} {flags}")
+
+    n = len(documents)
+    print()
+    for name, (correct, total_us) in results.items():
+        print(f"{name:<12} accuracy {correct}/{n} ({correct / n:.0%}), {total_us / n:.1f} us per document")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Benchmark upload ingestion: the old temp-file path against ingestion.read_upload.
+
+The old /extract_text/ read the whole upload to hash it, read it again, wrote
+it to a NamedTemporaryFile and read it back with cv2.imread; the new path
+streams it once in chunks into a buffer, hashing as it goes, and decodes with
+cv2.imdecode. Uploads are spooled like Starlette's UploadFile (on disk past
+1 MB) before timing starts. Reports milliseconds and peak Python memory per
+upload for photo-sized inputs (random JPEG-like payloads unless an image file
+is given). Decoding is skipped with --no-decode or when OpenCV is missing.
+
+    python benchmarks/bench_ingestion.py [image_file] [--sizes 2,5] [--repeat N] [--no-decode]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ingestion import read_upload
+
+from cache import content_key
+
+STARLETTE_SPOOL_MAX = 1024 * 1024
+
+try:
+    import cv2
+    import numpy as np
+except ImportError:
+    cv2 = None
+
+
+class SpooledUploadFile:
+    """Stand-in for Starlette's UploadFile: the received body in a SpooledTemporaryFile"""
+
+    def __init__(self, filename, data):
+        self.filename = filename
+        self.size = len(data)
+        self._file = tempfile.SpooledTemporaryFile(max_size=STARLETTE_SPOOL_MAX)
+        self._file.write(data)
+        self._file.seek(0)
+
+    async def read(self, size=-1):
+        return self._file.read(size)
+
+    async def seek(self, offset):
+        self._file.seek(offset)
+
+    def close(self):
+        self._file.close()
+
+
+async def legacy_ingest(file, decode):
+    """/extract_text/ and extract_text_from_file before ingestion.py"""
+    file_data = await file.read()
+    await file.seek(0)
+    content_key("extraction", file_data, "auto", "auto")
+    del file_data
+    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
+        file_data = await file.read()
+        temp_file.write(file_data)
+        temp_path = temp_file.name
+    try:
+        if decode:
+            return cv2.imread(temp_path)
+        with open(temp_path, "rb") as f:
+            return f.read()
+    finally:
+        os.unlink(temp_path)
+
+
+async def streamed_ingest(file, decode):
+    upload = await read_upload(file)
+    content_key("extraction", upload.digest, "auto", "auto")
+    try:
+        if decode:
+            return cv2.imdecode(np.frombuffer(upload.source, dtype=np.uint8), cv2.IMREAD_COLOR)
+        return upload.source
+    finally:
+        upload.close()
+
+
+async def measure(fn, filename, data, decode, repeat):
+    files = [SpooledUploadFile(filename, data) for _ in range(repeat + 1)]
+    started = time.perf_counter()
+    for file in files[:repeat]:
+        await fn(file, decode)
+    elapsed_ms = (time.perf_counter() - started) / repeat * 1000
+    tracemalloc.start()
+    await fn(files[repeat], decode)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    for file in files:
+        file.close()
+    return elapsed_ms, peak / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("image", nargs="?", help="encoded image to ingest (default: random payloads)")
+    parser.add_argument("--sizes", default="2,5", help="payload sizes in MB when no image is given")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--no-decode", action="store_true")
+    args = parser.parse_args()
+
+    decode = cv2 is not None and not args.no_decode and args.image is not None
+    if args.image:
+        with open(args.image, "rb") as f:
+            inputs = [(os.path.basename(args.image), f.read())]
+    else:
+        inputs = [(f"photo-{mb}mb.jpg", os.urandom(int(float(mb) * 1024 * 1024))) for mb in args.sizes.split(",")]
+
+    print(f"{'upload':<24} {'legacy ms':>10} {'peak MB':>8} {'streamed ms':>12} {'peak MB':>8}"
+          f"   ({'with' if decode else 'without'} decoding)")
+    for filename, data in inputs:
+        legacy_ms, legacy_peak = asyncio.run(measure(legacy_ingest, filename, data, decode, args.repeat))
+        new_ms, new_peak = asyncio.run(measure(streamed_ingest, filename, data, decode, args.repeat))
+        print(f"{filename:<24} {legacy_ms:>10.2f} {legacy_peak:>8.1f} {new_ms:>12.2f} {new_peak:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
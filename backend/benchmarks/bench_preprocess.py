@@ -0,0 +1,130 @@
+"""Benchmark the preprocess_image quality profiles.
+
+For every profile this reports the mean milliseconds spent in each
+preprocessing stage, the EasyOCR time and the OCR accuracy (1 - character error
+rate) over a fixture set. Fixtures are image files with a .txt file of the same
+name holding the expected text; a "-<N>dpi" suffix in the name gives the source
+resolution, which is estimated otherwise. The default set, fixtures/scans, is a
+lab-report table as PDF render, clean, noisy and faded scans, fax, phone photo
+and low-resolution capture; --synthetic uses full pages drawn on the fly.
+
+    python benchmarks/bench_preprocess.py [fixture_dir | --synthetic] [--repeat N] [--no-ocr]
+"""
+import argparse
+import difflib
+import os
+import re
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ocr_engine import PREPROCESS_PROFILES, choose_profile, get_reader, preprocess_image
+
+SYNTHETIC_LINES = [
+    "COMPLETE BLOOD COUNT",
+    "Hemoglobin 13.5 g/dL 12.0 - 15.5",
+    "WBC Count 7200 /uL 4000 - 11000",
+    "Platelet Count 250000 /uL 150000 - 450000",
+    "Fasting Glucose 112 mg/dL 70 - 100 HIGH",
+    "HbA1c 6.1 % 4.0 - 5.6",
+    "Total Cholesterol 185 mg/dL < 200",
+]
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp')
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "scans")
+
+
+def render_page(dpi, noise, blur):
+    """Render the synthetic lines onto a page-sized canvas at the given DPI"""
+    scale = dpi / 300.0
+    width, height = int(8.5 * dpi), int(11 * dpi)
+    page = np.full((height, width, 3), 255, dtype=np.uint8)
+    y = int(150 * scale)
+    for line in SYNTHETIC_LINES:
+        cv2.putText(page, line, (int(120 * scale), y), cv2.FONT_HERSHEY_SIMPLEX,
+                    1.4 * scale, (20, 20, 20), max(1, int(3 * scale)), cv2.LINE_AA)
+        y += int(90 * scale)
+    if blur:
+        page = cv2.GaussianBlur(page, (blur, blur), 0)
+    if noise:
+        rng = np.random.default_rng(0)
+        page = np.clip(page + rng.normal(0, noise, page.shape), 0, 255).astype(np.uint8)
+    return page
+
+
+def synthetic_fixtures():
+    truth = " ".join(SYNTHETIC_LINES)
+    for dpi, noise, blur in [(300, 0, 0), (200, 8, 3), (120, 15, 3), (96, 25, 5)]:
+        yield f"synthetic-{dpi}dpi-noise{noise}", render_page(dpi, noise, blur), truth, dpi
+
+
+def directory_fixtures(path):
+    for name in sorted(os.listdir(path)):
+        stem, ext = os.path.splitext(name)
+        truth_path = os.path.join(path, stem + ".txt")
+        if ext.lower() not in IMAGE_EXTENSIONS or not os.path.exists(truth_path):
+            continue
+        img = cv2.imread(os.path.join(path, name))
+        if img is None:
+            continue
+        dpi = re.search(r'-(\d+)dpi$', stem)
+        with open(truth_path, encoding="utf-8") as f:
+            yield stem, img, f.read(), int(dpi.group(1)) if dpi else None
+
+
+def normalize(text):
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+def accuracy(expected, actual):
+    return difflib.SequenceMatcher(None, normalize(expected), normalize(actual)).ratio()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("fixture_dir", nargs="?", default=FIXTURE_DIR,
+                        help="directory of images with .txt ground truth")
+    parser.add_argument("--synthetic", action="store_true", help="use rendered synthetic pages")
+    parser.add_argument("--repeat", type=int, default=3, help="preprocessing runs per fixture")
+    parser.add_argument("--no-ocr", action="store_true", help="only time preprocessing")
+    args = parser.parse_args()
+
+    fixtures = list(synthetic_fixtures() if args.synthetic else directory_fixtures(args.fixture_dir))
+    if not fixtures:
+        sys.exit("No fixtures found")
+    reader = None if args.no_ocr else get_reader()
+
+    for name, img, _, dpi in fixtures:
+        print(f"{name}: {img.shape[1]}x{img.shape[0]}, auto profile -> {choose_profile(img, dpi)}")
+    print()
+
+    for profile in list(PREPROCESS_PROFILES) + ["auto"]:
+        stage_totals = {}
+        ocr_ms = 0.0
+        scores = []
+        for _, img, truth, dpi in fixtures:
+            for _ in range(args.repeat):
+                timings = {}
+                preprocessed = preprocess_image(img, profile, dpi=dpi, timings=timings)
+                for stage, ms in timings.items():
+                    stage_totals[stage] = stage_totals.get(stage, 0.0) + ms
+            if reader is not None:
+                started = time.perf_counter()
+                results = reader.readtext(preprocessed, paragraph=True)
+                ocr_ms += (time.perf_counter() - started) * 1000
+                scores.append(accuracy(truth, " ".join(r[1] for r in results)))
+
+        runs = len(fixtures) * args.repeat
+        stages = "  ".join(f"{stage}={ms / runs:.1f}" for stage, ms in stage_totals.items())
+        total = sum(stage_totals.values()) / runs
+        line = f"{profile:9s} preprocess={total:7.1f}ms  [{stages}]"
+        if reader is not None:
+            line += f"  ocr={ocr_ms / len(fixtures):7.1f}ms  accuracy={sum(scores) / len(scores):.3f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
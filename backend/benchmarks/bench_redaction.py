@@ -0,0 +1,104 @@
+"""Benchmark and adversarial regression check for redaction.redact.
+
+Reports throughput (MB/s) on synthetic OCR text for the single-pass engine
+and the previous seven-pass re.sub implementation, then runs inputs crafted
+to trigger catastrophic backtracking and fails (exit status 1) if the engine
+takes longer than the budget on any of them.
+
+    python benchmarks/bench_redaction.py [--mb N] [--budget SECONDS] [--legacy]
+
+--legacy also times the old implementation on the adversarial inputs, at a
+reduced size since it is quadratic on some of them.
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from redaction import redact
+
+OCR_PAGE = """COMPLETE BLOOD COUNT  Collected 12/03/2024  Ref. by Dr. Mehta
+Patient: John Doe  DOB: 04/12/1985  Phone: (555) 123-4567  Email: john.doe@example.com
+Address: 221 Baker Street, Apt 4B
+Hemoglobin 13.5 g/dL 12.0 - 15.5
+WBC Count 7200 /uL 4000 - 11000
+Platelet Count 250000 /uL 150000 - 450000
+Fasting Glucose 112 mg/dL 70 - 100 HIGH
+HbA1c 6.1 % 4.0 - 5.6
+Rx: Paracetamol 650 mg, take 1 tablet twice daily after food for 5 days.
+"""
+
+# name -> text of about `size` characters
+ADVERSARIAL = {
+    "email: dotted run": lambda size: "a." * (size // 2),
+    "email: repeated @": lambda size: "a@" * (size // 2),
+    "email: long local part": lambda size: "x" * size + "@",
+    "address: words without suffix": lambda size: "12 " + "word " * (size // 5),
+    "address: number/word pairs": lambda size: "1 a " * (size // 4),
+    "address: one long line": lambda size: "1 " + "a,b.c " * (size // 6),
+    "phone/ssn: digit run": lambda size: "1" * size,
+    "phone/ssn: separators": lambda size: "1-2.3 " * (size // 6),
+    "dob: label and spaces": lambda size: "DOB:" + " " * size,
+    "dob: repeated labels": lambda size: "Date of Birth: " * (size // 15),
+    "dob: label and blank lines": lambda size: "DOB:\n\n" * (size // 6),
+    "address: words over lines": lambda size: "12\n" + "word\n " * (size // 6),
+    "whitespace": lambda size: " \n\t" * (size // 3),
+}
+
+
+def legacy_redact(text):
+    """redact_personal_info before the single-pass engine"""
+    text = re.sub(r'\b(?:\+?1[-. ]?)?\(?([0-9]{3})\)?[-. ]?([0-9]{3})[-. ]?([0-9]{4})\b', '[PHONE REDACTED]', text)
+    text = re.sub(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b', '[EMAIL REDACTED]', text)
+    text = re.sub(r'\b\d{3}[-. ]?\d{2}[-. ]?\d{4}\b', '[SSN REDACTED]', text)
+    text = re.sub(r'\b(?:DOB|Date of Birth|Birth Date)[:;]\s*\d{1,2}[-/]\d{1,2}[-/]\d{2,4}\b', '[DOB REDACTED]', text)
+    text = re.sub(r'\b(?:DOB|Date of Birth|Birth Date)[:;]\s*\w+ \d{1,2},? \d{4}\b', '[DOB REDACTED]', text)
+    text = re.sub(r'\b\d{1,5}\s+[A-Za-z0-9\s,.]+(?:Avenue|Ave|Boulevard|Blvd|Street|St|Road|Rd|Lane|Ln|Drive|Dr|Court|Ct|Place|Pl|Terrace|Ter)(?:\s+[A-Za-z0-9\s,.]*)?\b', '[ADDRESS REDACTED]', text, flags=re.IGNORECASE)
+    return text
+
+
+def seconds(fn, text):
+    started = time.perf_counter()
+    fn(text)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mb", type=float, default=2.0, help="size of the throughput corpus")
+    parser.add_argument("--size", type=int, default=200_000, help="characters per adversarial input")
+    parser.add_argument("--budget", type=float, default=1.0, help="max seconds per adversarial input")
+    parser.add_argument("--legacy", action="store_true", help="also time the old implementation")
+    args = parser.parse_args()
+
+    corpus = OCR_PAGE * max(1, int(args.mb * 1e6 / len(OCR_PAGE)))
+    mb = len(corpus) / 1e6
+    result = redact(corpus)
+    print(f"throughput over {mb:.1f} MB of OCR text ({sum(result.counts.values())} redactions)")
+    print(f"  single pass  {mb / seconds(redact, corpus):6.1f} MB/s")
+    print(f"  legacy       {mb / seconds(legacy_redact, corpus):6.1f} MB/s")
+
+    print(f"\nadversarial inputs ({args.size} chars, budget {args.budget:.2f}s)")
+    failed = []
+    for name, make in ADVERSARIAL.items():
+        elapsed = seconds(redact, make(args.size))
+        line = f"  {name:<32} {elapsed * 1000:8.1f} ms"
+        if args.legacy:
+            # Quadratic cases make the old code unusable at full size
+            small = make(args.size // 10)
+            line += f"   legacy at {args.size // 10} chars: {seconds(legacy_redact, small) * 1000:8.1f} ms"
+        if elapsed > args.budget:
+            failed.append(name)
+            line += "   OVER BUDGET"
+        print(line)
+
+    if failed:
+        print(f"\n{len(failed)} adversarial input(s) over budget: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Benchmark DrugSearchIndex queries on a synthetic catalogue.
+
+Builds an index of --drugs generated drug documents (brand names, strengths,
+dosage forms and a few description words, so common tokens like "tablet" hit
+most of the catalogue) and reports the build time and microseconds per query
+for typeahead prefixes, full words and broad queries.
+
+    python benchmarks/bench_search.py [--drugs N] [--repeat N]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from drug_search import DrugSearchIndex
+
+SYLLABLES = ["ab", "ce", "dol", "fen", "gli", "lo", "met", "ox", "pan", "ra", "sar", "tin", "vi", "zol"]
+STRENGTHS = ["5mg", "10mg", "20mg", "250mg", "500mg", "650mg", "1g"]
+FORMS = ["Tablet", "Capsule", "Syrup", "Injection", "Cream"]
+WORDS = ["used", "to", "treat", "pain", "fever", "infection", "blood", "pressure", "diabetes"]
+
+QUERIES = {
+    "prefix, rare": "dolo",
+    "prefix, one letter": "p",
+    "word + prefix": "tablet 5",
+    "broad word": "tablet ",
+    "two broad words": "used treat ",
+}
+
+
+def make_catalogue(size, seed=1):
+    rng = random.Random(seed)
+    docs = []
+    for i in range(size):
+        name = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+        docs.append({
+            "_id": i,
+            "title": f"{name} {rng.choice(STRENGTHS)} {rng.choice(FORMS)}",
+            "meta": f"Prescription {rng.choice(FORMS)}",
+            "desc": " ".join(rng.choice(WORDS) for _ in range(12)),
+        })
+    return docs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--drugs", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    docs = make_catalogue(args.drugs)
+    started = time.perf_counter()
+    index = DrugSearchIndex(docs)
+    print(f"index of {len(index)} drugs built in {time.perf_counter() - started:.2f}s\n")
+
+    print(f"{'query':<20} {'matches':>8} {'page 1 us':>10} {'page 50 us':>11}")
+    for name, query in QUERIES.items():
+        timings = []
+        for offset in (0, 49 * 20):
+            started = time.perf_counter()
+            for _ in range(args.repeat):
+                _, total = index.search(query, limit=20, offset=offset)
+            timings.append((time.perf_counter() - started) / args.repeat * 1e6)
+        print(f"{name:<20} {total:>8} {timings[0]:>10.0f} {timings[1]:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
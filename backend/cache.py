@@ -0,0 +1,157 @@
+"""Content-addressed cache for extraction and analysis results.
+
+Entries live in an in-memory LRU tier with a TTL and, when a directory is
+configured, in an on-disk tier of JSON files that survives restarts and can be
+shared by several workers on the same host. get/set touch the disk synchronously;
+async code uses aget/aset, which do the file I/O in the default executor.
+Nothing that can hold personal data unredacted belongs in a cache with a disk tier.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Union
+
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", 256))
+RESULT_CACHE_TTL = float(os.environ.get("RESULT_CACHE_TTL", 7 * 24 * 3600))
+# Leave unset to keep the cache in memory only
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", "")
+
+
+def content_key(*parts: Union[bytes, str]) -> str:
+    """SHA-256 over the given parts, length-prefixed so parts can't run together"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """LRU + TTL cache of JSON-serializable values with an optional disk tier"""
+
+    def __init__(self, max_entries: int = RESULT_CACHE_SIZE, ttl: float = RESULT_CACHE_TTL,
+                 disk_dir: Optional[str] = RESULT_CACHE_DIR or None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+
+        entry = self._read_disk(key, now)
+        if entry is not None:
+            # Promote disk hits into the memory tier
+            self._store(key, *entry)
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        return None
+
+    def set(self, key: str, value: Any):
+        expires_at = time.time() + self.ttl
+        self._store(key, expires_at, value)
+        self._write_disk(key, expires_at, value)
+
+    async def aget(self, key: str) -> Optional[Any]:
+        """get() for the event loop: memory tier inline, disk tier in the executor"""
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self._entries[key]
+
+        if self.disk_dir:
+            entry = await asyncio.to_thread(self._read_disk, key, now)
+            if entry is not None:
+                self._store(key, *entry)
+                self.hits += 1
+                return entry[1]
+
+        self.misses += 1
+        return None
+
+    async def aset(self, key: str, value: Any):
+        """set() for the event loop: the disk write runs in the executor"""
+        expires_at = time.time() + self.ttl
+        self._store(key, expires_at, value)
+        if self.disk_dir:
+            await asyncio.to_thread(self._write_disk, key, expires_at, value)
+
+    def delete(self, key: str):
+        self._entries.pop(key, None)
+        if self.disk_dir:
+            try:
+                os.unlink(self._disk_path(key))
+            except OSError:
+                pass
+
+    def clear(self):
+        self._entries.clear()
+
+    def _store(self, key: str, expires_at: float, value: Any):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _disk_path(self, key: str) -> str:
+        # Fan out into subdirectories so no single directory gets huge
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _read_disk(self, key: str, now: float):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("expires_at", 0) <= now:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            return None
+        return entry["expires_at"], entry["value"]
+
+    def _write_disk(self, key: str, expires_at: float, value: Any):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temp file and rename so readers never see a partial entry
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"expires_at": expires_at, "value": value}, f)
+            os.replace(temp_path, path)
+        except (OSError, TypeError, ValueError):
+            # The disk tier is best effort; the memory tier still has the entry
+            pass
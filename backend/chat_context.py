@@ -0,0 +1,127 @@
+"""Token-budgeted prompt construction for document chats.
+
+Short chats are sent whole. Once a chat no longer fits CHAT_CONTEXT_TOKENS, the
+prompt becomes: system prompt, one context note (document reminder, cached
+structured-data summary and a rolling summary of older turns), as many recent
+turns as fit, and the new question. Turns that fall out of the window are folded
+into the rolling summary once, so prompt size stays flat as the chat grows.
+"""
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+CHAT_CONTEXT_TOKENS = int(os.environ.get("CHAT_CONTEXT_TOKENS", 6000))
+# Upper bound for the rolling summary of older turns
+CHAT_SUMMARY_TOKENS = int(os.environ.get("CHAT_SUMMARY_TOKENS", 600))
+# Upper bound for the structured-data summary kept in the context note
+CHAT_STRUCTURED_TOKENS = int(os.environ.get("CHAT_STRUCTURED_TOKENS", 1500))
+# Most recent messages read from the session store for each turn
+CHAT_HISTORY_WINDOW = int(os.environ.get("CHAT_HISTORY_WINDOW", 24))
+MESSAGE_OVERHEAD_TOKENS = 4
+CONDENSED_TURN_CHARS = 160
+
+CONTEXT_ACK = "I'll continue assisting you with this medical document, keeping in mind the extracted information and our previous discussion."
+
+# Least useful fields first: dropped in this order when the summary is too long
+STRUCTURED_DROP_ORDER = [
+    "report_tags", "doctor_questions", "lifestyle_recommendations",
+    "follow_up_tests", "recommended_supplements", "general_instructions"
+]
+
+
+def count_tokens(text: str) -> int:
+    """Cheap token estimate (about four characters per token for English text)"""
+    return (len(text) + 3) // 4
+
+
+def message_tokens(message: Dict[str, str]) -> int:
+    return count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+
+def summarize_structured_data(structured_data: Dict[str, Any],
+                              max_tokens: int = CHAT_STRUCTURED_TOKENS) -> str:
+    """Compact JSON of the structured data, dropping minor fields to fit max_tokens"""
+    data = dict(structured_data)
+    summary = json.dumps(data, separators=(",", ":"))
+    for field in STRUCTURED_DROP_ORDER:
+        if count_tokens(summary) <= max_tokens:
+            break
+        if data.pop(field, None) is not None:
+            summary = json.dumps(data, separators=(",", ":"))
+    return summary
+
+
+def condense_message(message: Dict[str, str]) -> str:
+    """One short line standing in for a whole message in the rolling summary"""
+    content = message["content"].replace("Question about the medical document: ", "", 1)
+    content = " ".join(content.split())
+    end = content.find(". ")
+    if 0 < end < CONDENSED_TURN_CHARS:
+        content = content[:end + 1]
+    elif len(content) > CONDENSED_TURN_CHARS:
+        content = content[:CONDENSED_TURN_CHARS].rstrip() + "..."
+    role = "User" if message["role"] == "user" else "Assistant"
+    return f"- {role}: {content}"
+
+
+def extend_summary(summary: str, messages: List[Dict[str, str]],
+                   max_tokens: int = CHAT_SUMMARY_TOKENS) -> str:
+    """Append condensed messages to the rolling summary, forgetting the oldest lines"""
+    lines = summary.splitlines() if summary else []
+    lines.extend(condense_message(m) for m in messages)
+    while lines and count_tokens("\n".join(lines)) > max_tokens:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+def build_chat_messages(system_prompt: str, context_note: str, history: List[Dict[str, str]],
+                        message_count: int, history_summary: str, summarized_count: int,
+                        new_message: Dict[str, str],
+                        budget: int = CHAT_CONTEXT_TOKENS) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
+    """Pack a chat turn into the token budget.
+
+    history is the tail of the stored conversation and message_count its full
+    length. Returns the messages to send and the session fields to update when
+    turns were newly folded into the rolling summary (otherwise an empty dict).
+    """
+    first_index = message_count - len(history)
+    indexed = [(first_index + i, m) for i, m in enumerate(history) if m["role"] != "system"]
+    system = {"role": "system", "content": system_prompt}
+    fixed = message_tokens(system) + message_tokens(new_message)
+
+    # The whole chat fits: send it unchanged
+    if first_index == 0 and fixed + sum(message_tokens(m) for _, m in indexed) <= budget:
+        return [system] + [m for _, m in indexed] + [new_message], {}
+
+    # Otherwise keep the newest turns that fit next to the context note, reserving
+    # room for the rolling summary at its maximum size
+    remaining = (budget - fixed - count_tokens(context_note) - CHAT_SUMMARY_TOKENS
+                 - count_tokens(CONTEXT_ACK) - 2 * MESSAGE_OVERHEAD_TOKENS)
+    packed = []
+    for index, message in reversed(indexed[-(CHAT_HISTORY_WINDOW - 2):]):
+        cost = message_tokens(message)
+        if cost > remaining:
+            break
+        packed.append((index, message))
+        remaining -= cost
+    packed.reverse()
+
+    # Turns that just left the window are summarized once
+    updates = {}
+    oldest_packed = packed[0][0] if packed else message_count
+    dropped = [m for index, m in indexed if summarized_count <= index < oldest_packed]
+    if dropped:
+        history_summary = extend_summary(history_summary, dropped)
+        updates = {"history_summary": history_summary, "summarized_count": oldest_packed}
+
+    note = context_note
+    if history_summary:
+        note += f"\n\nEarlier in this conversation:\n{history_summary}"
+    messages = [
+        system,
+        {"role": "user", "content": note},
+        {"role": "assistant", "content": CONTEXT_ACK},
+    ]
+    messages.extend(m for _, m in packed)
+    messages.append(new_message)
+    return messages, updates
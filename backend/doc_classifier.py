@@ -0,0 +1,149 @@
+"""Single-pass keyword classifier for medical documents.
+
+The lowercased text is tokenized once into its set of distinct words (one C
+level findall), and every keyword is then a set lookup, so the cost no longer
+grows with the number of keywords and matching is by whole word: "rx" is not
+found in "proxy", while "500mg" still yields the unit "mg". Phrases are
+confirmed with a compiled search only when all their words occur, and the
+structural patterns (dosage instructions, reference ranges) only when their
+trigger word occurs; searches stop at the first hit. Each keyword counts once,
+with a configurable weight. The result is the winning type with a confidence,
+or "mixed" when a document is strongly both (for example a discharge summary
+with results and a prescription). benchmarks/bench_classifier.py measures
+accuracy and speed over a labeled corpus.
+"""
+import json
+import os
+import re
+from typing import Dict, FrozenSet, List, NamedTuple, Optional
+
+# JSON file overriding keyword weights per type: {"prescription": {"rx": 3}, ...}
+DOC_CLASSIFIER_WEIGHTS = os.environ.get("DOC_CLASSIFIER_WEIGHTS", "")
+# Both types must reach this score, and the weaker at least MIXED_RATIO of the stronger
+MIXED_MIN_SCORE = 6
+MIXED_RATIO = 0.6
+
+KEYWORD_WEIGHTS = {
+    "prescription": {
+        "prescription": 2, "rx": 2, "prescribed": 2, "dosage": 2, "pharmacy": 2,
+        "take": 1, "medicine": 1, "medication": 1, "refill": 1, "tablet": 1, "tablets": 1,
+        "capsule": 1, "capsules": 1, "oral": 1, "topical": 1, "once daily": 1, "twice daily": 1,
+        "three times daily": 1, "physician": 1, "dr": 1, "doctor": 1, "dispense": 1, "substitution": 1,
+        "mg": 1, "mcg": 1, "ml": 1,
+    },
+    "lab_report": {
+        "laboratory": 2, "lab report": 2, "test results": 2, "reference range": 3, "reference interval": 3,
+        "specimen": 1, "blood test": 1, "urine test": 1, "cholesterol": 1, "glucose": 1, "wbc": 1,
+        "rbc": 1, "hgb": 1, "hemoglobin": 1, "haemoglobin": 1, "hba1c": 1, "creatinine": 1,
+        "normal range": 1, "reference": 1, "panel": 1, "hematology": 1, "haematology": 1,
+        "chemistry": 1, "lipid": 1, "thyroid": 1, "abnormal": 1, "elevated": 1,
+        "complete blood count": 1, "metabolic panel": 1,
+    },
+}
+
+# Words start with a letter and may contain digits: "hba1c" stays whole and
+# "500mg" yields "mg"
+_TOKEN = re.compile(r"[a-z][a-z0-9]*")
+
+
+class Pattern(NamedTuple):
+    doc_type: str
+    weight: float
+    regex: str
+    # Only searched when one of these words occurs (empty: always)
+    requires: FrozenSet[str] = frozenset()
+
+
+# Each regex starts with a literal or a digit and checks the word boundary just
+# after it, which lets the search skip ahead quickly; a leading lookbehind would
+# make it try every position.
+PATTERN_WEIGHTS = {
+    # "take 1 tablet"
+    "dose_instruction": Pattern("prescription", 3, r"take(?<![a-z0-9]take)\s{1,3}\d{1,2}\s{1,3}(?:tablet|tab|capsule|cap)s?\b",
+                                frozenset({"take"})),
+    # "3 times a day"
+    "times_daily": Pattern("prescription", 3, r"\d(?<![a-z0-9.]\d)\d?\s{1,3}times?\s{1,3}(?:a\s{1,3})?(?:daily|day)\b",
+                           frozenset({"time", "times"})),
+    # "12.0 - 15.5 g/dL", "(70 - 100)", but not part of an id or date ("HX-29-88231")
+    "value_range": Pattern("lab_report", 3, r"\d(?<![a-z0-9./-]\d)\d{0,5}(?:\.\d{1,4})?\s{0,3}[-–]\s{0,3}\d{1,6}(?:\.\d{1,4})?"
+                                            r"(?:\s{0,3}[a-z/%µ]|\))"),
+}
+
+
+def _phrase_regex(phrase: str):
+    first, *rest = map(re.escape, phrase.split())
+    return re.compile(rf"{first}(?<![a-z0-9]{first})" + "".join(rf"\s+{word}" for word in rest) + r"(?![a-z0-9])")
+
+
+class Classification(NamedTuple):
+    doc_type: str
+    confidence: float
+    scores: Dict[str, float]
+    # Distinct keywords and patterns that contributed, per document type
+    matched: Dict[str, List[str]]
+
+
+class DocumentClassifier:
+    """Keyword/pattern scorer over the set of words in a document"""
+
+    def __init__(self, keyword_weights: Optional[Dict[str, Dict[str, float]]] = None,
+                 pattern_weights: Optional[Dict[str, Pattern]] = None):
+        self.keyword_weights = keyword_weights or KEYWORD_WEIGHTS
+        self.pattern_weights = pattern_weights or PATTERN_WEIGHTS
+        self.types = list(self.keyword_weights)
+        self._weights = {}  # keyword or pattern name -> [(type, weight)]
+        for doc_type, keywords in self.keyword_weights.items():
+            for keyword, weight in keywords.items():
+                self._weights.setdefault(" ".join(_TOKEN.findall(keyword.lower())), []).append((doc_type, weight))
+        self._words = [k for k in self._weights if " " not in k]
+        # phrase -> (its words, whole-phrase regex allowing any whitespace between words)
+        self._phrases = {k: (frozenset(k.split()), _phrase_regex(k)) for k in self._weights if " " in k}
+        self._patterns = {}  # name -> (required words, compiled regex)
+        for name, pattern in self.pattern_weights.items():
+            pattern = Pattern(*pattern)
+            self._weights.setdefault(name, []).append((pattern.doc_type, pattern.weight))
+            self._patterns[name] = (pattern.requires, re.compile(pattern.regex))
+
+    @classmethod
+    def from_config(cls, path: str = DOC_CLASSIFIER_WEIGHTS) -> "DocumentClassifier":
+        """Default weights, overridden by the JSON file at path (if any)"""
+        if not path:
+            return cls()
+        with open(path, encoding="utf-8") as f:
+            overrides = json.load(f)
+        weights = {doc_type: dict(keywords) for doc_type, keywords in KEYWORD_WEIGHTS.items()}
+        for doc_type, keywords in overrides.items():
+            weights.setdefault(doc_type, {}).update(keywords)
+        return cls(weights)
+
+    def classify(self, text: str) -> Classification:
+        lowered = text.lower()
+        present = set(_TOKEN.findall(lowered))
+        found = [word for word in self._words if word in present]
+        for phrase, (words, regex) in self._phrases.items():
+            if words <= present and regex.search(lowered):
+                found.append(phrase)
+        for name, (requires, regex) in self._patterns.items():
+            if (not requires or not requires.isdisjoint(present)) and regex.search(lowered):
+                found.append(name)
+
+        scores = dict.fromkeys(self.types, 0.0)
+        matched = {doc_type: [] for doc_type in self.types}
+        for key in found:
+            for doc_type, weight in self._weights[key]:
+                scores[doc_type] += weight
+                matched[doc_type].append(key)
+        return Classification(*self._decide(scores), scores, matched)
+
+    def _decide(self, scores: Dict[str, float]):
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        (best, top), (_, second) = ranked[0], ranked[1] if len(ranked) > 1 else (None, 0.0)
+        total = sum(scores.values())
+        if top == 0 or top == second and top < MIXED_MIN_SCORE:
+            return "unknown", 0.0
+        if second >= MIXED_MIN_SCORE and second >= MIXED_RATIO * top:
+            # Confident it is mixed when both types are about equally strong
+            return "mixed", round(second / top, 3)
+        # Margin over the runner-up, damped for documents with little evidence
+        confidence = (top - second) / total * min(1.0, top / MIXED_MIN_SCORE)
+        return best, round(confidence, 3)
@@ -0,0 +1,170 @@
+"""Read-through cache for drug documents and /drugs result pages.
+
+Popular drugs are fetched over and over by the pharmacy and prescription
+screens. Documents are cached by id and result pages by their request
+parameters, both in size-bounded LRU tiers with a TTL.
+
+The scraper runs in another process, so its MongoDBPipeline announces every
+drug it writes in the DrugChanges collection. Each entry carries the catalogue
+version its write bumped in Meta with $inc as ``seq``: MongoDB hands the
+numbers out, so they have no gaps and don't depend on the clocks of the
+scraper processes. The backend polls that feed in seq order and evicts
+exactly the changed documents. A missing seq is an entry another process is
+still writing; later entries are applied, but the feed only resumes past the
+gap once it is filled or CHANGES_GAP_TIMEOUT has passed. Result pages are
+keyed by catalogue version and are also dropped as soon as a change arrives.
+
+The caches are only touched from the event loop; misses query MongoDB in the
+default executor.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from cache import ResultCache, content_key
+from drug_catalog import parse_id
+
+DRUG_CACHE_SIZE = int(os.environ.get("DRUG_CACHE_SIZE", 2048))
+DRUG_CACHE_TTL = float(os.environ.get("DRUG_CACHE_TTL", 600))
+DRUG_PAGE_CACHE_SIZE = int(os.environ.get("DRUG_PAGE_CACHE_SIZE", 512))
+DRUG_PAGE_CACHE_TTL = float(os.environ.get("DRUG_PAGE_CACHE_TTL", 120))
+# How often the change feed is polled, and how long MongoDB keeps its entries
+DRUG_CHANGES_POLL = float(os.environ.get("DRUG_CHANGES_POLL", 2))
+DRUG_CHANGES_TTL = 24 * 3600
+# Feed entries read per poll (each lists the drugs of one scraper write)
+CHANGES_BATCH = 100
+# Seconds a missing seq is waited for before the feed moves on without it
+CHANGES_GAP_TIMEOUT = float(os.environ.get("CHANGES_GAP_TIMEOUT", 60))
+
+logger = logging.getLogger(__name__)
+
+
+def project(document: Dict[str, Any], projection: Optional[Dict[str, int]]) -> Dict[str, Any]:
+    """Apply an inclusion projection to a cached document"""
+    if projection is None:
+        return dict(document)
+    return {k: v for k, v in document.items() if k == "_id" or k in projection}
+
+
+class DrugCache:
+    """LRU + TTL read-through cache in front of the Drugs collection"""
+
+    def __init__(self, collection, changes_collection,
+                 max_documents: int = DRUG_CACHE_SIZE, ttl: float = DRUG_CACHE_TTL,
+                 max_pages: int = DRUG_PAGE_CACHE_SIZE, page_ttl: float = DRUG_PAGE_CACHE_TTL):
+        self.collection = collection
+        self.changes = changes_collection
+        self.documents = ResultCache(max_entries=max_documents, ttl=ttl, disk_dir=None)
+        self.pages = ResultCache(max_entries=max_pages, ttl=page_ttl, disk_dir=None)
+        self.invalidations = 0
+        # Lowest seq not applied yet, the seqs above it already applied, and
+        # since when the feed has been waiting for the missing one
+        self._next_seq = None
+        self._applied = set()
+        self._gap_since = None
+        # Bumped by every invalidation, so a query that raced one doesn't
+        # cache what it read
+        self._generation = 0
+
+    def ensure_indexes(self):
+        self.changes.create_index("at", expireAfterSeconds=DRUG_CHANGES_TTL)
+        self.changes.create_index("seq")
+
+    async def get_document(self, drug_id: str) -> Optional[Dict[str, Any]]:
+        key = str(drug_id)
+        document = self.documents.get(key)
+        if document is None:
+            generation = self._generation
+            document = await asyncio.to_thread(self.collection.find_one, {"_id": parse_id(key)})
+            if document is not None and generation == self._generation:
+                self.documents.set(key, document)
+        return document
+
+    async def get_documents(self, ids: Iterable[Any]) -> Dict[str, Dict[str, Any]]:
+        """Documents by str(id); everything not cached is fetched with one $in query"""
+        found, missing = {}, []
+        for drug_id in ids:
+            key = str(drug_id)
+            document = self.documents.get(key)
+            if document is None:
+                missing.append(drug_id)
+            else:
+                found[key] = document
+        if missing:
+            generation = self._generation
+            documents = await asyncio.to_thread(
+                lambda: list(self.collection.find({"_id": {"$in": missing}})))
+            for document in documents:
+                key = str(document["_id"])
+                if generation == self._generation:
+                    self.documents.set(key, document)
+                found[key] = document
+        return found
+
+    @staticmethod
+    def page_key(version: int, params: Dict[str, Any]) -> str:
+        return content_key("drugs-page", str(version), json.dumps(params, sort_keys=True))
+
+    def invalidate(self, drug_ids: Iterable[Any]):
+        """Drop the given drugs, and every cached page since any of them may be listed"""
+        self._generation += 1
+        for drug_id in drug_ids:
+            self.documents.delete(str(drug_id))
+            self.invalidations += 1
+        self.pages.clear()
+
+    def fetch_changes(self) -> List[Any]:
+        """Ids of drugs announced in the change feed since the last call (blocking)"""
+        if self._next_seq is None:
+            # Nothing is cached yet, so only remember where the feed currently ends
+            latest = self.changes.find_one({"seq": {"$exists": True}}, sort=[("seq", -1)])
+            self._next_seq = latest["seq"] + 1 if latest else 1
+            return []
+        changed = []
+        for change in self.changes.find({"seq": {"$gte": self._next_seq}}).sort("seq", 1).limit(CHANGES_BATCH):
+            if change["seq"] not in self._applied:
+                self._applied.add(change["seq"])
+                changed.extend(change["drug_ids"])
+        self._advance(time.monotonic())
+        return changed
+
+    def _advance(self, now: float):
+        """Move the resume point past the applied seqs, waiting a while at gaps"""
+        while self._applied:
+            if self._next_seq in self._applied:
+                self._applied.discard(self._next_seq)
+            elif self._gap_since is None:
+                self._gap_since = now
+                return
+            elif now - self._gap_since < CHANGES_GAP_TIMEOUT:
+                return
+            else:
+                logger.warning("Drug change %d never arrived, moving on", self._next_seq)
+            self._next_seq += 1
+            self._gap_since = None
+
+    async def run(self, interval: float = DRUG_CHANGES_POLL):
+        """Poll the change feed every interval seconds and evict what changed"""
+        while True:
+            try:
+                # Query in a thread, but touch the caches only from the event loop
+                changed = await asyncio.to_thread(self.fetch_changes)
+                if changed:
+                    self.invalidate(changed)
+            except Exception:
+                logger.exception("Polling drug changes failed")
+            await asyncio.sleep(interval)
+
+    def stats(self) -> Dict[str, Any]:
+        def tier(cache):
+            lookups = cache.hits + cache.misses
+            return {
+                "entries": len(cache),
+                "hits": cache.hits,
+                "misses": cache.misses,
+                "hit_rate": round(cache.hits / lookups, 3) if lookups else None,
+            }
+        return {"documents": tier(self.documents), "pages": tier(self.pages), "invalidations": self.invalidations}
@@ -0,0 +1,133 @@
+"""Paging and counting helpers for the drug catalogue.
+
+Listings are paged with an opaque cursor instead of skip(): the cursor encodes
+the (title, _id) of the last drug on the page, so the next page is an index
+range scan that costs the same on page 500 as on page 1. Ranked search results
+come from the in-process index, where a cursor simply carries the offset.
+
+Counts are cached per query and catalogue version. The scraper bumps the
+version in the Meta collection whenever it writes drugs, which invalidates
+every cached count at once. Cache lookups happen on the event loop; MongoDB
+is queried in the default executor.
+"""
+import asyncio
+import base64
+import binascii
+import json
+import os
+import time
+from typing import Any, Dict, Optional
+
+from cache import ResultCache, content_key
+
+CATALOG_META_ID = "drugs"
+# How long a read of the catalogue version is trusted before asking MongoDB again
+CATALOG_VERSION_TTL = float(os.environ.get("CATALOG_VERSION_TTL", 5))
+DRUG_COUNT_CACHE_SIZE = int(os.environ.get("DRUG_COUNT_CACHE_SIZE", 1024))
+COUNT_MODES = ("exact", "estimate", "none")
+DRUG_FIELDS = ("link", "title", "price", "meta", "desc", "detail", "sideEffect")
+# What drug list views render; the long text fields come from the id lookup
+SUMMARY_FIELDS = ("title", "price", "meta", "link")
+
+
+class InvalidCursor(ValueError):
+    """Raised for cursors that were not produced by this API"""
+
+
+def encode_cursor(position: Dict[str, Any]) -> str:
+    payload = json.dumps(position, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).rstrip(b"=").decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        position = json.loads(payload)
+    except (binascii.Error, ValueError):
+        raise InvalidCursor("Malformed cursor")
+    if not isinstance(position, dict) or not isinstance(position.get("o", 0), int):
+        raise InvalidCursor("Malformed cursor")
+    return position
+
+
+def keyset_cursor(drug: Dict[str, Any]) -> str:
+    """Cursor pointing just after this drug in (title, _id) order"""
+    return encode_cursor({"t": drug.get("title", ""), "i": str(drug["_id"])})
+
+
+def keyset_filter(position: Dict[str, Any]) -> Dict[str, Any]:
+    """Query for the drugs that sort after a keyset cursor position"""
+    if "t" not in position or "i" not in position:
+        raise InvalidCursor("Cursor does not belong to this listing")
+    title, last_id = position["t"], parse_id(position["i"])
+    return {"$or": [
+        {"title": {"$gt": title}},
+        {"title": title, "_id": {"$gt": last_id}},
+    ]}
+
+
+def drug_projection(mode: str, fields: str) -> Optional[Dict[str, int]]:
+    """MongoDB projection for a listing (None for whole documents).
+
+    fields is a comma-separated subset of DRUG_FIELDS and wins over mode.
+    The title is always included because keyset cursors are built from it.
+    """
+    if fields:
+        selected = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in selected if f not in DRUG_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown drug fields: {', '.join(unknown)}")
+    elif mode == "summary":
+        selected = SUMMARY_FIELDS
+    else:
+        return None
+    projection = {field: 1 for field in selected}
+    projection["title"] = 1
+    return projection
+
+
+def parse_id(value: str):
+    """Drug ids are ObjectIds when inserted by the scraper, plain strings otherwise"""
+    from bson import ObjectId
+    return ObjectId(value) if ObjectId.is_valid(value) else value
+
+
+class CatalogCounts:
+    """Catalogue version tracking and per-query count cache"""
+
+    def __init__(self, collection, meta_collection, cache_size: int = DRUG_COUNT_CACHE_SIZE,
+                 version_ttl: float = CATALOG_VERSION_TTL):
+        self.collection = collection
+        self.meta = meta_collection
+        self.version_ttl = version_ttl
+        self._counts = ResultCache(max_entries=cache_size, disk_dir=None)
+        self._version = None
+        self._version_checked = 0.0
+
+    def ensure_indexes(self):
+        # Keyset pages are range scans over this index
+        self.collection.create_index([("title", 1), ("_id", 1)])
+
+    async def version(self) -> int:
+        """Current catalogue version (re-read at most every version_ttl seconds)"""
+        now = time.monotonic()
+        if self._version is None or now - self._version_checked >= self.version_ttl:
+            meta = await asyncio.to_thread(self.meta.find_one, {"_id": CATALOG_META_ID}) or {}
+            self._version = meta.get("version", 0)
+            self._version_checked = now
+        return self._version
+
+    async def count(self, query: Dict[str, Any], mode: str = "exact") -> Optional[int]:
+        """Number of drugs matching query: cached exact, estimated, or None"""
+        if mode == "none":
+            return None
+        if mode == "estimate" and not query:
+            # Collection metadata only, no scan
+            return await asyncio.to_thread(self.collection.estimated_document_count)
+        key = content_key("count", str(await self.version()), json.dumps(query, sort_keys=True, default=str))
+        total = self._counts.get(key)
+        if total is None:
+            total = await asyncio.to_thread(self.collection.count_documents, query)
+            self._counts.set(key, total)
+        return total
+
@@ -0,0 +1,293 @@
+"""Full-text search over the drug catalogue.
+
+The catalogue is loaded once into an in-process inverted index (compact integer
+posting arrays per field). A background task checks the catalogue version the
+scraper bumps in the Meta collection and rebuilds the index only when it has
+moved, since a rebuild holds the GIL for the whole build. Queries are
+tokenized the same way as the documents; the last query token also matches as
+a prefix so the index serves typeahead. Results are ranked by field-weighted
+IDF with boosts for exact and prefix title matches.
+
+Documents also carry a normalized ``title_norm`` field, written by the scraper
+and indexed here, used for anchored prefix queries while the in-process index
+is still loading.
+"""
+import asyncio
+import bisect
+import difflib
+import heapq
+import logging
+import math
+import os
+import re
+import time
+import unicodedata
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from drug_catalog import CATALOG_META_ID
+
+# Seconds between checks of the catalogue version; the index is rebuilt only when it moved
+DRUG_INDEX_REFRESH = float(os.environ.get("DRUG_INDEX_REFRESH", 60))
+# Relative importance of a query token found in each field
+FIELD_WEIGHTS = {"title": 3.0, "meta": 1.5, "desc": 0.5}
+# Only the start of the long description is indexed, to bound memory
+DESC_INDEX_TOKENS = 64
+# How many vocabulary terms a typeahead prefix may expand to
+MAX_PREFIX_EXPANSIONS = 64
+PREFIX_MATCH_FACTOR = 0.8
+EXACT_TITLE_BOOST = 10.0
+PREFIX_TITLE_BOOST = 5.0
+# Fuzzy name matching: candidates re-scored per name, and the score a best match needs
+MATCH_CANDIDATES = 20
+MATCH_MIN_SCORE = 0.5
+
+logger = logging.getLogger(__name__)
+
+_NON_ALNUM = re.compile(r'[^a-z0-9]+')
+
+
+def normalize(text: str) -> str:
+    """Lowercase, strip accents and collapse punctuation/whitespace to single spaces"""
+    text = unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode("ascii")
+    return _NON_ALNUM.sub(" ", text.lower()).strip()
+
+
+def tokenize(text: str) -> List[str]:
+    return normalize(text).split()
+
+
+def top_positions(scores: Dict[int, float], n: int) -> List[int]:
+    """The n best-scoring positions, ties in title (position) order.
+
+    Same order as nlargest with a (score, -position) key, without a key call
+    per candidate: the n-th best score is found among the bare floats, the
+    (fewer than n) positions above it are sorted, and the rest of the page is
+    the lowest positions scoring exactly the cut-off.
+    """
+    if n <= 0 or not scores:
+        return []
+    cutoff = heapq.nlargest(n, scores.values())[-1]
+    above, tied = [], []
+    for position, score in scores.items():
+        if score > cutoff:
+            above.append(position)
+        elif score == cutoff:
+            tied.append(position)
+    above.sort(key=lambda position: (-scores[position], position))
+    return above + heapq.nsmallest(n - len(above), tied)
+
+
+class DrugSearchIndex:
+    """Immutable inverted index over drug title, meta and description.
+
+    Documents are numbered in normalized-title order, so position order doubles
+    as the alphabetical tie-break and title prefixes map to contiguous ranges.
+    """
+
+    def __init__(self, docs: Iterable[Dict[str, Any]]):
+        entries = sorted(((normalize(doc.get("title", "")), doc) for doc in docs),
+                         key=lambda entry: entry[0])
+        self._ids = [doc["_id"] for _, doc in entries]
+        self._titles = [title for title, _ in entries]
+        postings = {field: {} for field in FIELD_WEIGHTS}
+        for position, (_, doc) in enumerate(entries):
+            for field in FIELD_WEIGHTS:
+                tokens = tokenize(doc.get(field) or "")
+                if field == "desc":
+                    tokens = tokens[:DESC_INDEX_TOKENS]
+                for token in set(tokens):
+                    postings[field].setdefault(token, array("I")).append(position)
+        self._postings = postings
+        self._vocabulary = sorted(set().union(*(p.keys() for p in postings.values())))
+        self._doc_freq = {}
+        for field_postings in postings.values():
+            for token, positions in field_postings.items():
+                self._doc_freq[token] = self._doc_freq.get(token, 0) + len(positions)
+        self.built_at = time.time()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _terms(self, token: str, prefix: bool) -> List[Tuple[str, float]]:
+        """Vocabulary terms a query token matches, with a weight for each"""
+        if not prefix:
+            return [(token, 1.0)] if token in self._doc_freq else []
+        terms = []
+        start = bisect.bisect_left(self._vocabulary, token)
+        for term in self._vocabulary[start:start + MAX_PREFIX_EXPANSIONS]:
+            if not term.startswith(token):
+                break
+            terms.append((term, 1.0 if term == token else PREFIX_MATCH_FACTOR))
+        return terms
+
+    def _token_scores(self, terms: List[Tuple[str, float]]) -> Dict[int, float]:
+        """Best score per document for one query token"""
+        total = len(self._ids)
+        weighted = []
+        for term, term_weight in terms:
+            idf = math.log(1 + total / self._doc_freq[term])
+            for field, field_weight in FIELD_WEIGHTS.items():
+                positions = self._postings[field].get(term)
+                if positions:
+                    weighted.append((idf * field_weight * term_weight, positions))
+        # Apply lowest scores first so each document ends up with its best one;
+        # dict.fromkeys/update keep the per-document work in C
+        weighted.sort(key=lambda item: item[0])
+        scores = {}
+        for score, positions in weighted:
+            scores.update(dict.fromkeys(positions, score))
+        return scores
+
+    def _title_range(self, prefix: str) -> Tuple[int, int]:
+        """Positions whose normalized title starts with prefix"""
+        lo = bisect.bisect_left(self._titles, prefix)
+        hi = bisect.bisect_left(self._titles, prefix + "\x7f", lo)
+        return lo, hi
+
+    def search(self, query: str, limit: int = 20, offset: int = 0) -> Tuple[List[Any], int]:
+        """Ids of the best matches for a page of results, plus the total match count"""
+        normalized = normalize(query)
+        tokens = normalized.split()
+        if not tokens:
+            return [], 0
+        # While typing, the last word is incomplete and matches as a prefix
+        typing = not query[-1:].isspace()
+        token_terms = []
+        for i, token in enumerate(tokens):
+            terms = self._terms(token, prefix=typing and i == len(tokens) - 1)
+            if not terms:
+                return [], 0
+            token_terms.append(terms)
+
+        # Every token must match; start from the rarest to keep candidate sets small
+        token_terms.sort(key=lambda terms: sum(self._doc_freq[t] for t, _ in terms))
+        candidates = None
+        for terms in token_terms:
+            scores = self._token_scores(terms)
+            if candidates is None:
+                candidates = scores
+            else:
+                if len(scores) < len(candidates):
+                    candidates = {p: candidates[p] + s for p, s in scores.items() if p in candidates}
+                else:
+                    candidates = {p: c + scores[p] for p, c in candidates.items() if p in scores}
+            if not candidates:
+                return [], 0
+
+        # Titles starting with the query, and above all equal to it, rank first
+        lo, hi = self._title_range(normalized)
+        titles = self._titles
+        for position in range(lo, hi):
+            if position in candidates:
+                boost = EXACT_TITLE_BOOST if titles[position] == normalized else PREFIX_TITLE_BOOST
+                candidates[position] += boost
+
+        best = top_positions(candidates, offset + limit)
+        return [self._ids[p] for p in best[offset:]], len(candidates)
+
+    def candidates(self, name: str, limit: int = MATCH_CANDIDATES) -> List[Any]:
+        """Ids of drugs sharing any token (or token prefix) with a free-text name.
+
+        Unlike search(), tokens are ORed: a prescription line like "Tab Dolo
+        650" should still find "Dolo 650mg Tablet" for fuzzy re-scoring.
+        """
+        scores = {}
+        for token in tokenize(name):
+            terms = self._terms(token, prefix=len(token) >= 3)
+            for position, score in self._token_scores(terms).items():
+                scores[position] = scores.get(position, 0.0) + score
+        return [self._ids[p] for p in top_positions(scores, limit)]
+
+
+class DrugSearch:
+    """Holds the current index for a collection and keeps it fresh"""
+
+    def __init__(self, collection, meta, refresh_interval: float = DRUG_INDEX_REFRESH):
+        self.collection = collection
+        self.meta = meta
+        self.refresh_interval = refresh_interval
+        self.index: Optional[DrugSearchIndex] = None
+        # Catalogue version the current index was built from
+        self.version: Optional[int] = None
+
+    def ensure_indexes(self):
+        self.collection.create_index("title_norm")
+
+    def rebuild(self) -> bool:
+        """Load the catalogue into a new index (blocking) and swap it in, unless
+        the catalogue version is the one the current index was built from"""
+        # Read before loading, so writes made during the load trigger the next rebuild
+        version = (self.meta.find_one({"_id": CATALOG_META_ID}) or {}).get("version", 0)
+        if self.index is not None and version == self.version:
+            return False
+        started = time.monotonic()
+        docs = list(self.collection.find({}, {"title": 1, "meta": 1, "desc": 1}))
+        self.index = DrugSearchIndex(docs)
+        self.version = version
+        logger.info("Drug search index built for catalogue version %d: %d drugs in %.1fs",
+                    version, len(self.index), time.monotonic() - started)
+        return True
+
+    async def run(self):
+        """Build in a background thread now, then rebuild whenever the catalogue
+        version has moved, checking every refresh_interval seconds"""
+        while True:
+            try:
+                await asyncio.to_thread(self.rebuild)
+            except Exception:
+                logger.exception("Drug search index build failed")
+            await asyncio.sleep(self.refresh_interval)
+
+    def search(self, query: str, limit: int, offset: int) -> Optional[Tuple[List[Any], int]]:
+        """Search the index, or None while it is not built yet"""
+        if self.index is None:
+            return None
+        return self.index.search(query, limit, offset)
+
+    def candidates(self, names: List[str]) -> Optional[Dict[str, List[Any]]]:
+        """Candidate drug ids for each name, or None while the index is not built"""
+        if self.index is None:
+            return None
+        return {name: self.index.candidates(name) for name in names}
+
+    @staticmethod
+    def fallback_query(query: str) -> Dict[str, Any]:
+        """Index-friendly anchored prefix query on title_norm (user input escaped)"""
+        return {"title_norm": {"$regex": "^" + re.escape(normalize(query))}}
+
+    @staticmethod
+    def fallback_match_query(names: List[str]) -> Dict[str, Any]:
+        """One query for drugs whose title starts with any name's first word"""
+        words = {tokens[0] for tokens in map(tokenize, names) if tokens}
+        return {"$or": [{"title_norm": {"$regex": "^" + re.escape(word)}} for word in sorted(words)]}
+
+
+def match_score(name: str, title: str) -> float:
+    """Similarity of a free-text medication name to a drug title, from 0 to 1.
+
+    Half character-level similarity (tolerates OCR and spelling slips), half
+    the share of the name's words that start a word of the title, so "tab"
+    and "650" count for "Tablet" and "650mg".
+    """
+    name, title = normalize(name), normalize(title)
+    if not name or not title:
+        return 0.0
+    ratio = difflib.SequenceMatcher(None, name, title, autojunk=False).ratio()
+    name_tokens = set(name.split())
+    title_tokens = title.split()
+    found = sum(1 for token in name_tokens if any(t.startswith(token) for t in title_tokens))
+    return round((ratio + found / len(name_tokens)) / 2, 3)
+
+
+def best_match(name: str, documents: Iterable[Dict[str, Any]],
+               min_score: float = MATCH_MIN_SCORE) -> Tuple[Optional[Dict[str, Any]], float]:
+    """Best-scoring drug for a name, or (None, best score) when nothing scores min_score"""
+    best, best_score = None, 0.0
+    for document in documents:
+        score = match_score(name, document.get("title", ""))
+        if score > best_score:
+            best, best_score = document, score
+    if best_score < min_score:
+        return None, best_score
+    return best, best_score
@@ -0,0 +1,145 @@
+"""Upload ingestion.
+
+Uploads are read in chunks into a buffer (hashing as they go, so the cache
+key costs no extra pass) and rejected as soon as they pass UPLOAD_MAX_BYTES.
+Typical uploads, phone photos of a few MB, stay in memory: PDF text layers and
+DOCX files are read from the buffer. Uploads above UPLOAD_SPOOL_THRESHOLD are
+spooled to a temporary file, as are PDFs that need rendering, since poppler
+reads from disk, and images going to the OCR workers, which read a path
+instead of having the buffer pickled to them.
+"""
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+from typing import BinaryIO, Optional, Union
+
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", 25 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", 256 * 1024))
+# Larger uploads go to a temporary file instead of memory
+UPLOAD_SPOOL_THRESHOLD = int(os.environ.get("UPLOAD_SPOOL_THRESHOLD", 8 * 1024 * 1024))
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload is bigger than the configured maximum"""
+
+    def __init__(self, max_bytes: int):
+        super().__init__(f"File is larger than {max_bytes // (1024 * 1024)} MB")
+        self.max_bytes = max_bytes
+
+
+class Upload:
+    """An uploaded file held in memory or, past the threshold, in a temporary file"""
+
+    def __init__(self, filename: str, data: Optional[bytearray] = None, path: Optional[str] = None,
+                 digest: str = "", size: int = 0, owns_path: bool = True):
+        self.filename = filename
+        self.extension = os.path.splitext(filename)[1].lower()
+        self.data = data
+        self.path = path
+        self.digest = digest
+        self.size = size
+        # Temporary files are removed on close; files owned by someone else are not
+        self.owns_path = owns_path
+
+    @classmethod
+    def from_path(cls, path: str, filename: str) -> "Upload":
+        """An upload already on disk (a job's spooled file), hashed in chunks"""
+        digest = hashlib.sha256()
+        size = 0
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+                digest.update(chunk)
+                size += len(chunk)
+        return cls(filename, path=path, digest=digest.hexdigest(), size=size, owns_path=False)
+
+    @property
+    def source(self) -> Union[bytearray, str]:
+        """The buffer, or the file path once spooled"""
+        return self.data if self.data is not None else self.path
+
+    def open(self) -> BinaryIO:
+        """File object over the contents, without copying the buffer"""
+        if self.data is not None:
+            return io.BytesIO(memoryview(self.data))
+        return open(self.path, "rb")
+
+    def spool(self) -> str:
+        """Path of a file with the contents, writing the buffer out on first use"""
+        if self.path is None:
+            fd, self.path = tempfile.mkstemp(suffix=self.extension)
+            with os.fdopen(fd, "wb") as f:
+                f.write(self.data)
+        return self.path
+
+    def move_to(self, path: str):
+        """Store the contents at path (a job's spool file) without another copy in memory"""
+        if self.path is not None and self.owns_path:
+            shutil.move(self.path, path)
+            self.path = path
+            self.owns_path = False
+        else:
+            with open(path, "wb") as f:
+                if self.data is not None:
+                    f.write(self.data)
+                else:
+                    with open(self.path, "rb") as source:
+                        shutil.copyfileobj(source, f)
+
+    def close(self):
+        if self.path is not None and self.owns_path:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+        self.path = None
+        self.data = None
+
+
+async def read_upload(file, max_bytes: int = UPLOAD_MAX_BYTES,
+                      spool_threshold: int = UPLOAD_SPOOL_THRESHOLD) -> Upload:
+    """Stream an UploadFile into an Upload, enforcing the size limit"""
+    known_size = getattr(file, "size", None)
+    if known_size is not None and known_size > max_bytes:
+        raise UploadTooLarge(max_bytes)
+
+    digest = hashlib.sha256()
+    # With the size known up front the buffer is allocated once and filled in
+    # place; growing it chunk by chunk would reallocate and copy
+    buffer = bytearray(known_size) if known_size is not None and known_size <= spool_threshold else bytearray()
+    spooled = None
+    size = 0
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge(max_bytes)
+            digest.update(chunk)
+            start = size - len(chunk)
+            if spooled is None and size > spool_threshold:
+                spooled = tempfile.NamedTemporaryFile(
+                    delete=False, suffix=os.path.splitext(file.filename or "")[1].lower())
+                spooled.write(memoryview(buffer)[:start])
+                buffer = None
+            if spooled is not None:
+                spooled.write(chunk)
+            elif size <= len(buffer):
+                buffer[start:size] = chunk
+            else:
+                del buffer[start:]
+                buffer += chunk
+    except BaseException:
+        if spooled is not None:
+            spooled.close()
+            os.unlink(spooled.name)
+        raise
+
+    if spooled is not None:
+        spooled.close()
+        return Upload(file.filename or "", path=spooled.name, digest=digest.hexdigest(), size=size)
+    del buffer[size:]
+    return Upload(file.filename or "", data=buffer, digest=digest.hexdigest(), size=size)
@@ -0,0 +1,547 @@
+"""Background document analysis jobs.
+
+POST /jobs spools the uploads to disk and returns a job id at once. A small
+pool of in-process workers then runs each file through the same pipeline as
+/extract_text/, recording per-stage progress (text layer, OCR page k of n,
+analysis) in a job store. Clients poll the job or subscribe to its events and
+fetch the result when it is done.
+
+Two stores share one interface, as for chat sessions:
+
+- MemoryJobStore (the default): a dict with an idle TTL, for a single worker;
+  its jobs are lost on restart.
+- MongoJobStore (JOB_STORE=mongo): a MongoDB collection, so job state survives
+  restarts and is visible to every uvicorn worker and replica. Workers claim a
+  job with a lease and renew it while they run it; every runner periodically
+  sweeps for jobs whose lease ran out (their process died) and runs them again,
+  so JOB_SPOOL_DIR must then be storage that every replica mounts.
+
+A job is found by its idempotency key (the client's Idempotency-Key header, or
+a hash of the files and options), so a client that retries a submission
+reattaches to the existing job instead of starting a new one.
+"""
+import asyncio
+import copy
+import datetime
+import logging
+import os
+import tempfile
+import time
+import uuid
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from ingestion import Upload
+
+# "memory" or "mongo"
+JOB_STORE = os.environ.get("JOB_STORE", "memory")
+# Jobs processed at once by this worker (OCR itself is bounded by the OCR pool)
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+# Submissions beyond this many waiting jobs are refused with 429
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", 100))
+JOB_MAX_FILES = int(os.environ.get("JOB_MAX_FILES", 10))
+# Finished and abandoned jobs are dropped after this long
+JOB_TTL = int(os.environ.get("JOB_TTL", 24 * 3600))
+# A running job not updated for this long is considered abandoned and can be claimed again
+JOB_LEASE = float(os.environ.get("JOB_LEASE", 300))
+# How often a runner renews its own leases and looks for abandoned jobs
+JOB_SWEEP_INTERVAL = float(os.environ.get("JOB_SWEEP_INTERVAL", JOB_LEASE / 5))
+# Retries of a file that failed with 429/503 (OCR pool or model busy)
+JOB_RETRIES = int(os.environ.get("JOB_RETRIES", 3))
+# Event streams re-read the store at least this often (jobs run by other workers)
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 2.0))
+# Uploads wait here until processed. Any worker sharing the store may run a job,
+# so with JOB_STORE=mongo this is required and must be shared by every replica
+JOB_SPOOL_DIR = os.environ.get("JOB_SPOOL_DIR", "")
+LOCAL_SPOOL_DIR = os.path.join(tempfile.gettempdir(), "medilink-jobs")
+
+FINISHED = ("done", "failed")
+
+logger = logging.getLogger(__name__)
+# Fields that stay internal to the runner
+_PRIVATE_FIELDS = ("key", "owner", "lease_until", "options")
+_PRIVATE_FILE_FIELDS = ("path", "result")
+
+Progress = Callable[..., None]
+ProcessFile = Callable[[str, str, Dict[str, Any], Progress], Awaitable[Dict[str, Any]]]
+
+
+class JobQueueFull(Exception):
+    """Raised when too many jobs are waiting"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Job queue is full")
+        self.retry_after = retry_after
+
+
+def new_job(job_id: str, key: str, filenames: List[str], paths: List[str],
+            options: Dict[str, Any]) -> Dict[str, Any]:
+    now = time.time()
+    return {
+        "job_id": job_id,
+        "key": key,
+        "status": "queued",
+        "options": options,
+        "files": [
+            {"filename": filename, "path": path, "status": "queued", "stage": "queued",
+             "progress": {}, "result": None, "error": None}
+            for filename, path in zip(filenames, paths)
+        ],
+        # Bumped on every change so event streams can tell what is new
+        "version": 0,
+        "created_at": now,
+        "updated_at": now,
+        "owner": None,
+        "lease_until": 0.0,
+    }
+
+
+def job_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    """What clients see of a job: status and progress, without results"""
+    view = {k: v for k, v in job.items() if k not in _PRIVATE_FIELDS}
+    view["files"] = [{k: v for k, v in f.items() if k not in _PRIVATE_FILE_FIELDS} for f in job["files"]]
+    return view
+
+
+class MemoryJobStore:
+    """In-process job store with an idle TTL"""
+
+    # Calls are cheap and must stay on the event loop thread (not thread-safe)
+    blocking = False
+
+    def __init__(self, ttl: int = JOB_TTL):
+        self.ttl = ttl
+        self._jobs = {}  # job_id -> job
+        self._keys = {}  # idempotency key -> job_id
+
+    def ensure_indexes(self):
+        pass
+
+    def _prune(self):
+        cutoff = time.time() - self.ttl
+        for job_id in [j for j, job in self._jobs.items() if job["updated_at"] < cutoff]:
+            # Files of abandoned jobs are still spooled
+            _unlink([f["path"] for f in self._jobs[job_id]["files"] if f["status"] not in FINISHED])
+            self.delete(job_id)
+
+    def create(self, job: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+        """Store a new job, or return the one already holding its key (and True)"""
+        self._prune()
+        existing = self._keys.get(job["key"])
+        if existing is not None:
+            return copy.deepcopy(self._jobs[existing]), True
+        self._jobs[job["job_id"]] = copy.deepcopy(job)
+        self._keys[job["key"]] = job["job_id"]
+        return job, False
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self._jobs.get(job_id)
+        return copy.deepcopy(job) if job is not None else None
+
+    def find(self, key: str) -> Optional[Dict[str, Any]]:
+        job_id = self._keys.get(key)
+        return self.get(job_id) if job_id is not None else None
+
+    def claim(self, job_id: str, owner: str, lease_until: float) -> bool:
+        job = self._jobs.get(job_id)
+        if job is None or not (job["status"] == "queued" or
+                               job["status"] == "running" and job["lease_until"] < time.time()):
+            return False
+        self._change(job, {"status": "running", "owner": owner, "lease_until": lease_until})
+        return True
+
+    def update(self, job_id: str, fields: Dict[str, Any]):
+        job = self._jobs.get(job_id)
+        if job is not None:
+            self._change(job, fields)
+
+    def update_file(self, job_id: str, index: int, fields: Dict[str, Any], lease_until: float):
+        job = self._jobs.get(job_id)
+        if job is not None:
+            job["files"][index].update(copy.deepcopy(fields))
+            self._change(job, {"lease_until": lease_until})
+
+    @staticmethod
+    def _change(job: Dict[str, Any], fields: Dict[str, Any]):
+        job.update(fields)
+        job["version"] += 1
+        job["updated_at"] = time.time()
+
+    def unfinished(self) -> List[str]:
+        return [job_id for job_id, job in self._jobs.items() if job["status"] not in FINISHED]
+
+    def abandoned(self, now: float, queued_before: float) -> List[str]:
+        """Running jobs whose lease ran out, and jobs queued since before queued_before"""
+        self._prune()
+        return [job_id for job_id, job in self._jobs.items()
+                if job["status"] == "running" and job["lease_until"] < now
+                or job["status"] == "queued" and job["updated_at"] < queued_before]
+
+    def renew(self, job_id: str, owner: str, lease_until: float):
+        job = self._jobs.get(job_id)
+        if job is not None and job["owner"] == owner and job["status"] == "running":
+            # Not a change clients need to see, so the version stays
+            job["lease_until"] = lease_until
+
+    def delete(self, job_id: str):
+        job = self._jobs.pop(job_id, None)
+        if job is not None and self._keys.get(job["key"]) == job_id:
+            del self._keys[job["key"]]
+
+
+class MongoJobStore:
+    """Job store backed by a MongoDB collection with a TTL index"""
+
+    # Every call is a network round-trip, so the runner makes it in a thread
+    blocking = True
+
+    def __init__(self, collection, ttl: int = JOB_TTL):
+        self.collection = collection
+        self.ttl = ttl
+
+    def ensure_indexes(self):
+        # One job per idempotency key; MongoDB removes jobs idle for longer than the TTL
+        self.collection.create_index("key", unique=True)
+        self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    def _expiry(self):
+        return datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=self.ttl)
+
+    @staticmethod
+    def _job(document: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        if document is None:
+            return None
+        document["job_id"] = document.pop("_id")
+        document.pop("expires_at", None)
+        return document
+
+    def create(self, job: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+        """Store a new job, or return the one already holding its key (and True)"""
+        from pymongo.errors import DuplicateKeyError
+
+        document = {k: v for k, v in job.items() if k != "job_id"}
+        document["_id"] = job["job_id"]
+        document["expires_at"] = self._expiry()
+        try:
+            self.collection.insert_one(document)
+        except DuplicateKeyError:
+            existing = self.find(job["key"])
+            if existing is not None:
+                return existing, True
+            raise
+        return job, False
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self._job(self.collection.find_one({"_id": job_id}))
+
+    def find(self, key: str) -> Optional[Dict[str, Any]]:
+        return self._job(self.collection.find_one({"key": key}))
+
+    def claim(self, job_id: str, owner: str, lease_until: float) -> bool:
+        claimed = self.collection.find_one_and_update(
+            {"_id": job_id, "$or": [
+                {"status": "queued"},
+                {"status": "running", "lease_until": {"$lt": time.time()}},
+            ]},
+            self._change({"status": "running", "owner": owner, "lease_until": lease_until}),
+            projection={"_id": 1}
+        )
+        return claimed is not None
+
+    def update(self, job_id: str, fields: Dict[str, Any]):
+        self.collection.update_one({"_id": job_id}, self._change(fields))
+
+    def update_file(self, job_id: str, index: int, fields: Dict[str, Any], lease_until: float):
+        changes = {f"files.{index}.{k}": v for k, v in fields.items()}
+        changes["lease_until"] = lease_until
+        self.collection.update_one({"_id": job_id}, self._change(changes))
+
+    def _change(self, fields: Dict[str, Any]) -> Dict[str, Any]:
+        return {"$set": dict(fields, updated_at=time.time(), expires_at=self._expiry()),
+                "$inc": {"version": 1}}
+
+    def unfinished(self) -> List[str]:
+        return [d["_id"] for d in self.collection.find({"status": {"$nin": list(FINISHED)}}, {"_id": 1})]
+
+    def abandoned(self, now: float, queued_before: float) -> List[str]:
+        """Running jobs whose lease ran out, and jobs queued since before queued_before"""
+        return [d["_id"] for d in self.collection.find({"$or": [
+            {"status": "running", "lease_until": {"$lt": now}},
+            {"status": "queued", "updated_at": {"$lt": queued_before}},
+        ]}, {"_id": 1})]
+
+    def renew(self, job_id: str, owner: str, lease_until: float):
+        self.collection.update_one({"_id": job_id, "owner": owner, "status": "running"},
+                                   {"$set": {"lease_until": lease_until, "expires_at": self._expiry()}})
+
+    def delete(self, job_id: str):
+        self.collection.delete_one({"_id": job_id})
+
+
+def create_job_store(db=None):
+    """Job store selected by JOB_STORE ("memory" or "mongo")"""
+    if JOB_STORE == "mongo":
+        if not JOB_SPOOL_DIR:
+            raise RuntimeError("JOB_STORE=mongo needs JOB_SPOOL_DIR on storage shared by every replica")
+        return MongoJobStore(db["Jobs"])
+    return MemoryJobStore()
+
+
+class JobRunner:
+    """In-process queue and workers that run jobs file by file"""
+
+    def __init__(self, store, process: ProcessFile, workers: int = JOB_WORKERS,
+                 queue_size: int = JOB_QUEUE_SIZE, spool_dir: str = JOB_SPOOL_DIR or LOCAL_SPOOL_DIR):
+        self.store = store
+        self.process = process
+        self.workers = workers
+        self.queue_size = queue_size
+        self.spool_dir = spool_dir
+        # Identifies this process in job leases
+        self.owner = uuid.uuid4().hex
+        self._queue = None
+        self._tasks = []
+        self._queued = set()  # jobs in this process's queue
+        self._running = set()  # jobs this process holds a lease on
+        # Replaced on every change; event streams wait on the current one
+        self._changed = None
+        # Moving average of job duration, used to estimate Retry-After
+        self._avg_job_seconds = 30.0
+
+    async def start(self):
+        """Start the workers (recover() creates the indexes and picks up jobs
+        from a previous run; submissions must wait for it)"""
+        if self._queue is not None:
+            return
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._queue = asyncio.Queue()
+        self._changed = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.ensure_future(self._sweep_forever()))
+
+    async def recover(self):
+        """Create the store's indexes and requeue jobs left unfinished by a previous run"""
+        await self._call("ensure_indexes")
+        # Jobs still held by a live worker are skipped when their claim fails
+        for job_id in await self._call("unfinished"):
+            self._enqueue(job_id)
+
+    async def sweep(self):
+        """Renew the leases of jobs running here, requeue jobs abandoned by dead
+        processes and remove spooled files no job will pick up anymore"""
+        now = time.time()
+        for job_id in list(self._running):
+            await self._call("renew", job_id, self.owner, now + JOB_LEASE)
+        # A queued job untouched for a lease period was left in a dead process's queue;
+        # if it is only waiting in a live one, whichever worker claims it first runs it
+        for job_id in await self._call("abandoned", now, now - JOB_LEASE):
+            self._enqueue(job_id)
+        await _in_thread(_remove_stale_files, self.spool_dir, now - self.store.ttl)
+
+    def _enqueue(self, job_id: str):
+        if job_id not in self._queued and job_id not in self._running:
+            self._queued.add(job_id)
+            self._queue.put_nowait(job_id)
+
+    async def _sweep_forever(self):
+        while True:
+            await asyncio.sleep(JOB_SWEEP_INTERVAL)
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("Job sweep failed")
+
+    async def _call(self, method: str, *args):
+        """Call a store method, in a thread when the store blocks (MongoDB)"""
+        fn = getattr(self.store, method)
+        if self.store.blocking:
+            return await _in_thread(fn, *args)
+        return fn(*args)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self._call("get", job_id)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    @property
+    def queued(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def retry_after(self) -> int:
+        return max(1, int(round(self._queue.qsize() / self.workers * self._avg_job_seconds)))
+
+    async def submit(self, key: str, uploads: List[Upload],
+                     options: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+        """Queue a job for the uploads, or reattach to the one with this key.
+
+        Returns the job and whether it already existed. A failed job is replaced
+        so that retrying it really runs it again.
+        """
+        existing = await self._call("find", key)
+        if existing is not None:
+            if existing["status"] != "failed":
+                return existing, True
+            await self._call("delete", existing["job_id"])
+        if self._queue.qsize() >= self.queue_size:
+            raise JobQueueFull(self.retry_after())
+
+        job_id = str(uuid.uuid4())
+        paths = [os.path.join(self.spool_dir, f"{job_id}-{i}{upload.extension}")
+                 for i, upload in enumerate(uploads)]
+        await _in_thread(_spool, uploads, paths)
+        job = new_job(job_id, key, [upload.filename for upload in uploads], paths, options)
+        job, reattached = await self._call("create", job)
+        if reattached:
+            # Lost a race with an identical submission
+            await _in_thread(_unlink, paths)
+        else:
+            self._enqueue(job_id)
+            self._notify()
+        return job, reattached
+
+    async def watch(self, job_id: str) -> AsyncIterator[Dict[str, Any]]:
+        """Yield the job each time it changes, until it is finished"""
+        version = None
+        while True:
+            job = await self._call("get", job_id)
+            if job is None:
+                return
+            if job["version"] != version:
+                version = job["version"]
+                yield job
+            if job["status"] in FINISHED:
+                return
+            try:
+                await asyncio.wait_for(self._changed.wait(), JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _work(self):
+        while True:
+            job_id = await self._queue.get()
+            self._queued.discard(job_id)
+            started = time.monotonic()
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await self._call("update", job_id, {"status": "failed", "error": f"Job failed: {str(e)}"})
+            finally:
+                self._queue.task_done()
+                self._avg_job_seconds = 0.8 * self._avg_job_seconds + 0.2 * (time.monotonic() - started)
+                self._notify()
+
+    async def _run(self, job_id: str):
+        if not await self._call("claim", job_id, self.owner, time.time() + JOB_LEASE):
+            return
+        self._running.add(job_id)
+        try:
+            await self._run_claimed(job_id)
+        finally:
+            self._running.discard(job_id)
+
+    async def _run_claimed(self, job_id: str):
+        self._notify()
+        job = await self._call("get", job_id)
+        for index, file in enumerate(job["files"]):
+            # Files finished before a restart are kept
+            if file["status"] in FINISHED:
+                continue
+
+            progress = _ProgressWriter(self, job_id, index)
+            progress("extracting")
+            try:
+                result = await self._process(file, job["options"], progress)
+            except Exception as e:
+                fields = {"status": "failed", "stage": "failed",
+                          "error": {"status_code": getattr(e, "status_code", 500),
+                                    "detail": getattr(e, "detail", None) or str(e)}}
+            else:
+                fields = {"status": "done", "stage": "done", "result": result}
+            # The last progress write must not land after the final state
+            await progress.flush()
+            await self._call("update_file", job_id, index, fields, time.time() + JOB_LEASE)
+            self._notify()
+            await _in_thread(_unlink, [file["path"]])
+
+        files = (await self._call("get", job_id))["files"]
+        status = "failed" if all(f["status"] == "failed" for f in files) else "done"
+        await self._call("update", job_id, {"status": status, "owner": None})
+
+    async def _process(self, file: Dict[str, Any], options: Dict[str, Any], progress: Progress) -> Dict[str, Any]:
+        """Process one file, waiting out 429/503 (busy OCR pool or model) a few times"""
+        for attempt in range(JOB_RETRIES + 1):
+            try:
+                return await self.process(file["path"], file["filename"], options, progress)
+            except Exception as e:
+                if getattr(e, "status_code", None) not in (429, 503) or attempt == JOB_RETRIES:
+                    raise
+                retry_after = (getattr(e, "headers", None) or {}).get("Retry-After", "5")
+                progress("waiting", retry_after=int(retry_after), attempt=attempt + 1)
+                await asyncio.sleep(int(retry_after))
+
+
+class _ProgressWriter:
+    """progress(stage, **details) callback for one file of a job.
+
+    The pipeline reports progress synchronously (e.g. every OCR page), so the
+    store write happens in the background; ticks arriving while a write is in
+    flight are coalesced into one write of the latest state, in order.
+    """
+
+    def __init__(self, runner: "JobRunner", job_id: str, index: int):
+        self.runner = runner
+        self.job_id = job_id
+        self.index = index
+        self._latest = None
+        self._writer = None
+
+    def __call__(self, stage: str, **details):
+        self._latest = {"status": "running", "stage": stage, "progress": details}
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.ensure_future(self._write())
+
+    async def _write(self):
+        while self._latest is not None:
+            fields, self._latest = self._latest, None
+            await self.runner._call("update_file", self.job_id, self.index, fields, time.time() + JOB_LEASE)
+            self.runner._notify()
+
+    async def flush(self):
+        if self._writer is not None:
+            await asyncio.gather(self._writer, return_exceptions=True)
+
+
+async def _in_thread(fn, *args):
+    # to_thread, unlike run_in_executor, keeps the caller's context, so the
+    # MongoDB commands still count towards the request's Server-Timing
+    return await asyncio.to_thread(fn, *args)
+
+
+def _spool(uploads: List[Upload], paths: List[str]):
+    for upload, path in zip(uploads, paths):
+        upload.move_to(path)
+
+
+def _unlink(paths: List[str]):
+    for path in paths:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def _remove_stale_files(directory: str, modified_before: float):
+    """Spooled uploads of jobs that expired from the store without running"""
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return
+    _unlink([entry.path for entry in entries if entry.is_file() and entry.stat().st_mtime < modified_before])
@@ -0,0 +1,270 @@
+"""Async gateway to the LLM chat completions API.
+
+All model calls go through LLMGateway, which shares one pooled HTTP client,
+limits concurrency globally and per route, retries rate limits and server
+errors with jittered exponential backoff, and enforces a timeout per attempt.
+Concurrency permits are held per attempt and released while backing off, so
+a rate-limited route doesn't starve the others.
+The backend is pluggable: GroqBackend talks to Groq, FakeBackend answers
+locally for tests and offline development (LLM_BACKEND=fake).
+"""
+import asyncio
+import contextlib
+import json
+import os
+import random
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+from metrics import record, registry, span
+
+LLM_BACKEND = os.environ.get("LLM_BACKEND", "groq")
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 64))
+# Per-route limits as "route=limit,route=limit"; routes not listed share the global limit
+LLM_ROUTE_LIMITS = os.environ.get("LLM_ROUTE_LIMITS", "extract_text=16,chat=48")
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 3))
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", 60))
+LLM_BACKOFF_BASE = 0.5
+LLM_BACKOFF_MAX = 8.0
+
+LLM_RETRIES = registry.counter("medilink_llm_retries_total", "Model calls retried after a failed attempt", ("route",))
+
+
+class LLMUnavailable(Exception):
+    """Raised when the model can't be reached within the retry budget"""
+
+
+def parse_route_limits(spec: str) -> Dict[str, int]:
+    limits = {}
+    for part in spec.split(","):
+        if "=" in part:
+            route, limit = part.split("=", 1)
+            limits[route.strip()] = int(limit)
+    return limits
+
+
+class GroqBackend:
+    """Groq chat completions over a shared, pooled HTTP connection"""
+
+    def __init__(self, api_key: str, max_connections: int = LLM_MAX_CONCURRENCY,
+                 timeout: float = LLM_TIMEOUT):
+        self.api_key = api_key
+        self.max_connections = max_connections
+        self.timeout = timeout
+        # The SDK and its HTTP client are set up on the first request, which
+        # keeps them out of the app's import time
+        self._groq = None
+        self._http = None
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            import httpx
+            import groq
+            self._groq = groq
+            self._http = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+                timeout=self.timeout,
+            )
+            # Retries are handled by the gateway, so the SDK must not retry on its own
+            self._client = groq.AsyncGroq(api_key=self.api_key, http_client=self._http,
+                                          max_retries=0, timeout=self.timeout)
+        return self._client
+
+    async def complete(self, **kwargs) -> str:
+        completion = await self._get_client().chat.completions.create(**kwargs)
+        return completion.choices[0].message.content
+
+    async def stream(self, **kwargs) -> AsyncIterator[str]:
+        chunks = await self._get_client().chat.completions.create(stream=True, **kwargs)
+        try:
+            async for chunk in chunks:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            # Give the connection back even when the caller stops early
+            await chunks.close()
+
+    def is_retryable(self, error: Exception) -> bool:
+        if self._groq is None:
+            return False
+        if isinstance(error, self._groq.APIStatusError):
+            return error.status_code == 429 or error.status_code >= 500
+        return isinstance(error, self._groq.APIConnectionError)
+
+    def retry_after(self, error: Exception) -> Optional[float]:
+        response = getattr(error, "response", None)
+        if response is None:
+            return None
+        try:
+            return float(response.headers.get("retry-after"))
+        except (TypeError, ValueError):
+            return None
+
+    async def aclose(self):
+        if self._http is not None:
+            await self._http.aclose()
+
+
+class FakeBackend:
+    """Local stand-in for the model, for tests and offline development.
+
+    responder receives the request kwargs and returns the reply text; by default
+    JSON requests get a minimal valid object and other requests an echo.
+    """
+
+    def __init__(self, responder: Optional[Callable[[Dict[str, Any]], str]] = None,
+                 latency: float = 0.0):
+        self.responder = responder or self._default_reply
+        self.latency = latency
+        self.calls = []
+        # Streams started and streams closed, to check callers clean up
+        self.streams_opened = 0
+        self.streams_closed = 0
+
+    @staticmethod
+    def _default_reply(kwargs: Dict[str, Any]) -> str:
+        if (kwargs.get("response_format") or {}).get("type") == "json_object":
+            return json.dumps({"summary": "Fake analysis", "test_results": [], "medications": []})
+        last = kwargs["messages"][-1]["content"] if kwargs.get("messages") else ""
+        return f"Fake reply to: {last[:200]}"
+
+    async def complete(self, **kwargs) -> str:
+        self.calls.append(kwargs)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.responder(kwargs)
+
+    async def stream(self, **kwargs) -> AsyncIterator[str]:
+        self.calls.append(kwargs)
+        self.streams_opened += 1
+        try:
+            words = self.responder(kwargs).split(" ")
+            for i, word in enumerate(words):
+                if self.latency:
+                    await asyncio.sleep(self.latency / len(words))
+                yield word if i == 0 else " " + word
+        finally:
+            self.streams_closed += 1
+
+    def is_retryable(self, error: Exception) -> bool:
+        return False
+
+    def retry_after(self, error: Exception) -> Optional[float]:
+        return None
+
+    async def aclose(self):
+        pass
+
+
+def create_backend(api_key: Optional[str]):
+    """Backend selected by LLM_BACKEND ("groq" or "fake")"""
+    if LLM_BACKEND == "fake":
+        return FakeBackend()
+    if not api_key:
+        raise RuntimeError("GROQ_API_KEY is not set (or set LLM_BACKEND=fake to run without Groq)")
+    return GroqBackend(api_key)
+
+
+async def _close_stream(chunks):
+    aclose = getattr(chunks, "aclose", None)
+    if aclose is not None:
+        await aclose()
+
+
+class LLMGateway:
+    """Concurrency-limited, retrying front door for model calls"""
+
+    def __init__(self, backend, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 route_limits: Optional[Dict[str, int]] = None,
+                 max_retries: int = LLM_MAX_RETRIES, timeout: float = LLM_TIMEOUT):
+        self.backend = backend
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self._global = asyncio.Semaphore(max_concurrency)
+        if route_limits is None:
+            route_limits = parse_route_limits(LLM_ROUTE_LIMITS)
+        self._routes = {route: asyncio.Semaphore(limit) for route, limit in route_limits.items()}
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        # Full jitter keeps retrying clients from synchronizing
+        delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+        if retry_after:
+            delay = max(delay, min(retry_after, LLM_BACKOFF_MAX))
+        return delay
+
+    @contextlib.asynccontextmanager
+    async def _limits(self, route: str):
+        route_limit = self._routes.get(route)
+        async with self._global:
+            if route_limit is None:
+                yield
+            else:
+                async with route_limit:
+                    yield
+
+    def _check_retry(self, attempt: int, error: Exception) -> Optional[float]:
+        """Re-raise errors that should not be retried; otherwise return Retry-After"""
+        if isinstance(error, asyncio.TimeoutError):
+            if attempt == self.max_retries:
+                raise LLMUnavailable("AI service timed out") from error
+            return None
+        if not self.backend.is_retryable(error):
+            raise error
+        if attempt == self.max_retries:
+            raise LLMUnavailable(f"AI service unavailable: {str(error)}") from error
+        return self.backend.retry_after(error)
+
+    async def complete(self, route: str, **kwargs) -> str:
+        """Run a chat completion for the given route and return the reply text"""
+        for attempt in range(self.max_retries + 1):
+            waiting = time.perf_counter()
+            async with self._limits(route):
+                record("llm_wait", (time.perf_counter() - waiting) * 1000)
+                try:
+                    with span("llm"):
+                        return await asyncio.wait_for(self.backend.complete(**kwargs), self.timeout)
+                except Exception as e:
+                    retry_after = self._check_retry(attempt, e)
+            LLM_RETRIES.inc(route=route)
+            await asyncio.sleep(self._backoff(attempt, retry_after))
+
+    async def stream(self, route: str, **kwargs) -> AsyncIterator[str]:
+        """Run a streaming chat completion, yielding text deltas as they arrive.
+
+        Failures before the first token are retried like complete(); once tokens
+        have been sent, errors are raised to the caller. The timeout applies to
+        the wait for each chunk. Every backend stream is closed when its attempt
+        ends, including when the caller stops iterating.
+        """
+        for attempt in range(self.max_retries + 1):
+            waiting = time.perf_counter()
+            async with self._limits(route):
+                record("llm_wait", (time.perf_counter() - waiting) * 1000)
+                chunks = self.backend.stream(**kwargs).__aiter__()
+                try:
+                    try:
+                        with span("llm_first_token"):
+                            first = await asyncio.wait_for(chunks.__anext__(), self.timeout)
+                    except StopAsyncIteration:
+                        return
+                    except Exception as e:
+                        retry_after = self._check_retry(attempt, e)
+                    else:
+                        yield first
+                        while True:
+                            try:
+                                chunk = await asyncio.wait_for(chunks.__anext__(), self.timeout)
+                            except StopAsyncIteration:
+                                return
+                            except asyncio.TimeoutError as e:
+                                raise LLMUnavailable("AI service stopped responding") from e
+                            yield chunk
+                finally:
+                    await _close_stream(chunks)
+            LLM_RETRIES.inc(route=route)
+            await asyncio.sleep(self._backoff(attempt, retry_after))
+
+    async def aclose(self):
+        await self.backend.aclose()
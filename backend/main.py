@@ -1,22 +1,40 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Body, Form
+from fastapi import FastAPI, File, UploadFile, HTTPException, Body, Form, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-import easyocr
-import numpy as np
-import cv2
-import io
-from groq import Groq
-from typing import List, Dict, Any, Optional, Union
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from typing import List, Dict, Any, Optional, Tuple, Union
+import asyncio
+import contextlib
 import uuid
 import re
 import os
 import json
-from PIL import Image
-import pytesseract
-import pdf2image
-import docx2txt
-import tempfile
-import shutil
+import time
+import orjson
 from pymongo import MongoClient
+from cache import ResultCache, content_key
+from llm_gateway import LLMGateway, LLMUnavailable, create_backend
+from session_store import call_store, create_session_store
+from chat_context import CHAT_HISTORY_WINDOW, build_chat_messages, summarize_structured_data
+from drug_search import DrugSearch, best_match
+from redaction import redact
+from doc_classifier import DocumentClassifier
+from ingestion import UPLOAD_MAX_BYTES, Upload, UploadTooLarge, read_upload
+from jobs import JOB_MAX_FILES, JobQueueFull, JobRunner, create_job_store, job_view
+from drug_cache import DrugCache, project
+from startup import Readiness, lazy_import
+from metrics import SamplingProfiler, PROFILE_MIN_SECONDS, mongo_listener, registry, span
+import metrics
+from drug_catalog import (
+    COUNT_MODES, CatalogCounts, InvalidCursor, decode_cursor, drug_projection, encode_cursor,
+    keyset_cursor, keyset_filter, parse_id
+)
+from ocr_engine import (
+    OCREngine, OCRQueueFull, OCRTimeout, PDF_MAX_INFLIGHT_PAGES, PREPROCESS_PROFILES,
+    ocr_image_file, ocr_pdf_page, pdf_page_count, read_pdf_text_layer, is_usable_text_layer
+)
+
+docx2txt = lazy_import("docx2txt")
 
 app = FastAPI()
 
@@ -29,25 +47,89 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize EasyOCR reader with enhanced settings
-reader = easyocr.Reader(
-    ['en'],
-    gpu=False,  # Set to True if GPU is available
-    model_storage_directory=os.path.join(os.path.dirname(__file__), 'models'),
-    download_enabled=True,
-    quantize=True  # Use quantization for faster inference
-)
+# Most files accepted per upload route; anything beyond their combined size
+# limit (plus multipart framing) is refused before the body is parsed
+UPLOAD_ROUTES = {"/extract_text/": 1, "/jobs": JOB_MAX_FILES}
+MULTIPART_OVERHEAD = 64 * 1024
 
-# Initialize Groq client with API key
-from groq import Groq
-client = Groq(api_key="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")
-# In-memory store for session data
-sessions = {}
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """Answer 413 from Content-Length instead of spooling an oversized body"""
+    files = UPLOAD_ROUTES.get(request.url.path)
+    length = request.headers.get("content-length", "")
+    if files and request.method == "POST" and length.isdigit() \
+            and int(length) > UPLOAD_MAX_BYTES * files + MULTIPART_OVERHEAD:
+        return JSONResponse({"detail": f"Upload is larger than {UPLOAD_MAX_BYTES // (1024 * 1024)} MB per file"},
+                            status_code=413)
+    return await call_next(request)
+
+@app.middleware("http")
+async def instrument(request: Request, call_next):
+    """Request metrics, a Server-Timing header with the stages of the request,
+    and a stack profile for sampled requests (PROFILE_SAMPLE_RATE)"""
+    timings = metrics.begin_request()
+    profiler = SamplingProfiler.maybe_start()
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        elapsed = time.perf_counter() - started
+        # Route templates ("/jobs/{job_id}"), not raw paths, keep the label set small
+        route = getattr(request.scope.get("route"), "path", "other")
+        metrics.observe_request(request.method, route, status, elapsed)
+        if profiler is not None:
+            # Joining the sampler thread and writing the profile both block
+            await run_in_threadpool(profiler.stop)
+            if elapsed >= PROFILE_MIN_SECONDS:
+                await run_in_threadpool(profiler.dump, f"{request.method} {route}")
+    response.headers["Server-Timing"] = metrics.server_timing(timings, elapsed)
+    return response
 
-# MongoDB connection
-mongo_client = MongoClient("mongodb://localhost:27017/")
+# OCR runs in a pool of worker processes, each with its own warm EasyOCR reader
+ocr_engine = OCREngine()
+# How long an OCR request waits for the model to finish loading before a 503
+OCR_READY_TIMEOUT = float(os.environ.get("OCR_READY_TIMEOUT", 20))
+# How long a job submission waits for the job store's indexes before a 503
+JOBS_READY_TIMEOUT = float(os.environ.get("JOBS_READY_TIMEOUT", 10))
+# Components started in the background after uvicorn binds (see /health/ready)
+readiness = Readiness()
+
+# All model calls go through the async gateway (pooled connections, limits, retries)
+llm = LLMGateway(create_backend(api_key=os.environ.get("GROQ_API_KEY")))
+LLM_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"
+JSON_ANSWER_INSTRUCTION = "Answer with a JSON object that uses the same field names as the structured data extracted from the document."
+# Caches keyed by content hash. Extractions hold the OCR text before redaction,
+# so they stay in memory; analyses of the redacted text may use the disk tier
+extraction_cache = ResultCache(disk_dir=None)
+result_cache = ResultCache()
+CACHE_LOOKUPS = registry.counter("medilink_cache_lookups_total", "Result cache lookups by kind and outcome",
+                                 ("kind", "result"))
+# Bump when prompts or schemas change so stale analyses are not served
+ANALYSIS_PROMPT_VERSION = "2"
+# Keyword/pattern weights for document_type="auto" (DOC_CLASSIFIER_WEIGHTS overrides)
+document_classifier = DocumentClassifier.from_config()
+
+# MongoDB connection, opened on first use rather than at import
+mongo_client = MongoClient("mongodb://localhost:27017/", connect=False,
+                           event_listeners=[mongo_listener()])
 db = mongo_client["MediLink"]
 drugs_collection = db["Drugs"]
+# In-process inverted index over the drug catalogue, rebuilt in the background
+# when the catalogue version the scraper bumps has moved
+drug_search = DrugSearch(drugs_collection, db["Meta"])
+# Cached drug counts, invalidated by the same catalogue version
+drug_catalog = CatalogCounts(drugs_collection, db["Meta"])
+# Hot drugs and result pages, evicted through the scraper's DrugChanges feed
+drug_cache = DrugCache(drugs_collection, db["DrugChanges"])
+# Most names or ids accepted by one batch lookup
+DRUG_BATCH_MAX = int(os.environ.get("DRUG_BATCH_MAX", 100))
+# Largest page /drugs returns
+DRUG_PAGE_MAX = int(os.environ.get("DRUG_PAGE_MAX", 100))
+
+# Chat sessions: bounded in-memory LRU, or MongoDB to share them across workers
+session_store = create_session_store(db)
 
 # Enhanced schema for lab report structured output with new feature fields
 LAB_REPORT_SCHEMA = {
@@ -368,440 +450,648 @@ PRESCRIPTION_SCHEMA = {
     "required": ["summary", "medications"]
 }
 
+# Documents that are both (e.g. a discharge summary with results and the
+# medications prescribed) are extracted with the fields of both schemas
+MIXED_SCHEMA = {
+    "type": "object",
+    "properties": {
+        **LAB_REPORT_SCHEMA["properties"],
+        **PRESCRIPTION_SCHEMA["properties"],
+        "summary": {
+            "type": "string",
+            "description": "Brief overview of the test findings and the prescribed treatment in human-friendly language"
+        }
+    },
+    "required": ["summary", "test_results", "medications"]
+}
+
+# Document types analyzed into structured data
+STRUCTURED_DOC_TYPES = ("prescription", "lab_report", "mixed")
+
+@app.on_event("startup")
+async def start_ocr_engine():
+    # Loads and warms the model in every worker; only OCR requests wait for it
+    readiness.start("ocr", ocr_engine.warm_up)
+
+async def start_database():
+    await run_in_threadpool(mongo_client.admin.command, "ping")
+    await run_in_threadpool(drug_catalog.ensure_indexes)
+    await run_in_threadpool(drug_search.ensure_indexes)
+    await run_in_threadpool(drug_cache.ensure_indexes)
+    await run_in_threadpool(session_store.ensure_indexes)
+    asyncio.ensure_future(drug_search.run())
+    asyncio.ensure_future(drug_cache.run())
+
+@app.on_event("startup")
+async def start_drug_search():
+    readiness.start("database", start_database)
+
+@app.on_event("shutdown")
+async def stop_ocr_engine():
+    ocr_engine.shutdown()
+
+@app.on_event("shutdown")
+async def close_llm_gateway():
+    await llm.aclose()
+
 @app.get("/")
 async def root():
     return {"message": "OCR and AI API is running"}
 
-def preprocess_image(img, scale_factor=1.5, is_handwritten=False):
-    """Apply advanced preprocessing techniques to enhance OCR accuracy"""
-    # Check for extremely large images and resize if necessary
-    max_dimension = 3000  # Set a maximum dimension
-    height, width = img.shape[:2]
-    if height > max_dimension or width > max_dimension:
-        # Calculate new dimensions while preserving aspect ratio
-        if height > width:
-            new_height = max_dimension
-            new_width = int(width * (max_dimension / height))
-        else:
-            new_width = max_dimension
-            new_height = int(height * (max_dimension / width))
-        img = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_AREA)
-        
-    # Continue with regular preprocessing
-    # Resize image to zoom in (scale up) for better detail capture
-    height, width = img.shape[:2]
-    new_height, new_width = int(height * scale_factor), int(width * scale_factor)
-    img = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_CUBIC)
-    
-    # Convert to grayscale
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    
-    # Enhance contrast using CLAHE (Contrast Limited Adaptive Histogram Equalization)
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-    enhanced = clahe.apply(gray)
-    
-    # Apply bilateral filter to reduce noise while preserving edges
-    filtered = cv2.bilateralFilter(enhanced, 9, 75, 75)
-    
-    if is_handwritten:
-        # Special processing for handwritten text
-        # Sharpen the image to enhance handwriting strokes
-        kernel = np.array([[-1, -1, -1], [-1, 9, -1], [-1, -1, -1]])
-        sharpened = cv2.filter2D(filtered, -1, kernel)
-        
-        # Apply Otsu's thresholding for handwritten content
-        _, thresh = cv2.threshold(sharpened, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-        
-        # Apply morphological operations to connect broken strokes in handwriting
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2, 2))
-        closed = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
-        
-        return closed
-    else:
-        # For printed text, use adaptive thresholding
-        thresh = cv2.adaptiveThreshold(
-            filtered, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-            cv2.THRESH_BINARY, 11, 2
+@app.get("/metrics")
+async def get_metrics():
+    """Request, stage and queue metrics of this worker process in Prometheus text format"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/health/live")
+async def health_live():
+    """The process is up and serving requests"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def health_ready():
+    """Whether the components in READY_REQUIRES are ready, and how every component is doing"""
+    status = readiness.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+@contextlib.asynccontextmanager
+async def ocr_admission():
+    """Wait for the OCR model and reserve room on the worker pool for one
+    document, so a busy pool turns it away before any page is OCR'd"""
+    if not await readiness.wait("ocr", OCR_READY_TIMEOUT):
+        raise HTTPException(
+            status_code=503,
+            detail="OCR model is still loading. Please retry shortly.",
+            headers={"Retry-After": str(int(OCR_READY_TIMEOUT))}
         )
-        
-        # Denoise the image
-        denoised = cv2.fastNlMeansDenoising(thresh, None, 10, 7, 21)
-        
-        return denoised
+    try:
+        ocr_engine.admit()
+    except OCRQueueFull as e:
+        raise HTTPException(
+            status_code=429,
+            detail="OCR service is busy. Please retry shortly.",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    try:
+        yield
+    finally:
+        ocr_engine.release()
 
-async def extract_text_from_pdf(file_path: str) -> str:
-    """Extract text from PDF with robust fallbacks"""
+async def run_ocr_job(fn, *args):
+    """Run an OCR job on the worker pool, translating a timeout into an HTTP error"""
     try:
-        # Try with pdf2image first (requires poppler)
+        with span("ocr_job"):
+            result = await ocr_engine.run(fn, *args)
+    except OCRTimeout:
+        raise HTTPException(status_code=504, detail="Text extraction took too long. Please try a smaller document.")
+    # Stage timings measured in the worker process
+    if isinstance(result, dict) and "timings" in result:
+        metrics.record_all(result.pop("timings"))
+    return result
+
+def no_progress(stage: str, **details):
+    pass
+
+async def extract_text_from_pdf(upload: Upload, ocr_profile: str = "auto",
+                                progress=no_progress) -> Tuple[str, List[Dict[str, Any]]]:
+    """Extract text from PDF, reading the embedded text layer where it is usable
+    and OCR'ing only the remaining pages. Also returns how each page was read.
+    progress(stage, **details) is told about the text layer and each OCR'd page."""
+    # Parsing the text layer needs no OCR model: it is read from the buffer in
+    # the threadpool rather than copied to an OCR worker
+    progress("text_layer")
+    with span("text_layer"):
+        text_layer = await run_in_threadpool(read_pdf_text_layer, upload.source)
+
+    # A PDF whose text layer is usable throughout is read from memory; rendering
+    # pages needs poppler and a file on disk
+    can_rasterize = True
+    page_count = len(text_layer)
+    file_path = None
+    if not text_layer or not all(is_usable_text_layer(text) for text in text_layer):
         try:
-            images = pdf2image.convert_from_path(file_path, dpi=300)
-            extracted_texts = []
-            
-            for i, img in enumerate(images):
-                img_np = np.array(img)
-                img_np = cv2.cvtColor(img_np, cv2.COLOR_RGB2BGR)
-                preprocessed = preprocess_image(img_np)
-                results = reader.readtext(preprocessed, paragraph=True)
-                page_text = " ".join([result[1] for result in results])
-                
-                if not page_text.strip():
-                    page_text = pytesseract.image_to_string(Image.fromarray(preprocessed))
-                
-                extracted_texts.append(f"[Page {i+1}]: {page_text}")
-            
-            return "\n\n".join(extracted_texts)
-        
+            file_path = await run_in_threadpool(upload.spool)
+            page_count = await run_in_threadpool(pdf_page_count, file_path)
         except Exception as e:
-            if "poppler" in str(e).lower():
-                # Try PyPDF2 as a fallback (no images but can extract text)
-                try:
-                    import PyPDF2
-                    with open(file_path, "rb") as pdf_file:
-                        reader = PyPDF2.PdfReader(pdf_file)
-                        text = ""
-                        for i, page in enumerate(reader.pages):
-                            page_text = page.extract_text() or ""
-                            text += f"[Page {i+1}]: {page_text}\n\n"
-                        return text
-                except Exception:
-                    # Last resort: Use pdfplumber as a fallback
-                    try:
-                        import pdfplumber
-                        text = ""
-                        with pdfplumber.open(file_path) as pdf:
-                            for i, page in enumerate(pdf.pages):
-                                text += f"[Page {i+1}]: {page.extract_text() or ''}\n\n"
-                        return text
-                    except Exception:
-                        raise ValueError("Failed to extract text from PDF. Please install poppler-utils or upload a different file format.")
-            else:
-                raise e
+            if "poppler" not in str(e).lower():
+                raise ValueError(f"PDF extraction error: {str(e)}")
+            if not text_layer:
+                raise ValueError("Failed to extract text from PDF. Please install poppler-utils or upload a different file format.")
+            # Without poppler we can't rasterize, so the text layer is all we have
+            can_rasterize = False
+            page_count = len(text_layer)
+
+    page_count = max(page_count, len(text_layer))
+    page_texts = text_layer + [""] * (page_count - len(text_layer))
+    ocr_pages = [
+        n for n in range(1, page_count + 1)
+        if can_rasterize and not is_usable_text_layer(page_texts[n - 1])
+    ]
+
+    # Pages are rendered and OCR'd one at a time in the workers, with at most
+    # PDF_MAX_INFLIGHT_PAGES of this document in memory at once
+    inflight = asyncio.Semaphore(PDF_MAX_INFLIGHT_PAGES)
+    ocr_done = 0
+    if ocr_pages:
+        progress("ocr", page=0, pages=len(ocr_pages))
+
+    async def ocr_page(page_number: int) -> Dict[str, Any]:
+        nonlocal ocr_done
+        async with inflight:
+            result = await run_ocr_job(ocr_pdf_page, file_path, page_number, ocr_profile)
+        ocr_done += 1
+        progress("ocr", page=ocr_done, pages=len(ocr_pages))
+        return result
+
+    async def ocr_document() -> List[Dict[str, Any]]:
+        if not ocr_pages:
+            return []
+        async with ocr_admission():
+            tasks = [asyncio.ensure_future(ocr_page(n)) for n in ocr_pages]
+            try:
+                return await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                raise
+
+    try:
+        ocr_results = await ocr_document()
+    except HTTPException:
+        raise
     except Exception as e:
         raise ValueError(f"PDF extraction error: {str(e)}")
 
-async def extract_text_from_file(file: UploadFile) -> str:
-    """Extract text from various file formats (image, PDF, DOCX)"""
-    file_extension = os.path.splitext(file.filename)[1].lower() if file.filename else ""
-    
-    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-        # Read the file data
-        file_data = await file.read()
-        temp_file.write(file_data)
-        temp_path = temp_file.name
-    
-    try:
-        # Process PDF files with enhanced error handling
-        if file_extension == ".pdf":
-            return await extract_text_from_pdf(temp_path)
-            
-        # Process DOCX files
-        elif file_extension == ".docx":
-            return docx2txt.process(temp_path)
-            
-        # Process image files (png, jpg, jpeg, etc.)
-        else:
-            try:
-                img = cv2.imread(temp_path)
-                if img is None:
-                    raise ValueError("Could not read image")
-                
-                # First try EasyOCR with preprocessing
-                preprocessed = preprocess_image(img)
-                results = reader.readtext(preprocessed, paragraph=True)
-                extracted_text = " ".join([result[1] for result in results])
-                
-                # If that doesn't work well, try the original image
-                if not extracted_text.strip():
-                    results = reader.readtext(img, paragraph=True)
-                    extracted_text = " ".join([result[1] for result in results])
-                
-                # If EasyOCR doesn't work well, try Tesseract as fallback
-                if not extracted_text.strip():
-                    preprocessed_pil = Image.fromarray(preprocessed)
-                    extracted_text = pytesseract.image_to_string(preprocessed_pil)
-                    
-                    # If still no results, try with original image
-                    if not extracted_text.strip():
-                        img_pil = Image.fromarray(img)
-                        extracted_text = pytesseract.image_to_string(img_pil)
-                
-                return extracted_text
-                
-            except Exception as e:
-                raise HTTPException(status_code=400, detail=f"Unsupported file format or corrupted file: {str(e)}")
-    finally:
-        # Clean up temporary file
-        if os.path.exists(temp_path):
-            os.unlink(temp_path)
+    pages = [{"page": n, "method": "text_layer"} for n in range(1, page_count + 1)]
+    for page_number, ocr_result in zip(ocr_pages, ocr_results):
+        page_texts[page_number - 1] = ocr_result["text"]
+        pages[page_number - 1] = {
+            "page": page_number,
+            "method": "ocr",
+            "confidence": ocr_result["confidence"],
+            "engines": ocr_result["engines"]
+        }
+    text = "\n\n".join(f"[Page {i+1}]: {page_text}" for i, page_text in enumerate(page_texts))
+    return text, pages
 
-def identify_document_type(text):
-    """Enhanced document type identification with more robust patterns"""
-    text_lower = text.lower()
-    
-    # Check for prescription indicators with more patterns
-    prescription_keywords = [
-        'prescription', 'rx', 'rx#', 'dosage', 'take', 'medicine', 'medication',
-        'prescribed', 'pharmacy', 'refill', 'tablets', 'capsules', 'oral', 'topical',
-        'mg', 'mcg', 'ml', 'once daily', 'twice daily', 'three times daily',
-        'physician', 'dr\\.', 'doctor', 'dispense', 'substitution'
-    ]
-    
-    # Enhanced lab report indicators
-    lab_report_keywords = [
-        'laboratory', 'lab report', 'test results', 'specimen', 'reference range',
-        'blood test', 'urine test', 'cholesterol', 'glucose', 'wbc', 'rbc', 'hgb',
-        'hemoglobin', 'hba1c', 'creatinine', 'normal range', 'reference', 'panel',
-        'hematology', 'chemistry', 'lipid', 'thyroid', 'abnormal', 'elevated',
-        'complete blood count', 'metabolic panel'
-    ]
-    
-    # Calculate scores with weighted terms
-    prescription_score = 0
-    lab_report_score = 0
-    
-    for keyword in prescription_keywords:
-        if keyword in text_lower:
-            # Give higher weight to strong indicators
-            if keyword in ['prescription', 'rx', 'prescribed', 'dosage', 'pharmacy']:
-                prescription_score += 2
-            else:
-                prescription_score += 1
-    
-    for keyword in lab_report_keywords:
-        if keyword in text_lower:
-            # Give higher weight to strong indicators
-            if keyword in ['laboratory', 'lab report', 'test results', 'reference range']:
-                lab_report_score += 2
-            else:
-                lab_report_score += 1
-    
-    # Look for patterns typical in prescriptions
-    if re.search(r'take\s+\d+\s+tablet', text_lower) or re.search(r'\d+\s+times?\s+daily', text_lower):
-        prescription_score += 3
+async def extract_text_from_upload(upload: Upload, ocr_profile: str = "auto",
+                                   progress=no_progress) -> Tuple[str, Dict[str, Any]]:
+    """Extract text from various file formats (image, PDF, DOCX).
+    Returns the text and a report of how it was extracted."""
+    # Process PDF files with enhanced error handling
+    if upload.extension == ".pdf":
+        text, pages = await extract_text_from_pdf(upload, ocr_profile, progress)
+        return text, {"method": "pdf", "ocr_profile": ocr_profile, "pages": pages}
         
-    # Look for patterns typical in lab reports
-    if re.search(r'\b\d+\s*[-–]\s*\d+\s*[a-zA-Z\/]+\b', text_lower) or re.search(r'reference range', text_lower):
-        lab_report_score += 3
-    
-    # Determine document type based on keyword matches
-    if prescription_score > lab_report_score:
-        return "prescription"
-    elif lab_report_score > prescription_score:
-        return "lab_report"
+    # Process DOCX files
+    elif upload.extension == ".docx":
+        progress("text_layer")
+        with upload.open() as docx_file, span("docx"):
+            return await run_in_threadpool(docx2txt.process, docx_file), {"method": "docx"}
+        
+    # Process image files (png, jpg, jpeg, etc.) in an OCR worker, which reads them from a file
     else:
-        return "unknown"
+        try:
+            progress("ocr", page=0, pages=1)
+            async with ocr_admission():
+                # Workers get a path to read, not the whole buffer pickled through the pool's pipe
+                file_path = await run_in_threadpool(upload.spool)
+                ocr_result = await run_ocr_job(ocr_image_file, file_path, ocr_profile)
+            progress("ocr", page=1, pages=1)
+            return ocr_result.pop("text"), dict(ocr_result, method="ocr", ocr_profile=ocr_profile)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Unsupported file format or corrupted file: {str(e)}")
+
+async def receive_upload(file: UploadFile) -> Upload:
+    """Stream an upload in chunks, answering 413 past UPLOAD_MAX_BYTES"""
+    try:
+        with span("upload"):
+            return await read_upload(file)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+async def extract_with_cache(upload: Upload, document_type: str, ocr_profile: str,
+                             progress=no_progress) -> Tuple[str, Dict[str, Any]]:
+    """Extracted text and report, reused for identical uploads"""
+    extraction_key = content_key("extraction", upload.digest, document_type, ocr_profile)
+    cached_extraction = extraction_cache.get(extraction_key)
+    CACHE_LOOKUPS.inc(kind="extraction", result="miss" if cached_extraction is None else "hit")
+    if cached_extraction is not None:
+        return tuple(cached_extraction)
+    extracted_text, extraction = await extract_text_from_upload(upload, ocr_profile, progress)
+    extraction_cache.set(extraction_key, [extracted_text, extraction])
+    return extracted_text, extraction
+
+def identify_document_type(text):
+    """Prescription, lab_report, mixed or unknown (single-pass scoring, see doc_classifier.py)"""
+    return document_classifier.classify(text).doc_type
 
 def redact_personal_info(text):
-    """Enhanced redaction of potentially personal information from extracted text"""
-    # Redact potential phone numbers with international formats
-    text = re.sub(r'\b(?:\+?1[-. ]?)?\(?([0-9]{3})\)?[-. ]?([0-9]{3})[-. ]?([0-9]{4})\b', '[PHONE REDACTED]', text)
-    
-    # Redact potential emails with various domains
-    text = re.sub(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b', '[EMAIL REDACTED]', text)
-    
-    # Redact potential SSNs with various formats
-    text = re.sub(r'\b\d{3}[-. ]?\d{2}[-. ]?\d{4}\b', '[SSN REDACTED]', text)
-    
-    # Redact dates of birth
-    text = re.sub(r'\b(?:DOB|Date of Birth|Birth Date)[:;]\s*\d{1,2}[-/]\d{1,2}[-/]\d{2,4}\b', '[DOB REDACTED]', text)
-    text = re.sub(r'\b(?:DOB|Date of Birth|Birth Date)[:;]\s*\w+ \d{1,2},? \d{4}\b', '[DOB REDACTED]', text)
-    
-    # Redact potential addresses
-    text = re.sub(r'\b\d{1,5}\s+[A-Za-z0-9\s,.]+(?:Avenue|Ave|Boulevard|Blvd|Street|St|Road|Rd|Lane|Ln|Drive|Dr|Court|Ct|Place|Pl|Terrace|Ter)(?:\s+[A-Za-z0-9\s,.]*)?\b', '[ADDRESS REDACTED]', text, flags=re.IGNORECASE)
-    
-    return text
+    """Redact potentially personal information from extracted text (single pass, see redaction.py)"""
+    return redact(text).text
 
-@app.post("/extract_text/")
-async def extract_text(file: UploadFile = File(...), document_type: str = Form("lab_report")):
-    """Extract text from various file formats and process with Groq AI"""
-    try:
-        # Check if the file has a supported extension
-        filename = file.filename.lower() if file.filename else ""
-        if not any(filename.endswith(ext) for ext in ['.jpg', '.jpeg', '.png', '.pdf', '.docx', '.bmp', '.tiff', '.tif', '.webp']):
-            raise HTTPException(status_code=400, detail="Unsupported file format. Please upload an image, PDF, or DOCX file.")
+async def analyze_document(redacted_text: str, doc_type: str) -> Dict[str, Any]:
+    """Analyze redacted document text with Groq AI"""
+    # Enhanced prompts for more comprehensive analysis
+    if doc_type == "prescription":
+        system_prompt = """You are a medical assistant AI specialized in interpreting prescriptions. 
+        Analyze the provided prescription text and extract the information according to the specified JSON schema.
         
-        # Extract text from the file
-        extracted_text = await extract_text_from_file(file)
+        IMPORTANT GUIDELINES:
+        - Create a human-friendly summary that explains the prescription's purpose
+        - NEVER include any personal information like patient names, addresses, or contact details
+        - Add lifestyle recommendations based on common advice for patients on these medications
+        - Suggest doctor questions the patient should ask about this prescription
+        - Add relevant tags to categorize this prescription
+        - If information is unclear or missing, use null values rather than guessing
+        - Provide warnings about medication interactions or side effects where relevant
+        """
         
-        if not extracted_text or len(extracted_text.strip()) < 10:
-            raise HTTPException(status_code=400, detail="Could not extract sufficient text from the file. Please try a clearer image or document.")
+        schema = json.dumps(PRESCRIPTION_SCHEMA, indent=2)
         
-        # Redact potential personal information
-        redacted_text = redact_personal_info(extracted_text)
+        # Use function calling format in Groq to get structured output
+        ai_response = await llm.complete(
+            "extract_text",
+            model=LLM_MODEL,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": f"Extract information from this prescription according to the schema. Use strict JSON format.\n\nSCHEMA: {schema}\n\nPRESCRIPTION TEXT: {redacted_text}"}
+            ],
+            temperature=0.1,  # Lower temperature for more consistent results
+            max_completion_tokens=2048,
+            top_p=1,
+            response_format={"type": "json_object"}
+        )
         
-        # Use provided document type instead of detection
-        doc_type = document_type
+    elif doc_type == "lab_report":
+        system_prompt = """You are a medical assistant AI specialized in interpreting laboratory reports. 
+        Analyze the provided lab report text and extract the information according to the specified JSON schema.
         
-        # Use automatic detection as fallback if "auto" is provided
-        if doc_type == "auto":
-            doc_type = identify_document_type(redacted_text)
+        IMPORTANT GUIDELINES:
+        - Create a human-friendly executive summary that explains key findings in plain language
+        - Categorize abnormal values with severity levels (MILD, MODERATE, SEVERE)
+        - Suggest appropriate supplements or medications based on test results
+        - Provide lifestyle and diet recommendations specific to these lab results
+        - Recommend follow-up tests that would complement these findings
+        - Generate questions the patient should ask their doctor
+        - Add relevant tags to categorize this report
+        - NEVER include any personal information like patient names, addresses, or contact details
+        """
         
-        # Enhanced prompts for more comprehensive analysis
-        if doc_type == "prescription":
-            system_prompt = """You are a medical assistant AI specialized in interpreting prescriptions. 
-            Analyze the provided prescription text and extract the information according to the specified JSON schema.
-            
-            IMPORTANT GUIDELINES:
-            - Create a human-friendly summary that explains the prescription's purpose
-            - NEVER include any personal information like patient names, addresses, or contact details
-            - Add lifestyle recommendations based on common advice for patients on these medications
-            - Suggest doctor questions the patient should ask about this prescription
-            - Add relevant tags to categorize this prescription
-            - If information is unclear or missing, use null values rather than guessing
-            - Provide warnings about medication interactions or side effects where relevant
-            """
-            
-            schema = json.dumps(PRESCRIPTION_SCHEMA, indent=2)
-            
-            # Use function calling format in Groq to get structured output
-            completion = client.chat.completions.create(
-                model="meta-llama/llama-4-scout-17b-16e-instruct",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"Extract information from this prescription according to the schema. Use strict JSON format.\n\nSCHEMA: {schema}\n\nPRESCRIPTION TEXT: {redacted_text}"}
-                ],
-                temperature=0.1,  # Lower temperature for more consistent results
-                max_completion_tokens=2048,
-                top_p=1,
-                response_format={"type": "json_object"}
-            )
-            
-        elif doc_type == "lab_report":
-            system_prompt = """You are a medical assistant AI specialized in interpreting laboratory reports. 
-            Analyze the provided lab report text and extract the information according to the specified JSON schema.
-            
-            IMPORTANT GUIDELINES:
-            - Create a human-friendly executive summary that explains key findings in plain language
-            - Categorize abnormal values with severity levels (MILD, MODERATE, SEVERE)
-            - Suggest appropriate supplements or medications based on test results
-            - Provide lifestyle and diet recommendations specific to these lab results
-            - Recommend follow-up tests that would complement these findings
-            - Generate questions the patient should ask their doctor
-            - Add relevant tags to categorize this report
-            - NEVER include any personal information like patient names, addresses, or contact details
-            """
-            
-            schema = json.dumps(LAB_REPORT_SCHEMA, indent=2)
-            
-            # Use function calling format in Groq to get structured output
-            completion = client.chat.completions.create(
-                model="meta-llama/llama-4-scout-17b-16e-instruct",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"Extract information from this lab report according to the schema. Use strict JSON format.\n\nSCHEMA: {schema}\n\nLAB REPORT TEXT: {redacted_text}"}
-                ],
-                temperature=0.1,  # Lower temperature for more consistent results
-                max_completion_tokens=2048,
-                top_p=1,
-                response_format={"type": "json_object"}
-            )
-            
-        else:
-            # Use regular prompt for non-specific medical documents
-            system_prompt = """You are a medical assistant AI specialized in interpreting medical documents. 
-            Analyze the provided medical document text and extract key information:
-
-            ## TASK
-            Identify the document type first, then extract and organize relevant medical information:
-            1. DOCUMENT TYPE: Determine what kind of medical document this is
-            2. KEY INFORMATION: Extract the most important medical details
-            3. MEDICAL TERMS: Explain any specialized medical terminology
-            4. SUMMARY: Provide a concise, plain-language overview
-            
-            ## IMPORTANT GUIDELINES
-            - NEVER include any personal information like patient names, addresses, or contact details
-            - Organize information in a logical, easy-to-understand format
-            - Highlight important medical findings or recommendations
-            - If information is unclear or missing, indicate this rather than guessing
-            - Use formatting to improve readability
-            """
-            
-            # Process with Groq AI using enhanced prompting
-            completion = client.chat.completions.create(
-                model="meta-llama/llama-4-scout-17b-16e-instruct",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"Here is the text extracted from a medical document. Please analyze it according to the instructions:\n\n{redacted_text}"}
-                ],
-                temperature=0.5,
-                max_completion_tokens=1024,
-                top_p=1
-            )
+        schema = json.dumps(LAB_REPORT_SCHEMA, indent=2)
         
-        # Process AI response
-        ai_response = completion.choices[0].message.content
+        # Use function calling format in Groq to get structured output
+        ai_response = await llm.complete(
+            "extract_text",
+            model=LLM_MODEL,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": f"Extract information from this lab report according to the schema. Use strict JSON format.\n\nSCHEMA: {schema}\n\nLAB REPORT TEXT: {redacted_text}"}
+            ],
+            temperature=0.1,  # Lower temperature for more consistent results
+            max_completion_tokens=2048,
+            top_p=1,
+            response_format={"type": "json_object"}
+        )
         
-        # For structured responses, validate JSON
-        structured_data = None
-        if doc_type in ["prescription", "lab_report"]:
-            try:
-                structured_data = json.loads(ai_response)
-            except json.JSONDecodeError:
-                # If JSON parsing fails, try to extract JSON from the text
+    elif doc_type == "mixed":
+        system_prompt = """You are a medical assistant AI specialized in interpreting medical documents that contain both laboratory results and prescribed medications, such as discharge summaries.
+        Analyze the provided document text and extract the information according to the specified JSON schema.
+        
+        IMPORTANT GUIDELINES:
+        - Create a human-friendly summary that explains the key findings and the purpose of the prescribed treatment
+        - Categorize abnormal values with severity levels (MILD, MODERATE, SEVERE)
+        - Relate the medications to the findings where the document makes that clear
+        - Provide warnings about medication interactions or side effects where relevant
+        - Provide lifestyle recommendations and questions the patient should ask their doctor
+        - Add relevant tags to categorize this document
+        - If information is unclear or missing, use null values rather than guessing
+        - NEVER include any personal information like patient names, addresses, or contact details
+        """
+        
+        schema = json.dumps(MIXED_SCHEMA, indent=2)
+        
+        ai_response = await llm.complete(
+            "extract_text",
+            model=LLM_MODEL,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": f"Extract information from this medical document according to the schema. Use strict JSON format.\n\nSCHEMA: {schema}\n\nDOCUMENT TEXT: {redacted_text}"}
+            ],
+            temperature=0.1,
+            max_completion_tokens=3072,
+            top_p=1,
+            response_format={"type": "json_object"}
+        )
+        
+    else:
+        # Use regular prompt for non-specific medical documents
+        system_prompt = """You are a medical assistant AI specialized in interpreting medical documents. 
+        Analyze the provided medical document text and extract key information:
+
+        ## TASK
+        Identify the document type first, then extract and organize relevant medical information:
+        1. DOCUMENT TYPE: Determine what kind of medical document this is
+        2. KEY INFORMATION: Extract the most important medical details
+        3. MEDICAL TERMS: Explain any specialized medical terminology
+        4. SUMMARY: Provide a concise, plain-language overview
+        
+        ## IMPORTANT GUIDELINES
+        - NEVER include any personal information like patient names, addresses, or contact details
+        - Organize information in a logical, easy-to-understand format
+        - Highlight important medical findings or recommendations
+        - If information is unclear or missing, indicate this rather than guessing
+        - Use formatting to improve readability
+        """
+        
+        # Process with Groq AI using enhanced prompting
+        ai_response = await llm.complete(
+            "extract_text",
+            model=LLM_MODEL,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": f"Here is the text extracted from a medical document. Please analyze it according to the instructions:\n\n{redacted_text}"}
+            ],
+            temperature=0.5,
+            max_completion_tokens=1024,
+            top_p=1
+        )
+    
+    # For structured responses, validate JSON
+    structured_data = None
+    if doc_type in STRUCTURED_DOC_TYPES:
+        try:
+            structured_data = json.loads(ai_response)
+        except json.JSONDecodeError:
+            # If JSON parsing fails, try to extract JSON from the text
+            with span("json_repair"):
                 json_match = re.search(r'```json\s*(.*?)\s*```', ai_response, re.DOTALL)
                 if json_match:
                     try:
                         structured_data = json.loads(json_match.group(1))
                     except json.JSONDecodeError:
                         structured_data = None
+
+    return {
+        "system_prompt": system_prompt,
+        "ai_response": ai_response,
+        "structured_data": structured_data
+    }
+
+SUPPORTED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.pdf', '.docx', '.bmp', '.tiff', '.tif', '.webp')
+
+def check_upload(filename: str, ocr_profile: str):
+    """Reject unsupported file types and preprocessing profiles"""
+    # Check if the file has a supported extension
+    if not filename.lower().endswith(SUPPORTED_EXTENSIONS):
+        raise HTTPException(status_code=400, detail="Unsupported file format. Please upload an image, PDF, or DOCX file.")
+    
+    # Preprocessing profile: fast / balanced / max, or auto to pick from image resolution
+    if ocr_profile != "auto" and ocr_profile not in PREPROCESS_PROFILES:
+        raise HTTPException(status_code=400, detail=f"Unknown ocr_profile. Use one of: auto, {', '.join(PREPROCESS_PROFILES)}")
+
+async def analyze_extracted_text(extracted_text: str, extraction: Dict[str, Any], document_type: str,
+                                 match_drugs: bool, progress=no_progress) -> Dict[str, Any]:
+    """Redact, classify and analyze extracted text, and open a chat session on it"""
+    if not extracted_text or len(extracted_text.strip()) < 10:
+        raise HTTPException(status_code=400, detail="Could not extract sufficient text from the file. Please try a clearer image or document.")
+    
+    # Redact potential personal information
+    with span("redact"):
+        redaction = redact(extracted_text)
+    redacted_text = redaction.text
+    
+    # Use provided document type instead of detection
+    doc_type = document_type
+    
+    # Use automatic detection as fallback if "auto" is provided
+    classification = None
+    if doc_type == "auto":
+        with span("classify"):
+            classification = document_classifier.classify(redacted_text)
+        doc_type = classification.doc_type
+    
+    # Reuse the analysis of identical text, otherwise ask the model
+    progress("analysis", document_type=doc_type)
+    analysis_key = content_key("analysis", ANALYSIS_PROMPT_VERSION, doc_type, redacted_text)
+    analysis = await result_cache.aget(analysis_key)
+    CACHE_LOOKUPS.inc(kind="analysis", result="miss" if analysis is None else "hit")
+    if analysis is None:
+        analysis = await analyze_document(redacted_text, doc_type)
+        # A failed JSON parse is worth retrying, so only cache usable results
+        if analysis["structured_data"] is not None or doc_type not in STRUCTURED_DOC_TYPES:
+            await result_cache.aset(analysis_key, analysis)
+
+    system_prompt = analysis["system_prompt"]
+    ai_response = analysis["ai_response"]
+    structured_data = analysis["structured_data"]
+    
+    # Generate a session ID
+    session_id = str(uuid.uuid4())
+    
+    # Store the extracted text and initial conversation for this session
+    await call_store(session_store, "create", session_id, {
+        "extracted_text": redacted_text,
+        "document_type": doc_type,
+        "structured_data": structured_data,
+        "system_prompt": system_prompt,
+        "conversation": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": f"Here is the text extracted from a medical document: {redacted_text}"},
+            {"role": "assistant", "content": ai_response}
+        ]
+    })
+    
+    # Return response with structured data if available
+    response = {
+        "session_id": session_id,
+        "document_type": doc_type,
+        "extracted_text": redacted_text,
+        "extraction": extraction,
+        "redactions": redaction.counts,
+        "initial_analysis": ai_response
+    }
+    if classification is not None:
+        response["classification"] = {"confidence": classification.confidence, "scores": classification.scores}
+    
+    if structured_data:
+        response["structured_data"] = structured_data
+        medications = structured_data.get("medications") or []
+        names = [m["name"] for m in medications if isinstance(m, dict) and m.get("name")]
+        if match_drugs and names:
+            # One catalogue lookup instead of a request per medication
+            with span("drug_match"):
+                response["drug_matches"] = await match_drug_names(names[:DRUG_BATCH_MAX], drug_projection("summary", ""))
         
-        # Generate a session ID
-        session_id = str(uuid.uuid4())
-        
-        # Store the extracted text and initial conversation for this session
-        sessions[session_id] = {
-            "extracted_text": redacted_text,
-            "document_type": doc_type,
-            "structured_data": structured_data,
-            "conversation": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Here is the text extracted from a medical document: {redacted_text}"},
-                {"role": "assistant", "content": ai_response}
-            ]
-        }
+    return response
+
+@app.post("/extract_text/")
+async def extract_text(file: UploadFile = File(...), document_type: str = Form("lab_report"),
+                       ocr_profile: str = Form("auto"), match_drugs: bool = Form(False)):
+    """Extract text from various file formats and process with Groq AI.
+
+    With match_drugs, prescribed medications come back matched to the drug catalogue.
+    For long documents or flaky connections use POST /jobs instead.
+    """
+    try:
+        check_upload(file.filename or "", ocr_profile)
         
-        # Return response with structured data if available
-        response = {
-            "session_id": session_id,
-            "document_type": doc_type,
-            "extracted_text": redacted_text,
-            "initial_analysis": ai_response
-        }
+        # Identical uploads skip OCR entirely
+        upload = await receive_upload(file)
+        try:
+            extracted_text, extraction = await extract_with_cache(upload, document_type, ocr_profile)
+        finally:
+            upload.close()
         
-        if structured_data:
-            response["structured_data"] = structured_data
-            
-        return response
+        return await analyze_extracted_text(extracted_text, extraction, document_type, match_drugs)
         
+    except HTTPException:
+        raise
+    except LLMUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing document: {str(e)}")
 
-@app.post("/chat/{session_id}")
-async def chat(session_id: str, message: Dict[str, Any] = Body(...)):
-    """Chat with AI using the context from the extracted text"""
-    if session_id not in sessions:
-        raise HTTPException(status_code=404, detail="Session not found")
-    
+async def process_job_file(file_path: str, filename: str, options: Dict[str, Any], progress) -> Dict[str, Any]:
+    """One file of a job: the /extract_text/ pipeline on a spooled upload"""
+    try:
+        # The spooled file is used in place (read for the hash, never loaded whole)
+        upload = await run_in_threadpool(Upload.from_path, file_path, filename)
+        extracted_text, extraction = await extract_with_cache(upload, options["document_type"],
+                                                              options["ocr_profile"], progress)
+        return await analyze_extracted_text(extracted_text, extraction, options["document_type"],
+                                            options["match_drugs"], progress)
+    except LLMUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
+# Background analysis jobs: in-process queue, state in memory or MongoDB (JOB_STORE)
+job_runner = JobRunner(create_job_store(db), process_job_file)
+
+registry.gauge("medilink_ocr_jobs_pending", "OCR jobs running in or waiting for a worker",
+               lambda: ocr_engine.pending)
+registry.gauge("medilink_ocr_documents_admitted", "Documents admitted to the OCR worker pool",
+               lambda: ocr_engine.admitted)
+registry.gauge("medilink_jobs_queued", "Analysis jobs waiting for a job worker", lambda: job_runner.queued)
+
+@app.on_event("startup")
+async def start_job_runner():
+    await job_runner.start()
+    readiness.start("jobs", job_runner.recover)
+
+@app.on_event("shutdown")
+async def stop_job_runner():
+    await job_runner.stop()
+
+async def get_job_or_404(job_id: str) -> Dict[str, Any]:
+    job = await job_runner.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.post("/jobs")
+async def create_job(files: List[UploadFile] = File(...), document_type: str = Form("lab_report"),
+                     ocr_profile: str = Form("auto"), match_drugs: bool = Form(False),
+                     idempotency_key: Optional[str] = Header(None)):
+    """Submit one or more documents for analysis and return a job id right away.
+
+    Follow progress with GET /jobs/{job_id} or the /events stream, then fetch
+    /jobs/{job_id}/result. Retrying a submission (same Idempotency-Key header,
+    or the same files and options) returns the existing job with status 200
+    instead of 202.
+    """
+    if len(files) > JOB_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {JOB_MAX_FILES} files per job")
+    for file in files:
+        check_upload(file.filename or "", ocr_profile)
+    # The unique index on the idempotency key must exist before jobs are stored
+    if not await readiness.wait("jobs", JOBS_READY_TIMEOUT):
+        raise HTTPException(
+            status_code=503,
+            detail="Job queue is still starting. Please retry shortly.",
+            headers={"Retry-After": str(int(JOBS_READY_TIMEOUT))}
+        )
+    uploads = []
+    try:
+        for file in files:
+            uploads.append(await receive_upload(file))
+        options = {"document_type": document_type, "ocr_profile": ocr_profile, "match_drugs": match_drugs}
+        if idempotency_key:
+            key = content_key("job", idempotency_key)
+        else:
+            key = content_key("job", json.dumps(options, sort_keys=True),
+                              *[part for upload in uploads for part in (upload.filename, upload.digest)])
+        job, reattached = await job_runner.submit(key, uploads, options)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail="Too many queued jobs. Please retry shortly.",
+                            headers={"Retry-After": str(e.retry_after)})
+    finally:
+        for upload in uploads:
+            upload.close()
+    return JSONResponse(dict(job_view(job), reattached=reattached), status_code=200 if reattached else 202)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Job status with per-file stage and progress (e.g. OCR page k of n)"""
+    return job_view(await get_job_or_404(job_id))
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Job progress as server-sent events: "progress" on every change, then "done" """
+    await get_job_or_404(job_id)
+
+    async def events():
+        last = None
+        async for job in job_runner.watch(job_id):
+            last = job_view(job)
+            yield sse_event(last, event="progress")
+        if last is None:
+            yield sse_event({"detail": "Job not found"}, event="error")
+        else:
+            yield sse_event(last, event="done")
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """Per-file results of a finished job: the /extract_text/ response, or an error"""
+    job = await get_job_or_404(job_id)
+    if job["status"] not in ("done", "failed"):
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}", headers={"Retry-After": "2"})
+    return {
+        "job_id": job_id,
+        "status": job["status"],
+        "results": [
+            {"filename": f["filename"], "status": f["status"], "result": f["result"], "error": f["error"]}
+            for f in job["files"]
+        ]
+    }
+
+async def prepare_chat_request(session_id: str, message: Dict[str, Any]) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
+    """Build the conversation to send for a chat turn and the completion options"""
     user_message = message.get("message", "")
     if not user_message:
         raise HTTPException(status_code=400, detail="Message cannot be empty")
     
-    # Get the conversation history and context from the session
-    conversation = sessions[session_id]["conversation"]
-    doc_type = sessions[session_id]["document_type"]
-    extracted_text = sessions[session_id]["extracted_text"]
-    structured_data = sessions[session_id].get("structured_data")
+    # Get the context and recent conversation history from the session
+    session = await call_store(session_store, "get", session_id, conversation_tail=CHAT_HISTORY_WINDOW)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
     
-    # Choose schema based on document type for structured responses
-    use_schema = False
-    schema_definition = None
+    doc_type = session["document_type"]
+    extracted_text = session["extracted_text"]
+    structured_data = session.get("structured_data")
     
-    if "extract" in user_message.lower() or "summarize" in user_message.lower() or "list" in user_message.lower():
-        use_schema = True
-        if doc_type == "prescription":
-            schema_definition = json.dumps(PRESCRIPTION_SCHEMA, indent=2)
-        elif doc_type == "lab_report":
-            schema_definition = json.dumps(LAB_REPORT_SCHEMA, indent=2)
+    # Structured documents answer extraction-style questions in JSON
+    lowered = user_message.lower()
+    use_schema = doc_type in STRUCTURED_DOC_TYPES and (
+        "extract" in lowered or "summarize" in lowered or "list" in lowered
+    )
     
     # Enhanced context reminder with document type, extracted text, and structured data
     if doc_type == "prescription":
@@ -812,113 +1102,256 @@ async def chat(session_id: str, message: Dict[str, Any] = Body(...)):
         context_reminder = """You are analyzing a laboratory report document. 
         Remember the extracted information while answering additional questions.
         Maintain medical accuracy when discussing test results and explain medical terms clearly."""
+    elif doc_type == "mixed":
+        context_reminder = """You are analyzing a medical document with both test results and prescribed medications. 
+        Remember the extracted information while answering additional questions.
+        Maintain medical accuracy and refer to the structured data when relevant."""
     else:
         context_reminder = """You are analyzing a medical document. 
         Remember the extracted information while answering additional questions.
         Maintain medical accuracy and clarity in your responses."""
     
-    # Add structured data to the context if available
+    # Add structured data to the context if available, serialized once per session
+    session_updates = {}
     structured_data_reminder = ""
     if structured_data:
-        structured_data_summary = json.dumps(structured_data, indent=2)
+        structured_data_summary = session.get("structured_summary")
+        if structured_data_summary is None:
+            structured_data_summary = summarize_structured_data(structured_data)
+            session_updates["structured_summary"] = structured_data_summary
         structured_data_reminder = f"\n\nStructured data extracted from the document:\n{structured_data_summary}"
     
     # Add a reminder of the extracted text (truncated to avoid token limits)
     text_reminder = f"Extracted text (truncated): {extracted_text[:200]}..."
     
-    # Add an enhanced context message at the beginning if it's getting too long
-    if len(conversation) > 6:  # Check if conversation is getting long
-        # Replace the old context with a fresh one to avoid token limits
-        conversation = [
-            {"role": "system", "content": conversation[0]["content"]},
-            {"role": "user", "content": f"{context_reminder}\n\n{text_reminder}{structured_data_reminder}"},
-            {"role": "assistant", "content": "I'll continue assisting you with this medical document, keeping in mind the extracted information and our previous discussion."},
-            # Keep the last 4 messages for immediate context
-            conversation[-4],
-            conversation[-3],
-            conversation[-2],
-            conversation[-1]
-        ]
-    
-    # Add the new user message with better context
-    conversation.append({
+    # Pack history into the token budget, summarizing turns that no longer fit
+    new_message = {
         "role": "user", 
         "content": f"Question about the medical document: {user_message}"
-    })
+    }
+    conversation, summary_updates = build_chat_messages(
+        session["system_prompt"],
+        f"{context_reminder}\n\n{text_reminder}{structured_data_reminder}",
+        session["conversation"],
+        session["message_count"],
+        session.get("history_summary", ""),
+        session.get("summarized_count", 0),
+        new_message
+    )
+    session_updates.update(summary_updates)
+    if session_updates:
+        await call_store(session_store, "update", session_id, session_updates)
+    
+    if use_schema:
+        # JSON mode needs the prompt to ask for JSON; the field names are already
+        # in the structured data, so the full schema isn't resent every turn
+        conversation.insert(-1, {"role": "system", "content": JSON_ANSWER_INSTRUCTION})
+        options = {"temperature": 0.5, "max_completion_tokens": 1024, "top_p": 1,
+                   "response_format": {"type": "json_object"}}
+    else:
+        options = {"temperature": 0.7, "max_completion_tokens": 1024, "top_p": 1}
+    return conversation, options
+
+@app.post("/chat/{session_id}")
+async def chat(session_id: str, message: Dict[str, Any] = Body(...)):
+    """Chat with AI using the context from the extracted text"""
+    conversation, options = await prepare_chat_request(session_id, message)
     
     # Send to Groq AI with conversation context
     try:
-        if use_schema and schema_definition:
-            completion = client.chat.completions.create(
-                model="meta-llama/llama-4-scout-17b-16e-instruct",
-                messages=conversation,
-                temperature=0.5,
-                max_completion_tokens=1024,
-                top_p=1,
-                response_format={"type": "json_object"}
-            )
-        else:
-            completion = client.chat.completions.create(
-                model="meta-llama/llama-4-scout-17b-16e-instruct",
-                messages=conversation,
-                temperature=0.7,
-                max_completion_tokens=1024,
-                top_p=1,
-            )
-        
-        # Get the response
-        ai_response = completion.choices[0].message.content
+        ai_response = await llm.complete("chat", model=LLM_MODEL, messages=conversation, **options)
         
-        # Add the AI response to the conversation
-        conversation.append({"role": "assistant", "content": ai_response})
-        
-        # Update the session
-        sessions[session_id]["conversation"] = conversation
+        # Store the new turn (question and answer) in the session
+        await call_store(session_store, "append_messages", session_id, [
+            conversation[-1],
+            {"role": "assistant", "content": ai_response}
+        ])
         
         return {"response": ai_response}
+    except LLMUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error from AI service: {str(e)}")
 
-@app.get("/drugs")
-async def get_drugs(search: str = "", limit: int = 20, page: int = 0, id: str = ""):
-    """Fetch drugs from MongoDB with pagination and search"""
+def sse_event(data: Dict[str, Any], event: Optional[str] = None) -> str:
+    """Format one server-sent event"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+@app.post("/chat/{session_id}/stream")
+async def chat_stream(session_id: str, message: Dict[str, Any] = Body(...)):
+    """Chat with AI, streaming the reply as server-sent events.
+    
+    Emits {"token": ...} events as the model produces text, then a "done" event
+    with the full response (or an "error" event). The assembled reply is saved
+    to the session like a regular chat turn.
+    """
+    conversation, options = await prepare_chat_request(session_id, message)
+    
+    async def events():
+        parts = []
+        tokens = llm.stream("chat", model=LLM_MODEL, messages=conversation, **options)
+        try:
+            async for token in tokens:
+                parts.append(token)
+                yield sse_event({"token": token})
+        except Exception as e:
+            yield sse_event({"detail": f"Error from AI service: {str(e)}"}, event="error")
+            return
+        finally:
+            # Releases the model connection and permits if the client went away
+            await tokens.aclose()
+        
+        ai_response = "".join(parts)
+        await call_store(session_store, "append_messages", session_id, [
+            conversation[-1],
+            {"role": "assistant", "content": ai_response}
+        ])
+        yield sse_event({"response": ai_response}, event="done")
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+class DrugJSONResponse(JSONResponse):
+    """orjson-encoded response; ObjectIds and dates are serialized as strings"""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=str)
+
+@app.get("/drugs", response_class=DrugJSONResponse)
+async def get_drugs(search: str = "", limit: int = 20, page: int = 0, id: str = "",
+                    cursor: str = "", count: str = "exact", mode: str = "full", fields: str = ""):
+    """Fetch drugs from MongoDB with cursor pagination and search.
+
+    Pass the returned `next` cursor to get the following page (`page` still
+    works but skips). `count` is "exact" (cached per query), "estimate" or "none".
+    `mode=summary` or `fields=title,price,...` trims list entries; the id
+    lookup always returns the whole document.
+    """
+    if count not in COUNT_MODES:
+        raise HTTPException(status_code=400, detail=f"count must be one of {', '.join(COUNT_MODES)}")
+    if mode not in ("full", "summary"):
+        raise HTTPException(status_code=400, detail="mode must be full or summary")
+    if not 1 <= limit <= DRUG_PAGE_MAX:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {DRUG_PAGE_MAX}")
+    if page < 0:
+        raise HTTPException(status_code=400, detail="page must not be negative")
+    try:
+        projection = drug_projection(mode, fields)
+        position = decode_cursor(cursor) if cursor else {}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     try:
         # If an ID is provided, fetch that specific drug
         if id:
-            drug = drugs_collection.find_one({"_id": id})
-            if drug:
-                # Convert ObjectId to string
-                drug["_id"] = str(drug["_id"])
-                return {"drug": drug}
-            return {"drug": None}
-
-        # Create a search query
-        query = {}
-        if search:
-            query = {"title": {"$regex": search, "$options": "i"}}
-
-        # Fetch drugs with pagination
-        drugs = list(drugs_collection.find(query)
-                    .sort("title", 1)
-                    .skip(page * limit)
-                    .limit(limit))
-        
-        # Convert ObjectId to string for JSON serialization
-        for drug in drugs:
-            drug["_id"] = str(drug["_id"])
+            return DrugJSONResponse({"drug": await drug_cache.get_document(id)})
 
-        # Get total count for pagination
-        total = drugs_collection.count_documents(query)
+        # Whole pages are cached per catalogue version
+        page_key = drug_cache.page_key(await drug_catalog.version(), {
+            "search": search, "limit": limit, "page": page, "cursor": cursor,
+            "count": count, "mode": mode, "fields": fields
+        })
+        body = drug_cache.pages.get(page_key)
+        if body is not None:
+            return DrugJSONResponse(body)
 
-        return {
+        # Ranked search from the in-memory index once it is loaded; its cursor is an offset
+        results = None
+        if search and "t" not in position:
+            offset = position.get("o", page * limit)
+            with span("drug_search"):
+                results = drug_search.search(search, limit, offset)
+        if results is not None:
+            ids, total = results
+            found = await drug_cache.get_documents(ids)
+            drugs = [project(found[str(drug_id)], projection) for drug_id in ids if str(drug_id) in found]
+            next_cursor = encode_cursor({"o": offset + len(ids)}) if offset + len(ids) < total else None
+        else:
+            # Anchored prefix query on the normalized title (index-backed, input escaped)
+            query = DrugSearch.fallback_query(search) if search else {}
+            page_query = query
+            if "t" in position:
+                page_query = {"$and": [query, keyset_filter(position)]} if query else keyset_filter(position)
+            listing = drugs_collection.find(page_query, projection).sort([("title", 1), ("_id", 1)])
+            if "o" in position or (page and not position):
+                listing = listing.skip(position.get("o", page * limit))
+            # One extra row tells whether there is a next page
+            drugs = await run_in_threadpool(list, listing.limit(limit + 1))
+            next_cursor = keyset_cursor(drugs[limit - 1]) if len(drugs) > limit else None
+            drugs = drugs[:limit]
+            total = await drug_catalog.count(query, count)
+
+        body = {
             "drugs": drugs,
+            "next": next_cursor,
             "total": total,
             "page": page,
             "limit": limit,
-            "totalPages": (total + limit - 1) // limit
+            "totalPages": (total + limit - 1) // limit if total is not None else None
         }
+        drug_cache.pages.set(page_key, body)
+        # Returned as a response directly: orjson encodes the ObjectIds, skipping
+        # FastAPI's generic encoder
+        return DrugJSONResponse(body)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        return DrugJSONResponse({"error": f"Failed to fetch drugs: {str(e)}"}, status_code=500)
+
+async def match_drug_names(names: List[str], projection: Optional[Dict[str, int]]) -> List[Dict[str, Any]]:
+    """Best catalogue match and its score for each medication name"""
+    candidates = drug_search.candidates(names)
+    if candidates is None:
+        # Index still loading: one anchored query covering every name's first word
+        listing = drugs_collection.find(DrugSearch.fallback_match_query(names)).limit(50 * len(names))
+        documents = {str(drug["_id"]): drug for drug in await run_in_threadpool(list, listing)}
+        candidates = {name: list(documents) for name in names}
+    else:
+        documents = await drug_cache.get_documents({drug_id for ids in candidates.values() for drug_id in ids})
+    matches = []
+    for name in names:
+        drug, score = best_match(name, (documents[str(i)] for i in candidates[name] if str(i) in documents))
+        if drug is not None:
+            drug = project(drug, projection)
+            drug["_id"] = str(drug["_id"])
+        matches.append({"name": name, "drug": drug, "score": score})
+    return matches
+
+@app.post("/drugs/batch", response_class=DrugJSONResponse)
+async def get_drugs_batch(request: Dict[str, Any] = Body(...)):
+    """Resolve a list of medication names and/or drug ids in one round-trip.
+
+    Body: {"names": [...], "ids": [...], "mode": "summary" | "full", "fields": "..."}.
+    Ids are fetched with a single $in query; names are fuzzy-matched against the
+    catalogue and come back with their best match and a 0-1 score.
+    """
+    names, ids = request.get("names") or [], request.get("ids") or []
+    if not all(isinstance(v, list) and all(isinstance(x, str) for x in v) for v in (names, ids)):
+        raise HTTPException(status_code=400, detail="names and ids must be lists of strings")
+    if len(names) + len(ids) > DRUG_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {DRUG_BATCH_MAX} names and ids per request")
+    try:
+        projection = drug_projection(request.get("mode", "summary"), request.get("fields", ""))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        found = await drug_cache.get_documents([parse_id(i) for i in ids]) if ids else {}
+        return DrugJSONResponse({
+            "ids": [{"id": i, "drug": project(found[i], projection) if i in found else None} for i in ids],
+            "names": await match_drug_names(names, projection) if names else []
+        })
     except Exception as e:
-        return {"error": f"Failed to fetch drugs: {str(e)}"}, 500
+        return DrugJSONResponse({"error": f"Failed to look up drugs: {str(e)}"}, status_code=500)
+
+@app.get("/drugs/cache")
+async def get_drug_cache_stats():
+    """Hit/miss counters of the drug document and page caches"""
+    return drug_cache.stats()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,291 @@
+"""Latency instrumentation.
+
+Stages of a request (upload read, OCR preprocessing and engines, redaction,
+model calls, MongoDB commands...) are timed with span(stage) or, for work done
+elsewhere such as the OCR worker processes, reported with record(stage, ms).
+Every stage feeds a histogram, and the stages of the current request are also
+collected so the middleware can return them in a Server-Timing header (stages
+that run in parallel, like the pages of a PDF, add up). Blocking calls made
+for a request go through asyncio.to_thread, which, unlike run_in_executor,
+carries the request's context into the thread, so their stages are counted
+too. The registry renders
+everything in the Prometheus text format for /metrics; each uvicorn worker
+process has its own registry.
+
+For finding hot paths under real load, PROFILE_SAMPLE_RATE enables a sampling
+profiler on a share of requests: while such a request runs, the stacks of all
+threads are sampled every PROFILE_INTERVAL seconds and written in collapsed
+stack format (flamegraph.pl, speedscope) to PROFILE_DIR. Requests running
+concurrently on the same event loop show up in the same samples.
+"""
+import bisect
+import contextlib
+import contextvars
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter as StackCounter
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+# Share of requests profiled (0 disables the profiler)
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", 0.005))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "medilink-profiles"))
+# Profiles of requests faster than this are discarded
+PROFILE_MIN_SECONDS = float(os.environ.get("PROFILE_MIN_SECONDS", 0))
+
+# Seconds; OCR and model calls take up to minutes, cache hits under a millisecond
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 20, 30, 60, 120)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    """Monotonic count per label set"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}  # label values -> count
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per label set"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._values = {}  # label values -> [bucket counts..., sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * len(self.buckets) + [0.0]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = sorted((key, list(counts)) for key, counts in self._values.items())
+        for key, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}"
+            labels = _format_labels(self.labels, key)
+            yield f"{self.name}_sum{labels} {_format_value(round(counts[-1], 6))}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Gauge:
+    """Value read from a callback when metrics are collected"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, read: Callable[[], float]):
+        self.name = name
+        self.help = help
+        self.read = read
+
+    def samples(self) -> Iterator[str]:
+        yield f"{self.name} {_format_value(self.read())}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _add(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name: str, help: str, read: Callable[[], float]) -> Gauge:
+        return self._add(Gauge(name, help, read))
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+REQUESTS = registry.counter("medilink_http_requests_total", "HTTP requests by route and status",
+                            ("method", "route", "status"))
+REQUEST_SECONDS = registry.histogram("medilink_http_request_duration_seconds",
+                                     "Time until the response headers are sent", ("method", "route"))
+STAGE_SECONDS = registry.histogram("medilink_stage_duration_seconds",
+                                   "Time spent in each processing stage", ("stage",))
+
+# Stage -> milliseconds for the request being handled (None outside requests)
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def begin_request() -> Dict[str, float]:
+    """Start collecting stage timings for the current request"""
+    timings = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def record(stage: str, milliseconds: float):
+    """Record a stage measured elsewhere (e.g. in an OCR worker process)"""
+    STAGE_SECONDS.observe(milliseconds / 1000, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + milliseconds
+
+
+def record_all(timings: Dict[str, float]):
+    for stage, milliseconds in timings.items():
+        record(stage, milliseconds)
+
+
+@contextlib.contextmanager
+def span(stage: str):
+    """Time the block as stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, (time.perf_counter() - started) * 1000)
+
+
+def server_timing(timings: Dict[str, float], total_seconds: float) -> str:
+    """Server-Timing header value for the stages of a request"""
+    entries = [f"{stage};dur={milliseconds:.1f}" for stage, milliseconds in timings.items()]
+    entries.append(f"total;dur={total_seconds * 1000:.1f}")
+    return ", ".join(entries)
+
+
+def observe_request(method: str, route: str, status: int, seconds: float):
+    REQUESTS.inc(method=method, route=route, status=status)
+    REQUEST_SECONDS.observe(seconds, method=method, route=route)
+
+
+def mongo_listener():
+    """pymongo command listener recording every command as a mongo_<command> stage"""
+    from pymongo import monitoring
+
+    class MongoCommandTimer(monitoring.CommandListener):
+        def started(self, event):
+            pass
+
+        def succeeded(self, event):
+            record(f"mongo_{event.command_name}", event.duration_micros / 1000)
+
+        def failed(self, event):
+            record(f"mongo_{event.command_name}", event.duration_micros / 1000)
+
+    return MongoCommandTimer()
+
+
+class SamplingProfiler:
+    """Samples the stacks of all threads from a background thread"""
+
+    _active = threading.Lock()  # one profile at a time
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks = StackCounter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def maybe_start(cls, rate: float = PROFILE_SAMPLE_RATE) -> Optional["SamplingProfiler"]:
+        """A running profiler for a sampled request, or None"""
+        if rate <= 0 or random.random() >= rate or not cls._active.acquire(blocking=False):
+            return None
+        profiler = cls()
+        profiler._thread = threading.Thread(target=profiler._run, name="sampling-profiler", daemon=True)
+        profiler._thread.start()
+        return profiler
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._active.release()
+
+    def dump(self, name: str, directory: str = PROFILE_DIR) -> str:
+        """Write the samples as "frame;frame;... count" lines and return the path"""
+        os.makedirs(directory, exist_ok=True)
+        safe_name = "".join(c if c.isalnum() else "_" for c in name).strip("_")
+        path = os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{safe_name}-{uuid.uuid4().hex[:8]}.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
@@ -0,0 +1,600 @@
+"""OCR execution engine.
+
+CPU-bound OCR work (preprocessing, EasyOCR, Tesseract, PDF rendering) runs in a
+process pool where every worker keeps one warm EasyOCR reader, so a long OCR job
+never blocks the event loop serving the rest of the API. OpenCV, EasyOCR and
+the Tesseract and poppler bindings are only imported where they are used (in
+the workers), and OCREngine.warm_up loads and exercises the model in the
+background after startup.
+"""
+import asyncio
+import contextlib
+import io
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from startup import lazy_import
+
+np = lazy_import("numpy")
+cv2 = lazy_import("cv2")
+easyocr = lazy_import("easyocr")
+Image = lazy_import("PIL.Image")
+pytesseract = lazy_import("pytesseract")
+pdf2image = lazy_import("pdf2image")
+
+# Engine settings (override through environment variables)
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+# Documents (a PDF or an image) being OCR'd at once; further uploads get a 429
+OCR_QUEUE_SIZE = int(os.environ.get("OCR_QUEUE_SIZE", 16))
+# Seconds one job (an image or a PDF page) may run in a worker, not counting
+# the time it waits for a free worker
+OCR_JOB_TIMEOUT = float(os.environ.get("OCR_JOB_TIMEOUT", 120))
+OCR_TORCH_THREADS = int(os.environ.get("OCR_TORCH_THREADS", 1))
+# Pages of one PDF being rendered/OCR'd at the same time; caps peak memory per document
+PDF_MAX_INFLIGHT_PAGES = int(os.environ.get("PDF_MAX_INFLIGHT_PAGES", OCR_WORKERS))
+PDF_RENDER_DPI = 300
+# A page's embedded text layer is used instead of OCR when it has at least this
+# many characters and this share of them look like real text
+PDF_TEXT_LAYER_MIN_CHARS = int(os.environ.get("PDF_TEXT_LAYER_MIN_CHARS", 40))
+PDF_TEXT_LAYER_MIN_QUALITY = float(os.environ.get("PDF_TEXT_LAYER_MIN_QUALITY", 0.85))
+
+MODEL_DIR = os.path.join(os.path.dirname(__file__), 'models')
+
+# Preprocessing quality profiles, from cheapest to most thorough.
+#   target_dpi        resolution the image is resized to (in a single step)
+#   denoise_strength  fastNlMeansDenoising strength, 0 to skip
+#   bilateral         bilateralFilter (d, sigmaColor, sigmaSpace), None to skip
+PREPROCESS_PROFILES = {
+    "fast": {"target_dpi": 200, "denoise_strength": 0, "clahe": False, "bilateral": None},
+    "balanced": {"target_dpi": 300, "denoise_strength": 0, "clahe": True, "bilateral": (5, 50, 50)},
+    "max": {"target_dpi": 300, "denoise_strength": 10, "clahe": True, "bilateral": (9, 75, 75)},
+}
+# Photos carry no DPI, so assume the long side of the picture is one page
+ASSUMED_PAGE_INCHES = 11.0
+MAX_UPSCALE = 2.0
+MAX_PREPROCESS_DIMENSION = 4500
+# "auto" only trusts the resolution for clean pages: grainier than AUTO_NOISE_SIGMA
+# (gray levels, in flat areas) or with less than AUTO_MIN_CONTRAST between paper
+# and ink gets the "max" profile
+AUTO_NOISE_SIGMA = float(os.environ.get("AUTO_NOISE_SIGMA", 1.0))
+AUTO_MIN_CONTRAST = int(os.environ.get("AUTO_MIN_CONTRAST", 100))
+NOISE_SAMPLE_SIZE = 512
+
+# OCR cascade: stop once the mean EasyOCR confidence reaches OCR_CONFIDENCE_THRESHOLD,
+# otherwise re-read regions below OCR_REGION_CONFIDENCE with Tesseract
+OCR_CONFIDENCE_THRESHOLD = float(os.environ.get("OCR_CONFIDENCE_THRESHOLD", 0.75))
+OCR_REGION_CONFIDENCE = float(os.environ.get("OCR_REGION_CONFIDENCE", 0.5))
+# Images whose grayscale standard deviation is below this are treated as blank
+BLANK_PAGE_STDDEV = 4.0
+
+# One EasyOCR reader per worker process, created by the pool initializer
+_reader = None
+_clahe = None
+
+
+class OCRQueueFull(Exception):
+    """Raised when the OCR queue has no room for another job"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"OCR queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class OCRTimeout(Exception):
+    """Raised when an OCR job does not finish within its timeout"""
+
+
+def _init_worker():
+    """Load and warm the EasyOCR model once when a worker process starts"""
+    global _reader
+    # Keep each worker single-threaded so N workers don't oversubscribe the CPU
+    cv2.setNumThreads(1)
+    try:
+        import torch
+        torch.set_num_threads(OCR_TORCH_THREADS)
+    except ImportError:
+        pass
+    _reader = get_reader()
+    _warm_up_reader(_reader)
+
+
+def _warm_up_reader(reader):
+    """One throwaway inference, so the first real job doesn't pay for the
+    model's first-call setup (allocations, kernel selection)"""
+    img = np.full((64, 320), 255, dtype=np.uint8)
+    cv2.putText(img, "Paracetamol 500 mg", (8, 42), cv2.FONT_HERSHEY_SIMPLEX, 0.9, 0, 2)
+    reader.readtext(img)
+
+
+def warm_up_job() -> int:
+    """No-op job: it only runs once its worker has finished _init_worker"""
+    return os.getpid()
+
+
+def get_reader():
+    """Return this process's EasyOCR reader, creating it on first use"""
+    global _reader
+    if _reader is None:
+        _reader = easyocr.Reader(
+            ['en'],
+            gpu=False,  # Set to True if GPU is available
+            model_storage_directory=MODEL_DIR,
+            download_enabled=True,
+            quantize=True  # Use quantization for faster inference
+        )
+    return _reader
+
+
+@contextlib.contextmanager
+def _timed(timings: Optional[Dict[str, float]], stage: str):
+    """Add the block's duration in milliseconds to timings[stage]"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + (time.perf_counter() - started) * 1000
+
+
+def estimate_dpi(img) -> float:
+    """Guess an image's DPI by assuming its long side spans a letter/A4 page"""
+    return max(img.shape[:2]) / ASSUMED_PAGE_INCHES
+
+
+def measure_quality(gray) -> Tuple[float, int]:
+    """Noise (gray levels) and paper-to-ink contrast of a grayscale image.
+
+    Noise is the typical standard deviation of 8x8 blocks in a central crop at
+    the source resolution, which flat paper dominates; contrast is the gap
+    between the median and the darkest 0.1% of the pixels (text can cover
+    well under 1% of a page).
+    """
+    height, width = gray.shape[:2]
+    top = max(0, (height - NOISE_SAMPLE_SIZE) // 2)
+    left = max(0, (width - NOISE_SAMPLE_SIZE) // 2)
+    crop = gray[top:top + NOISE_SAMPLE_SIZE, left:left + NOISE_SAMPLE_SIZE]
+    rows, cols = crop.shape[0] // 8 * 8, crop.shape[1] // 8 * 8
+    blocks = crop[:rows, :cols].astype(np.float32).reshape(rows // 8, 8, cols // 8, 8)
+    noise = float(np.percentile(blocks.std(axis=(1, 3)), 25)) if rows and cols else 0.0
+
+    # Percentiles from a histogram of every other pixel, which is much cheaper than sorting
+    histogram = np.bincount(gray[::2, ::2].ravel(), minlength=256).cumsum()
+    ink = int(np.searchsorted(histogram, histogram[-1] * 0.001))
+    paper = int(np.searchsorted(histogram, histogram[-1] * 0.5))
+    return noise, paper - ink
+
+
+def choose_profile(img, dpi: Optional[float] = None) -> str:
+    """Pick a preprocessing profile from the image's (estimated) resolution and quality"""
+    dpi = dpi or estimate_dpi(img)
+    gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    noise, contrast = measure_quality(gray)
+    if noise > AUTO_NOISE_SIGMA or contrast < AUTO_MIN_CONTRAST:
+        return "max"
+    if dpi >= 250:
+        return "fast"
+    if dpi >= 150:
+        return "balanced"
+    return "max"
+
+
+def _get_clahe():
+    # CLAHE objects are reusable, so build one per worker process
+    global _clahe
+    if _clahe is None:
+        _clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+    return _clahe
+
+
+def preprocess_image(img, profile: str = "auto", dpi: Optional[float] = None,
+                     is_handwritten: bool = False, timings: Optional[Dict[str, float]] = None):
+    """Apply advanced preprocessing techniques to enhance OCR accuracy.
+
+    profile is one of PREPROCESS_PROFILES or "auto"; dpi is the source resolution
+    when known (rendered PDF pages) and estimated otherwise. When a timings dict
+    is passed, the milliseconds spent in each stage are recorded in it.
+    """
+    clock = time.perf_counter()
+
+    def mark(stage):
+        nonlocal clock
+        if timings is not None:
+            now = time.perf_counter()
+            timings[stage] = timings.get(stage, 0.0) + (now - clock) * 1000
+            clock = now
+
+    dpi = dpi or estimate_dpi(img)
+
+    # Convert to grayscale first so every later stage works on one channel
+    gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    mark("grayscale")
+
+    if profile == "auto":
+        profile = choose_profile(gray, dpi)
+        mark("choose_profile")
+    settings = PREPROCESS_PROFILES[profile]
+
+    # Denoise at the source resolution, before any upscaling makes it costlier
+    if settings["denoise_strength"]:
+        gray = cv2.fastNlMeansDenoising(gray, None, settings["denoise_strength"], 7, 21)
+        mark("denoise")
+
+    # A single resize to the profile's target resolution, capped in size
+    height, width = gray.shape[:2]
+    scale = min(settings["target_dpi"] / dpi, MAX_UPSCALE,
+                MAX_PREPROCESS_DIMENSION / max(height, width))
+    if abs(scale - 1.0) > 0.05:
+        interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_CUBIC
+        gray = cv2.resize(gray, (int(width * scale), int(height * scale)), interpolation=interpolation)
+    mark("resize")
+
+    # Enhance contrast using CLAHE (Contrast Limited Adaptive Histogram Equalization)
+    if settings["clahe"]:
+        gray = _get_clahe().apply(gray)
+        mark("clahe")
+
+    # Apply bilateral filter to reduce noise while preserving edges
+    if settings["bilateral"]:
+        gray = cv2.bilateralFilter(gray, *settings["bilateral"])
+        mark("bilateral")
+
+    if is_handwritten:
+        # Special processing for handwritten text
+        # Sharpen the image to enhance handwriting strokes
+        kernel = np.array([[-1, -1, -1], [-1, 9, -1], [-1, -1, -1]])
+        sharpened = cv2.filter2D(gray, -1, kernel)
+
+        # Apply Otsu's thresholding for handwritten content
+        _, thresh = cv2.threshold(sharpened, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+
+        # Apply morphological operations to connect broken strokes in handwriting
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2, 2))
+        closed = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
+        mark("threshold")
+
+        return closed
+    else:
+        # For printed text, use adaptive thresholding
+        thresh = cv2.adaptiveThreshold(
+            gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+            cv2.THRESH_BINARY, 11, 2
+        )
+        mark("threshold")
+
+        return thresh
+
+
+def is_blank(img) -> bool:
+    """Whether an image is (close to) a uniform blank page"""
+    gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return float(gray.std()) < BLANK_PAGE_STDDEV
+
+
+def _box_crop(img, box, pad: int = 4):
+    """Axis-aligned crop around an EasyOCR quadrilateral"""
+    points = np.array(box)
+    height, width = img.shape[:2]
+    x0, y0 = np.maximum(points.min(axis=0).astype(int) - pad, 0)
+    x1, y1 = np.minimum(points.max(axis=0).astype(int) + pad, [width, height])
+    return img[y0:y1, x0:x1]
+
+
+def _tesseract_region(crop):
+    """OCR one text region with Tesseract, returning (text, confidence 0-1)"""
+    data = pytesseract.image_to_data(Image.fromarray(crop), config="--psm 7",
+                                     output_type=pytesseract.Output.DICT)
+    words, confidences = [], []
+    for word, conf in zip(data["text"], data["conf"]):
+        conf = float(conf)
+        if word.strip() and conf >= 0:
+            words.append(word)
+            confidences.append(conf / 100)
+    if not words:
+        return "", 0.0
+    return " ".join(words), sum(confidences) / len(confidences)
+
+
+def _mean_confidence(regions) -> float:
+    """Mean confidence over regions, weighted by the length of their text"""
+    total = sum(len(text) for _, text, _ in regions)
+    if not total:
+        return 0.0
+    return sum(len(text) * conf for _, text, conf in regions) / total
+
+
+def _regions_to_text(regions) -> str:
+    """Join OCR regions into lines in reading order"""
+    if not regions:
+        return ""
+    boxes = []
+    for box, text, _ in regions:
+        points = np.array(box)
+        top, bottom = points[:, 1].min(), points[:, 1].max()
+        boxes.append(((top + bottom) / 2, bottom - top, points[:, 0].min(), text))
+    boxes.sort()
+    line_gap = float(np.median([b[1] for b in boxes])) / 2
+
+    lines, current, current_y = [], [], None
+    for center_y, _, left, text in boxes:
+        if current and center_y - current_y > line_gap:
+            lines.append(current)
+            current = []
+        if not current:
+            current_y = center_y
+        current.append((left, text))
+    lines.append(current)
+    return "\n".join(" ".join(text for _, text in sorted(line)) for line in lines)
+
+
+def _empty_result(blank: bool = False) -> Dict[str, Any]:
+    result = {"text": "", "confidence": 0.0, "engines": [], "regions": 0, "escalated": 0}
+    if blank:
+        result["blank"] = True
+    return result
+
+
+def ocr_cascade(img, profile: str = "auto", dpi: Optional[float] = None,
+                timings: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+    """OCR an image, escalating only as far as its confidence requires.
+
+    EasyOCR reads the preprocessed image first. If the mean confidence reaches
+    OCR_CONFIDENCE_THRESHOLD the result is returned as is; otherwise only the
+    regions below OCR_REGION_CONFIDENCE are cropped and re-read with Tesseract,
+    keeping whichever reading is more confident. Blank images are not OCR'd.
+    When a timings dict is passed, the milliseconds spent in preprocessing and
+    in each engine are recorded in it.
+    """
+    if is_blank(img):
+        return _empty_result(blank=True)
+    result = _empty_result()
+
+    reader = get_reader()
+    with _timed(timings, "preprocess"):
+        source = preprocess_image(img, profile, dpi)
+    with _timed(timings, "easyocr"):
+        regions = [list(r) for r in reader.readtext(source, paragraph=False)]
+    result["engines"].append("easyocr")
+
+    # Nothing detected after preprocessing: give the raw image one chance
+    if not regions:
+        source = img
+        with _timed(timings, "easyocr"):
+            regions = [list(r) for r in reader.readtext(source, paragraph=False)]
+        result["engines"].append("easyocr_raw")
+
+    # Still nothing: a single full-page Tesseract pass as the last resort
+    if not regions:
+        with _timed(timings, "tesseract"):
+            text = pytesseract.image_to_string(Image.fromarray(source))
+        result["engines"].append("tesseract")
+        result["text"] = text
+        return result
+
+    confidence = _mean_confidence(regions)
+    if confidence < OCR_CONFIDENCE_THRESHOLD:
+        escalated = 0
+        for region in regions:
+            box, text, conf = region
+            if conf >= OCR_REGION_CONFIDENCE:
+                continue
+            crop = _box_crop(source, box)
+            if crop.size == 0:
+                continue
+            escalated += 1
+            with _timed(timings, "tesseract"):
+                alt_text, alt_conf = _tesseract_region(crop)
+            if alt_text and alt_conf > conf:
+                region[1], region[2] = alt_text, alt_conf
+        if escalated:
+            result["engines"].append("tesseract_regions")
+            result["escalated"] = escalated
+            confidence = _mean_confidence(regions)
+
+    result["text"] = _regions_to_text(regions)
+    result["confidence"] = round(float(confidence), 3)
+    result["regions"] = len(regions)
+    return result
+
+
+def ocr_image_file(source: Union[bytes, bytearray, str], profile: str = "auto") -> Dict[str, Any]:
+    """OCR an image through the confidence cascade.
+
+    source is the encoded image itself, decoded straight from the buffer, or a
+    file path. The result's "timings" holds milliseconds per stage."""
+    timings = {}
+    with _timed(timings, "decode"):
+        if isinstance(source, str):
+            img = cv2.imread(source)
+        else:
+            img = cv2.imdecode(np.frombuffer(source, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Could not read image")
+    return dict(ocr_cascade(img, profile, timings=timings), timings=timings)
+
+
+def pdf_page_count(file_path: str) -> int:
+    """Number of pages in a PDF, read with poppler's pdfinfo"""
+    return int(pdf2image.pdfinfo_from_path(file_path)["Pages"])
+
+
+def ocr_pdf_page(file_path: str, page_number: int, profile: str = "auto") -> Dict[str, Any]:
+    """Render a single PDF page and OCR it through the confidence cascade.
+    The result's "timings" holds milliseconds per stage."""
+    timings = {}
+    # Only this page is rasterized, so a worker never holds the whole document
+    with _timed(timings, "render"):
+        images = pdf2image.convert_from_path(
+            file_path, dpi=PDF_RENDER_DPI, first_page=page_number, last_page=page_number
+        )
+        if images:
+            img_np = cv2.cvtColor(np.array(images[0]), cv2.COLOR_RGB2BGR)
+    if not images:
+        return dict(_empty_result(blank=True), timings=timings)
+    del images
+    return dict(ocr_cascade(img_np, profile, dpi=PDF_RENDER_DPI, timings=timings), timings=timings)
+
+
+def _pdf_stream(source: Union[bytes, bytearray, str]):
+    return open(source, "rb") if isinstance(source, str) else io.BytesIO(memoryview(source))
+
+
+def read_pdf_text_layer(source: Union[bytes, bytearray, str]) -> List[str]:
+    """Return the embedded text of every PDF page ([] if it can't be read).
+    source is the PDF itself or a file path."""
+    # Try PyPDF2 first (fast, pure Python)
+    try:
+        import PyPDF2
+        with _pdf_stream(source) as pdf_file:
+            pdf_reader = PyPDF2.PdfReader(pdf_file)
+            return [page.extract_text() or "" for page in pdf_reader.pages]
+    except Exception:
+        # Fall back to pdfplumber, which copes with more unusual encodings
+        try:
+            import pdfplumber
+            with _pdf_stream(source) as stream, pdfplumber.open(stream) as pdf:
+                return [page.extract_text() or "" for page in pdf.pages]
+        except Exception:
+            return []
+
+
+def text_layer_quality(text: str) -> float:
+    """Share of a text layer's characters that look like real text (0.0-1.0)"""
+    stripped = text.strip()
+    if not stripped:
+        return 0.0
+    # Unmapped glyphs come out as "(cid:123)" or the replacement character
+    garbage = sum(len(m) for m in re.findall(r'\(cid:\d+\)', stripped)) + stripped.count('\ufffd')
+    readable = sum(1 for c in stripped if c.isalnum() or c.isspace() or c in '.,:;%()/-+<>=')
+    return max(0.0, (readable - garbage) / len(stripped))
+
+
+def is_usable_text_layer(text: str) -> bool:
+    """Whether a page's text layer is good enough to skip OCR"""
+    return (len(text.strip()) >= PDF_TEXT_LAYER_MIN_CHARS
+            and text_layer_quality(text) >= PDF_TEXT_LAYER_MIN_QUALITY)
+
+
+class OCREngine:
+    """Bounded, process-backed executor for OCR jobs.
+
+    Work is admitted per document: admit() turns a document away while
+    queue_size others are in progress, and once admitted all of its pages run,
+    waiting for a free worker if needed. Jobs are only handed to the pool when
+    a worker is free, so the timeout measures execution, not queueing. A
+    running worker can't be interrupted: a job that times out keeps its worker,
+    and its slot, until it finishes.
+    """
+
+    def __init__(self, workers: int = OCR_WORKERS, queue_size: int = OCR_QUEUE_SIZE,
+                 job_timeout: float = OCR_JOB_TIMEOUT):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.job_timeout = job_timeout
+        self._pool = None
+        # Free workers; created on first use, inside the event loop
+        self._slots = None
+        # Documents admitted and not finished yet
+        self._admitted = 0
+        # Jobs waiting for a worker, and jobs in the pool (including ones whose
+        # caller timed out)
+        self._waiting = 0
+        self._running = 0
+        # Moving average of job duration, used to estimate Retry-After
+        self._avg_job_seconds = 5.0
+
+    def start(self):
+        if self._pool is None:
+            # Forking a process that already runs threads (the event loop's
+            # executor, MongoDB monitors) can deadlock the child, so workers
+            # start from a fresh interpreter
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                             mp_context=multiprocessing.get_context("spawn"))
+
+    async def warm_up(self):
+        """Spawn every worker and return once one has loaded and warmed the model.
+
+        Workers only take jobs after their initializer has run, so jobs never
+        reach a cold worker; the others keep warming up in the background.
+        """
+        self.start()
+        futures = [asyncio.wrap_future(self._pool.submit(warm_up_job)) for _ in range(self.workers)]
+        for future in futures:
+            # Only the first result is awaited; consume the others' errors
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        done, _ = await asyncio.wait(futures, return_when=asyncio.FIRST_COMPLETED)
+        try:
+            done.pop().result()
+        except Exception:
+            # A failed initializer (e.g. the model download) breaks the pool;
+            # drop it so the next attempt starts a fresh one
+            self.shutdown()
+            raise
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    @property
+    def pending(self) -> int:
+        """Jobs running in or waiting for a worker"""
+        return self._waiting + self._running
+
+    @property
+    def admitted(self) -> int:
+        return self._admitted
+
+    def retry_after(self) -> int:
+        """Rough number of seconds until the queued jobs have drained"""
+        waves = max(1, self.pending) / self.workers
+        return max(1, int(round(waves * self._avg_job_seconds)))
+
+    def admit(self):
+        """Reserve room for one document until release() is called.
+        Raises OCRQueueFull when queue_size documents are already in progress."""
+        if self._admitted >= self.queue_size:
+            raise OCRQueueFull(self.retry_after())
+        self._admitted += 1
+
+    def release(self):
+        self._admitted -= 1
+
+    def _job_finished(self, started: float):
+        self._running -= 1
+        self._slots.release()
+        elapsed = time.monotonic() - started
+        self._avg_job_seconds = 0.8 * self._avg_job_seconds + 0.2 * elapsed
+
+    async def run(self, fn, *args, timeout: Optional[float] = None):
+        """Run fn(*args) in a worker process once one is free, with a timeout on
+        its execution. Callers reserve room for the document with admit()."""
+        self.start()
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        try:
+            future = self._pool.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        self._running += 1
+        # The worker stays taken until the job is really finished, even if the
+        # caller already gave up waiting (cancel() can't stop a running job)
+        future.add_done_callback(
+            lambda _: loop.call_soon_threadsafe(self._job_finished, started))
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future),
+                                          timeout or self.job_timeout)
+        except asyncio.TimeoutError:
+            raise OCRTimeout("OCR job timed out")
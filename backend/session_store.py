@@ -0,0 +1,170 @@
+"""Chat session storage.
+
+A session holds the redacted document text, its structured analysis and the
+conversation about it. Two stores share one interface:
+
+- MemorySessionStore: bounded LRU with an idle TTL, for a single worker.
+- MongoSessionStore: a MongoDB collection with a TTL index, so sessions survive
+  restarts and can be shared by any number of uvicorn workers or replicas.
+
+Reads are lazy (callers ask only for the conversation tail they need) and
+conversation turns are appended incrementally instead of rewriting the session.
+Stores with blocking = True do I/O on every call, so async code goes through
+call_store, which runs those calls in the threadpool.
+"""
+import asyncio
+import copy
+import datetime
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+SESSION_STORE = os.environ.get("SESSION_STORE", "memory")
+SESSION_MAX_SESSIONS = int(os.environ.get("SESSION_MAX_SESSIONS", 1000))
+# Sessions idle for longer than this are dropped
+SESSION_TTL = int(os.environ.get("SESSION_TTL", 24 * 3600))
+# Only the most recent messages of a conversation are kept
+SESSION_MAX_MESSAGES = int(os.environ.get("SESSION_MAX_MESSAGES", 200))
+
+
+class MemorySessionStore:
+    """In-process session store with LRU eviction and an idle TTL"""
+
+    # Calls are cheap and must stay on the event loop thread (not thread-safe)
+    blocking = False
+
+    def __init__(self, max_sessions: int = SESSION_MAX_SESSIONS, ttl: int = SESSION_TTL,
+                 max_messages: int = SESSION_MAX_MESSAGES):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self._sessions = OrderedDict()  # session_id -> (expires_at, record)
+
+    def ensure_indexes(self):
+        pass
+
+    def _record(self, session_id: str) -> Optional[Dict[str, Any]]:
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return None
+        expires_at, record = entry
+        if expires_at <= time.time():
+            del self._sessions[session_id]
+            return None
+        # Touch: sliding expiry and most recently used
+        self._sessions[session_id] = (time.time() + self.ttl, record)
+        self._sessions.move_to_end(session_id)
+        return record
+
+    def create(self, session_id: str, session: Dict[str, Any]):
+        record = dict(session)
+        record["conversation"] = list(record.get("conversation", []))[-self.max_messages:]
+        record["message_count"] = len(session.get("conversation", []))
+        self._sessions[session_id] = (time.time() + self.ttl, record)
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def get(self, session_id: str, conversation_tail: int = 0) -> Optional[Dict[str, Any]]:
+        """Session fields plus the last conversation_tail messages (None if missing)"""
+        record = self._record(session_id)
+        if record is None:
+            return None
+        session = {k: v for k, v in record.items() if k != "conversation"}
+        session["conversation"] = copy.deepcopy(record["conversation"][-conversation_tail:]) if conversation_tail else []
+        return session
+
+    def append_messages(self, session_id: str, messages: List[Dict[str, str]]):
+        record = self._record(session_id)
+        if record is None:
+            return
+        record["conversation"].extend(messages)
+        del record["conversation"][:-self.max_messages]
+        record["message_count"] += len(messages)
+
+    def update(self, session_id: str, fields: Dict[str, Any]):
+        record = self._record(session_id)
+        if record is not None:
+            record.update(fields)
+
+    def delete(self, session_id: str):
+        self._sessions.pop(session_id, None)
+
+
+class MongoSessionStore:
+    """Session store backed by a MongoDB collection with a TTL index"""
+
+    # Every call is a network round-trip; async callers run it in a thread
+    blocking = True
+
+    def __init__(self, collection, ttl: int = SESSION_TTL, max_messages: int = SESSION_MAX_MESSAGES):
+        self.collection = collection
+        self.ttl = ttl
+        self.max_messages = max_messages
+
+    def ensure_indexes(self):
+        # MongoDB removes sessions once updated_at is older than the TTL
+        self.collection.create_index("updated_at", expireAfterSeconds=self.ttl)
+
+    @staticmethod
+    def _now():
+        return datetime.datetime.now(datetime.timezone.utc)
+
+    def create(self, session_id: str, session: Dict[str, Any]):
+        document = dict(session)
+        document["_id"] = session_id
+        document["conversation"] = list(session.get("conversation", []))[-self.max_messages:]
+        document["message_count"] = len(session.get("conversation", []))
+        document["updated_at"] = self._now()
+        self.collection.insert_one(document)
+
+    def get(self, session_id: str, conversation_tail: int = 0) -> Optional[Dict[str, Any]]:
+        """Session fields plus the last conversation_tail messages (None if missing)"""
+        # Only the requested slice of the conversation leaves the database
+        projection = {"conversation": {"$slice": -conversation_tail}} if conversation_tail else {"conversation": 0}
+        document = self.collection.find_one_and_update(
+            {"_id": session_id},
+            {"$set": {"updated_at": self._now()}},
+            projection=projection
+        )
+        if document is None:
+            return None
+        document.pop("_id", None)
+        document.pop("updated_at", None)
+        document.setdefault("conversation", [])
+        return document
+
+    def append_messages(self, session_id: str, messages: List[Dict[str, str]]):
+        self.collection.update_one(
+            {"_id": session_id},
+            {
+                "$push": {"conversation": {"$each": messages, "$slice": -self.max_messages}},
+                "$inc": {"message_count": len(messages)},
+                "$set": {"updated_at": self._now()}
+            }
+        )
+
+    def update(self, session_id: str, fields: Dict[str, Any]):
+        self.collection.update_one(
+            {"_id": session_id},
+            {"$set": dict(fields, updated_at=self._now())}
+        )
+
+    def delete(self, session_id: str):
+        self.collection.delete_one({"_id": session_id})
+
+
+async def call_store(store, method: str, *args, **kwargs):
+    """Call a store method, in a worker thread when the store blocks"""
+    fn = getattr(store, method)
+    if store.blocking:
+        return await asyncio.to_thread(fn, *args, **kwargs)
+    return fn(*args, **kwargs)
+
+
+def create_session_store(db):
+    """Session store selected by SESSION_STORE ("memory" or "mongo")"""
+    if SESSION_STORE == "mongo":
+        return MongoSessionStore(db["Sessions"])
+    return MemorySessionStore()
@@ -0,0 +1,115 @@
+"""Startup and readiness.
+
+Heavy optional dependencies (OpenCV, EasyOCR/torch, Tesseract and poppler
+bindings, docx2txt) are imported on first use through lazy_import, so importing
+the app is cheap and uvicorn binds right away. Slow initialisation (loading and
+warming the OCR model, reaching MongoDB) runs in background tasks that report
+into a Readiness registry instead of holding up startup. /health/live only says
+the process is up; /health/ready says whether the components in READY_REQUIRES
+are ready, so a replica takes traffic as soon as it can serve most routes,
+while routes that need a slower component (OCR) wait for it with a timeout.
+"""
+import asyncio
+import importlib
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+# Components that must be ready before /health/ready answers 200
+READY_REQUIRES = [name for name in os.environ.get("READY_REQUIRES", "database").split(",") if name]
+# Seconds between attempts when a component fails to start
+STARTUP_RETRY_INTERVAL = float(os.environ.get("STARTUP_RETRY_INTERVAL", 10))
+
+logger = logging.getLogger(__name__)
+
+PENDING = "starting"
+READY = "ready"
+FAILED = "failed"
+
+
+class LazyModule:
+    """Stands in for a module and imports it on first attribute access"""
+
+    def __init__(self, name: str):
+        self.__name = name
+        self.__module = None
+
+    def __getattr__(self, attr: str) -> Any:
+        if self.__module is None:
+            self.__module = importlib.import_module(self.__name)
+        value = getattr(self.__module, attr)
+        # Later lookups find the attribute directly and skip __getattr__
+        setattr(self, attr, value)
+        return value
+
+
+def lazy_import(name: str) -> LazyModule:
+    return LazyModule(name)
+
+
+class Readiness:
+    """State of the components that start in the background"""
+
+    def __init__(self, required: Iterable[str] = READY_REQUIRES):
+        self.required = list(required)
+        self.started = time.monotonic()
+        self._components = {}  # name -> {"state", "since", "error"}
+        self._events = {}  # name -> asyncio.Event, set once the component is ready
+
+    def _set(self, name: str, state: str, error: Optional[str] = None):
+        self._components[name] = {"state": state, "since": time.monotonic(), "error": error}
+
+    def _event(self, name: str) -> asyncio.Event:
+        if name not in self._events:
+            self._events[name] = asyncio.Event()
+        return self._events[name]
+
+    def start(self, name: str, init: Callable[[], Awaitable[Any]],
+              retry_interval: float = STARTUP_RETRY_INTERVAL) -> "asyncio.Future":
+        """Run init() in the background until it succeeds, tracking it as name"""
+        self._set(name, PENDING)
+        self._event(name)
+
+        async def run():
+            while True:
+                try:
+                    await init()
+                except Exception as e:
+                    logger.exception("Starting %s failed, retrying in %ss", name, retry_interval)
+                    self._set(name, FAILED, str(e))
+                    await asyncio.sleep(retry_interval)
+                else:
+                    self._set(name, READY)
+                    self._event(name).set()
+                    logger.info("%s ready after %.1fs", name, time.monotonic() - self.started)
+                    return
+
+        return asyncio.ensure_future(run())
+
+    def is_ready(self, name: str) -> bool:
+        return self._components.get(name, {}).get("state") == READY
+
+    async def wait(self, name: str, timeout: float) -> bool:
+        """Wait up to timeout seconds for a component; False if it isn't ready by then"""
+        if self.is_ready(name):
+            return True
+        try:
+            await asyncio.wait_for(self._event(name).wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def status(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        components = {}
+        for name, component in self._components.items():
+            components[name] = {"state": component["state"],
+                                "seconds": round(now - component["since"], 1)}
+            if component["error"]:
+                components[name]["error"] = component["error"]
+        return {
+            "ready": all(self.is_ready(name) for name in self.required),
+            "uptime": round(now - self.started, 1),
+            "components": components,
+        }
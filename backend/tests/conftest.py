@@ -0,0 +1,45 @@
+import os
+import sys
+import threading
+
+import pytest
+
+# The backend modules import each other by name, as when run from backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeCollection:
+    """Just enough of a pymongo collection for the drug caches, recording the
+    thread of every query"""
+
+    def __init__(self, documents=(), on_query=None):
+        self.documents = {doc["_id"]: doc for doc in documents}
+        self.threads = []
+        self.on_query = on_query
+
+    def _query(self):
+        self.threads.append(threading.current_thread())
+        if self.on_query:
+            self.on_query()
+
+    def find(self, query):
+        self._query()
+        return [self.documents[i] for i in query["_id"]["$in"] if i in self.documents]
+
+    def find_one(self, query):
+        self._query()
+        return self.documents.get(query["_id"])
+
+    def count_documents(self, query):
+        self._query()
+        return len(self.documents)
+
+    def estimated_document_count(self):
+        self._query()
+        return len(self.documents)
+
+
+@pytest.fixture
+def fake_collection():
+    """Makes FakeCollections: fake_collection(documents=(), on_query=None)"""
+    return FakeCollection
@@ -0,0 +1,67 @@
+import asyncio
+import threading
+
+from cache import ResultCache, content_key
+
+
+class RecordingCache(ResultCache):
+    """ResultCache noting the thread of every disk access"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.disk_threads = []
+
+    def _read_disk(self, key, now):
+        self.disk_threads.append(threading.current_thread())
+        return super()._read_disk(key, now)
+
+    def _write_disk(self, key, expires_at, value):
+        self.disk_threads.append(threading.current_thread())
+        super()._write_disk(key, expires_at, value)
+
+
+def test_async_access_keeps_disk_io_off_the_event_loop(tmp_path):
+    cache = RecordingCache(disk_dir=str(tmp_path))
+    key = content_key("analysis", "2", "lab_report", "Hemoglobin 13.5")
+
+    async def scenario():
+        assert await cache.aget(key) is None
+        await cache.aset(key, {"summary": "normal"})
+        cache.clear()
+        # Served from disk, then promoted to memory
+        assert await cache.aget(key) == {"summary": "normal"}
+        assert await cache.aget(key) == {"summary": "normal"}
+        return threading.current_thread()
+
+    loop_thread = asyncio.run(scenario())
+    assert len(cache.disk_threads) == 3
+    assert loop_thread not in cache.disk_threads
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_entries_written_by_one_worker_are_read_by_another(tmp_path):
+    writer, reader = ResultCache(disk_dir=str(tmp_path)), ResultCache(disk_dir=str(tmp_path))
+    writer.set("k", [1, 2])
+    assert reader.get("k") == [1, 2]
+    assert asyncio.run(ResultCache(disk_dir=str(tmp_path)).aget("k")) == [1, 2]
+
+
+def test_expired_entries_are_dropped(tmp_path):
+    cache = ResultCache(ttl=-1, disk_dir=str(tmp_path))
+    cache.set("k", "value")
+    assert cache.get("k") is None
+    assert asyncio.run(cache.aget("k")) is None
+    assert list(tmp_path.rglob("*.json")) == []
+
+
+def test_memory_only_cache_never_touches_disk(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache = ResultCache(max_entries=2, disk_dir=None)
+
+    async def scenario():
+        for key in "abc":
+            await cache.aset(key, key.upper())
+        return [await cache.aget(key) for key in "abc"]
+
+    assert asyncio.run(scenario()) == [None, "B", "C"]
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,96 @@
+import json
+
+from chat_context import (CHAT_SUMMARY_TOKENS, CONTEXT_ACK, build_chat_messages, condense_message,
+                          count_tokens, extend_summary, message_tokens, summarize_structured_data)
+
+SYSTEM = "You are a medical document assistant."
+NOTE = "Document: lab report (CBC)."
+
+
+def turns(count, words=60):
+    history = []
+    for i in range(count):
+        history.append({"role": "user", "content": f"Question about the medical document: question {i}. " + "word " * words})
+        history.append({"role": "assistant", "content": f"Answer {i}. " + "detail " * words})
+    return history
+
+
+def ask(text="What does my hemoglobin mean?"):
+    return {"role": "user", "content": text}
+
+
+def prompt_tokens(messages):
+    return sum(message_tokens(m) for m in messages)
+
+
+def test_short_chat_is_sent_whole():
+    history = [{"role": "system", "content": "stored system prompt"}] + turns(2)
+    messages, updates = build_chat_messages(SYSTEM, NOTE, history, len(history), "", 0, ask())
+    assert messages == [{"role": "system", "content": SYSTEM}] + history[1:] + [ask()]
+    assert updates == {}
+
+
+def test_long_chat_fits_the_budget_and_summarizes_dropped_turns():
+    history = turns(40)
+    budget = 2000
+    messages, updates = build_chat_messages(SYSTEM, NOTE, history[-24:], len(history), "", 0, ask(),
+                                            budget=budget)
+    assert prompt_tokens(messages) <= budget
+    assert messages[0]["content"] == SYSTEM
+    assert messages[1]["content"].startswith(NOTE)
+    assert messages[2] == {"role": "assistant", "content": CONTEXT_ACK}
+    assert messages[-1] == ask()
+
+    kept = messages[3:-1]
+    assert kept == history[-len(kept):]
+    # Only the turns read from the store (the last 24) can be summarized
+    assert updates["summarized_count"] == len(history) - len(kept)
+    assert updates["history_summary"].startswith("- User: question 28.\n- Assistant: Answer 28.")
+    assert "Earlier in this conversation:" in messages[1]["content"]
+
+
+def test_turns_are_summarized_once_and_prompt_stays_flat():
+    history, summary, summarized = [], "", 0
+    sizes = []
+    for turn in range(30):
+        window = history[-24:]
+        messages, updates = build_chat_messages(SYSTEM, NOTE, window, len(history), summary, summarized,
+                                                ask(f"question {turn}"), budget=1500)
+        if updates:
+            assert updates["summarized_count"] > summarized
+            summary, summarized = updates["history_summary"], updates["summarized_count"]
+        sizes.append(prompt_tokens(messages))
+        history += [ask(f"question {turn}. " + "word " * 60),
+                    {"role": "assistant", "content": f"answer {turn}. " + "detail " * 60}]
+    assert max(sizes) <= 1500
+    # Past the window, only the capped summary grows
+    assert max(sizes[10:]) - min(sizes[10:]) <= CHAT_SUMMARY_TOKENS
+    assert count_tokens(summary) <= CHAT_SUMMARY_TOKENS
+    lines = summary.splitlines()
+    assert len(lines) == len(set(lines))
+
+
+def test_condense_message_keeps_the_first_sentence():
+    message = {"role": "user", "content": "Question about the medical document: Is my  TSH normal? It is 2.4. Thanks"}
+    assert condense_message(message) == "- User: Is my TSH normal? It is 2.4."
+    long = {"role": "assistant", "content": "x" * 500}
+    assert condense_message(long) == "- Assistant: " + "x" * 160 + "..."
+
+
+def test_extend_summary_forgets_the_oldest_lines():
+    summary = extend_summary("", [{"role": "user", "content": f"Question {i} is about the lipid panel."}
+                                  for i in range(10)], max_tokens=40)
+    assert count_tokens(summary) <= 40
+    assert summary.splitlines()[-1] == "- User: Question 9 is about the lipid panel."
+    assert "Question 0 " not in summary
+
+
+def test_structured_summary_drops_minor_fields_first():
+    data = {"summary": "Mild anemia", "test_results": [{"name": "Hemoglobin", "value": "11.2"}],
+            "report_tags": ["cbc"] * 50, "doctor_questions": ["Why?"] * 50}
+    full = summarize_structured_data(data, max_tokens=10000)
+    assert json.loads(full) == data
+
+    trimmed = json.loads(summarize_structured_data(data, max_tokens=100))
+    assert "report_tags" not in trimmed and "doctor_questions" not in trimmed
+    assert trimmed["test_results"] == data["test_results"]
@@ -0,0 +1,50 @@
+import json
+import os
+
+import pytest
+
+from doc_classifier import DocumentClassifier
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          "benchmarks", "fixtures", "documents")
+CORPUS = [(label, filename) for label in sorted(os.listdir(CORPUS_DIR))
+          for filename in sorted(os.listdir(os.path.join(CORPUS_DIR, label)))]
+
+classifier = DocumentClassifier()
+
+
+@pytest.mark.parametrize("label, filename", CORPUS)
+def test_labeled_corpus(label, filename):
+    with open(os.path.join(CORPUS_DIR, label, filename), encoding="utf-8") as f:
+        assert classifier.classify(f.read()).doc_type == label
+
+
+def test_keywords_match_whole_words_only():
+    result = classifier.classify("Proxy form signed at the front desk")
+    assert "rx" not in result.matched["prescription"]
+    assert result.doc_type == "unknown"
+
+
+def test_units_are_found_inside_strengths():
+    assert "mg" in classifier.classify("Metformin 500mg").matched["prescription"]
+
+
+def test_phrases_allow_line_breaks():
+    result = classifier.classify("Reference\nrange 70 - 100 mg/dL")
+    assert "reference range" in result.matched["lab_report"]
+
+
+def test_structural_patterns():
+    rx = classifier.classify("Take 1 tablet 3 times a day after food")
+    assert {"dose_instruction", "times_daily"} <= set(rx.matched["prescription"])
+    lab = classifier.classify("Hemoglobin 13.5 g/dL 12.0 - 15.5 g/dL")
+    assert "value_range" in lab.matched["lab_report"]
+    # Ids and dates are not reference ranges
+    assert "value_range" not in classifier.classify("Ref HX-29-88231 on 12-03-2024").matched["lab_report"]
+
+
+def test_weights_can_be_overridden(tmp_path):
+    path = tmp_path / "weights.json"
+    path.write_text(json.dumps({"prescription": {"invoice": 5}}))
+    assert DocumentClassifier.from_config(str(path)).classify("Invoice").doc_type == "prescription"
+    assert DocumentClassifier.from_config("").classify("Invoice").doc_type == "unknown"
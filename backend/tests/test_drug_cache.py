@@ -0,0 +1,85 @@
+import asyncio
+import threading
+
+import drug_cache
+from drug_cache import DrugCache
+
+
+class ChangeFeed:
+    """DrugChanges entries, queried by seq like DrugCache does"""
+
+    def __init__(self):
+        self.entries = []
+
+    def write(self, seq, *drug_ids):
+        self.entries.append({"seq": seq, "drug_ids": list(drug_ids)})
+
+    def find_one(self, query, sort):
+        return max(self.entries, key=lambda entry: entry["seq"], default=None)
+
+    def find(self, query):
+        low = query["seq"]["$gte"]
+        return Cursor([entry for entry in self.entries if entry["seq"] >= low])
+
+
+class Cursor(list):
+    def sort(self, field, direction):
+        return Cursor(sorted(self, key=lambda entry: entry[field]))
+
+    def limit(self, n):
+        return Cursor(self[:n])
+
+
+DRUGS = [{"_id": i, "title": f"Drug {i}"} for i in range(5)]
+
+
+def test_get_documents_queries_misses_off_the_event_loop(fake_collection):
+    collection = fake_collection(DRUGS)
+    cache = DrugCache(collection, fake_collection())
+
+    async def scenario():
+        first = await cache.get_documents([1, 2, 9])
+        second = await cache.get_documents([1, 2])
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert sorted(first) == ["1", "2"] and sorted(second) == ["1", "2"]
+    # The second call is served from the cache
+    assert len(collection.threads) == 1
+    assert collection.threads[0] is not threading.main_thread()
+
+
+def test_invalidation_during_a_query_is_not_undone(fake_collection):
+    cache = None
+    collection = fake_collection(DRUGS, on_query=lambda: cache.invalidate([1]))
+    cache = DrugCache(collection, fake_collection())
+
+    found = asyncio.run(cache.get_documents([1]))
+    assert "1" in found
+    assert len(cache.documents) == 0
+
+
+def test_change_feed_is_read_in_seq_order_and_waits_at_gaps(monkeypatch, fake_collection):
+    now = [100.0]
+    monkeypatch.setattr(drug_cache.time, "monotonic", lambda: now[0])
+    feed = ChangeFeed()
+    feed.write(1, "a")
+    cache = DrugCache(fake_collection(), feed)
+    # The feed is read from where it ended when polling started
+    assert cache.fetch_changes() == []
+
+    # Another scraper process took seq 2 but committed after seq 3
+    feed.write(3, "c")
+    assert cache.fetch_changes() == ["c"]
+    feed.write(2, "b")
+    feed.write(4, "d")
+    assert cache.fetch_changes() == ["b", "d"]
+    assert cache.fetch_changes() == []
+
+    # A seq that never arrives holds the feed back only for a while
+    feed.write(6, "f")
+    assert cache.fetch_changes() == ["f"]
+    now[0] += drug_cache.CHANGES_GAP_TIMEOUT
+    feed.write(7, "g")
+    assert cache.fetch_changes() == ["g"]
+    assert cache._next_seq == 8
@@ -0,0 +1,76 @@
+import asyncio
+import threading
+
+import pytest
+
+from drug_catalog import (CATALOG_META_ID, CatalogCounts, InvalidCursor, decode_cursor, drug_projection,
+                          encode_cursor, keyset_cursor, keyset_filter)
+
+
+def test_counts_are_cached_per_version_and_queried_off_the_event_loop(fake_collection):
+    collection = fake_collection([{"_id": i} for i in range(5)])
+    meta = fake_collection([{"_id": CATALOG_META_ID, "version": 3}])
+    counts = CatalogCounts(collection, meta)
+
+    async def scenario():
+        return [await counts.count({}, "exact"), await counts.count({}, "exact"),
+                await counts.count({}, "estimate"), await counts.count({}, "none")]
+
+    assert asyncio.run(scenario()) == [5, 5, 5, None]
+    assert len(collection.threads) == 2 and len(meta.threads) == 1
+    assert threading.main_thread() not in collection.threads + meta.threads
+
+
+def test_cursor_round_trip():
+    position = {"t": "Dolo 650 Tablet", "i": "65f1c0ffee0000000000abcd"}
+    cursor = encode_cursor(position)
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == position
+
+
+@pytest.mark.parametrize("cursor", ["not base64!", encode_cursor({"o": "ten"}), "WzFd"])
+def test_malformed_cursors_are_rejected(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor)
+
+
+def test_offset_cursor_is_not_a_keyset_position():
+    with pytest.raises(InvalidCursor):
+        keyset_filter(decode_cursor(encode_cursor({"o": 20})))
+
+
+def matches(drug, query):
+    """Evaluate the subset of MongoDB queries keyset_filter produces"""
+    if "$or" in query:
+        return any(matches(drug, branch) for branch in query["$or"])
+    for field, condition in query.items():
+        if isinstance(condition, dict):
+            if not drug[field] > condition["$gt"]:
+                return False
+        elif drug[field] != condition:
+            return False
+    return True
+
+
+def test_keyset_pages_cover_duplicate_titles_exactly_once():
+    from bson import ObjectId
+    drugs = [{"_id": ObjectId(), "title": title}
+             for title in ["Pan 40", "Dolo 650", "Pan 40", "Augmentin", "Pan 40", "Dolo 650", "Zincovit"]]
+    ordered = sorted(drugs, key=lambda d: (d["title"], d["_id"]))
+
+    seen, query = [], {}
+    while True:
+        page = [d for d in ordered if matches(d, query)][:2]
+        if not page:
+            break
+        seen.extend(page)
+        query = keyset_filter(decode_cursor(keyset_cursor(page[-1])))
+    assert seen == ordered
+
+
+def test_projection_always_includes_the_title():
+    assert drug_projection("full", "") is None
+    assert drug_projection("summary", "") == {"title": 1, "price": 1, "meta": 1, "link": 1}
+    assert drug_projection("summary", "link, price") == {"link": 1, "price": 1, "title": 1}
+    with pytest.raises(ValueError):
+        drug_projection("full", "title,dosage")
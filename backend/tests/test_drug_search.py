@@ -0,0 +1,93 @@
+import random
+
+import pytest
+
+from drug_search import DrugSearch, DrugSearchIndex, best_match, normalize, top_positions
+
+DRUGS = [
+    {"_id": 1, "title": "Dolo 650mg Tablet", "meta": "Paracetamol", "desc": "Used to treat fever and pain"},
+    {"_id": 2, "title": "Dolo", "meta": "Paracetamol", "desc": "Fever"},
+    {"_id": 3, "title": "Crocin 500mg Tablet", "meta": "Paracetamol", "desc": "Used to treat fever"},
+    {"_id": 4, "title": "Augmentin 625 Duo Tablet", "meta": "Amoxicillin Clavulanic Acid", "desc": "Antibiotic"},
+    {"_id": 5, "title": "Calpol 500mg Tablet", "meta": "Paracetamol", "desc": "Pain relief"},
+    {"_id": 6, "title": "Doxycycline 100mg Capsule", "meta": "Doxycycline", "desc": "Antibiotic"},
+]
+
+
+@pytest.fixture(scope="module")
+def index():
+    return DrugSearchIndex(DRUGS)
+
+
+class Catalogue:
+    """Drugs collection and Meta document in one, counting full loads"""
+
+    def __init__(self, docs):
+        self.docs = list(docs)
+        self.version = 1
+        self.loads = 0
+
+    def find(self, query, projection):
+        self.loads += 1
+        return list(self.docs)
+
+    def find_one(self, query):
+        return {"_id": query["_id"], "version": self.version}
+
+
+def test_top_positions_matches_reference_order():
+    rng = random.Random(7)
+    for _ in range(200):
+        scores = {p: rng.choice([1.0, 2.5, 3.0, rng.random()]) for p in rng.sample(range(500), rng.randint(0, 80))}
+        for n in (0, 1, 5, 20, 100):
+            expected = sorted(scores, key=lambda p: (-scores[p], p))[:n]
+            assert top_positions(scores, n) == expected
+
+
+def test_exact_title_ranks_first(index):
+    ids, total = index.search("dolo ")
+    assert ids[0] == 2
+    assert set(ids) == {1, 2} and total == 2
+
+
+def test_last_token_matches_as_prefix_while_typing(index):
+    ids, _ = index.search("do")
+    assert set(ids) == {1, 2, 6}
+    assert index.search("do ")[1] == 0
+
+
+def test_all_tokens_must_match(index):
+    ids, _ = index.search("paracetamol 500")
+    assert set(ids) == {3, 5}
+
+
+def test_ties_are_in_title_order(index):
+    ids, _ = index.search("tablet ")
+    assert ids == sorted(ids, key=lambda i: normalize(DRUGS[i - 1]["title"]))
+
+
+def test_pages_are_consistent(index):
+    everything, total = index.search("paracetamol ", limit=10)
+    pages = [index.search("paracetamol ", limit=2, offset=offset)[0] for offset in range(0, total, 2)]
+    assert [i for page in pages for i in page] == everything
+
+
+def test_candidates_or_tokens_for_fuzzy_matching(index):
+    assert 1 in index.candidates("Tab Dolo 650")
+    documents = [d for d in DRUGS if d["_id"] in index.candidates("Tab Dolo 650")]
+    match, score = best_match("Tab Dolo 650", documents)
+    assert match["_id"] == 1 and score >= 0.5
+
+
+def test_index_is_rebuilt_only_when_the_catalogue_version_moves():
+    catalogue = Catalogue(DRUGS)
+    search = DrugSearch(catalogue, catalogue)
+    assert search.rebuild()
+    assert not search.rebuild()
+    assert catalogue.loads == 1
+
+    catalogue.docs.append({"_id": 7, "title": "Dolonex DT Tablet", "meta": "Piroxicam", "desc": "Pain relief"})
+    catalogue.version += 1
+    assert search.rebuild()
+    assert catalogue.loads == 2
+    assert search.search("dolonex", 10, 0) == ([7], 1)
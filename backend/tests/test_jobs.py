@@ -0,0 +1,261 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import jobs
+from ingestion import Upload
+from jobs import JobRunner, MemoryJobStore, job_view
+
+
+def make_upload(name="scan.png", data=b"image bytes"):
+    return Upload(name, data=bytearray(data), digest=name, size=len(data))
+
+
+class ThreadCheckingStore(MemoryJobStore):
+    """Memory store that claims to block and records the threads it runs on"""
+
+    blocking = True
+
+    def __init__(self):
+        super().__init__()
+        self.threads = set()
+        for name in ("create", "get", "find", "claim", "update", "update_file", "delete"):
+            setattr(self, name, self._recording(getattr(super(), name)))
+
+    def _recording(self, fn):
+        def call(*args):
+            self.threads.add(threading.get_ident())
+            return fn(*args)
+        return call
+
+
+async def finished(runner, job_id, timeout=2.0):
+    async def wait():
+        async for job in runner.watch(job_id):
+            last = job
+        return last
+    return await asyncio.wait_for(wait(), timeout)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_job_runs_every_file_and_reports_progress(tmp_path):
+    seen = []
+
+    async def process(path, filename, options, progress):
+        with open(path, "rb") as f:
+            data = f.read()
+        progress("ocr", page=1, pages=2)
+        progress("ocr", page=2, pages=2)
+        await asyncio.sleep(0)
+        return {"filename": filename, "bytes": len(data), "options": options}
+
+    async def scenario():
+        store = MemoryJobStore()
+        runner = JobRunner(store, process, workers=1, spool_dir=str(tmp_path))
+        await runner.start()
+        job, reattached = await runner.submit("k", [make_upload("a.png"), make_upload("b.png", b"xy")],
+                                              {"document_type": "auto"})
+        assert not reattached and job["status"] == "queued"
+        async for state in runner.watch(job["job_id"]):
+            seen.append([f["stage"] for f in state["files"]])
+        job = await runner.get(job["job_id"])
+        await runner.stop()
+        return job
+
+    job = run(scenario())
+    assert job["status"] == "done"
+    assert [f["result"]["bytes"] for f in job["files"]] == [11, 2]
+    assert all(f["status"] == "done" for f in job["files"])
+    # Spooled uploads are removed once processed
+    assert list(tmp_path.iterdir()) == []
+    assert seen[-1] == ["done", "done"]
+    # Clients never see paths, results or lease details
+    view = job_view(job)
+    assert "key" not in view and "lease_until" not in view
+    assert all("path" not in f and "result" not in f for f in view["files"])
+
+
+def test_resubmitting_reattaches_and_failed_jobs_are_replaced(tmp_path):
+    calls = []
+
+    async def process(path, filename, options, progress):
+        calls.append(filename)
+        if len(calls) == 1:
+            raise ValueError("unreadable")
+        return {"ok": True}
+
+    async def scenario():
+        runner = JobRunner(MemoryJobStore(), process, workers=1, spool_dir=str(tmp_path))
+        await runner.start()
+        first, _ = await runner.submit("k", [make_upload()], {})
+        first = await finished(runner, first["job_id"])
+        assert first["status"] == "failed"
+        assert first["files"][0]["error"] == {"status_code": 500, "detail": "unreadable"}
+
+        second, reattached = await runner.submit("k", [make_upload()], {})
+        assert not reattached and second["job_id"] != first["job_id"]
+        second = await finished(runner, second["job_id"])
+        assert second["status"] == "done"
+
+        again, reattached = await runner.submit("k", [make_upload()], {})
+        assert reattached and again["job_id"] == second["job_id"]
+        await runner.stop()
+
+    run(scenario())
+    assert calls == ["scan.png", "scan.png"]
+
+
+def test_busy_responses_are_retried(tmp_path, monkeypatch):
+    class Busy(Exception):
+        status_code = 429
+        headers = {"Retry-After": "0"}
+
+    attempts = []
+
+    async def process(path, filename, options, progress):
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise Busy()
+        return {"ok": True}
+
+    async def scenario():
+        runner = JobRunner(MemoryJobStore(), process, workers=1, spool_dir=str(tmp_path))
+        await runner.start()
+        job, _ = await runner.submit("k", [make_upload()], {})
+        job = await finished(runner, job["job_id"])
+        await runner.stop()
+        return job
+
+    assert run(scenario())["status"] == "done"
+    assert len(attempts) == 3
+
+
+def test_full_queue_is_refused(tmp_path):
+    async def process(path, filename, options, progress):
+        await asyncio.sleep(10)
+
+    async def scenario():
+        runner = JobRunner(MemoryJobStore(), process, workers=1, queue_size=1, spool_dir=str(tmp_path))
+        await runner.start()
+        await runner.submit("a", [make_upload()], {})
+        await asyncio.sleep(0.01)  # the worker takes job a
+        await runner.submit("b", [make_upload()], {})
+        with pytest.raises(jobs.JobQueueFull):
+            await runner.submit("c", [make_upload()], {})
+        await runner.stop()
+
+    run(scenario())
+
+
+def test_blocking_store_is_called_off_the_event_loop(tmp_path):
+    async def process(path, filename, options, progress):
+        progress("analysis")
+        return {"ok": True}
+
+    async def scenario():
+        store = ThreadCheckingStore()
+        runner = JobRunner(store, process, workers=1, spool_dir=str(tmp_path))
+        await runner.start()
+        job, _ = await runner.submit("k", [make_upload()], {})
+        job = await finished(runner, job["job_id"])
+        await runner.stop()
+        return store, job, threading.get_ident()
+
+    store, job, loop_thread = run(scenario())
+    assert job["status"] == "done"
+    assert store.threads and loop_thread not in store.threads
+
+
+def test_expired_lease_can_be_claimed_again(monkeypatch):
+    store = MemoryJobStore()
+    store.create(jobs.new_job("j", "k", ["a.png"], ["/nonexistent"], {}))
+    now = [1000.0]
+    monkeypatch.setattr("jobs.time.time", lambda: now[0])
+    assert store.claim("j", "worker-1", now[0] + 300)
+    assert not store.claim("j", "worker-2", now[0] + 300)
+    now[0] += 301
+    assert store.claim("j", "worker-2", now[0] + 300)
+    assert store.get("j")["owner"] == "worker-2"
+
+
+def test_sweep_requeues_jobs_abandoned_by_a_dead_process(tmp_path, monkeypatch):
+    async def process(path, filename, options, progress):
+        return {"ok": True}
+
+    async def scenario():
+        store = MemoryJobStore()
+        # Left running by another process that died, and queued in its memory
+        store.create(jobs.new_job("running", "k1", ["a.png"], [str(tmp_path / "a.png")], {}))
+        store.claim("running", "dead-process", time.time() - 1)
+        store.create(jobs.new_job("queued", "k2", ["b.png"], [str(tmp_path / "b.png")], {}))
+        store._jobs["queued"]["updated_at"] -= jobs.JOB_LEASE + 1
+        for name in ("a.png", "b.png"):
+            (tmp_path / name).write_bytes(b"x")
+
+        runner = JobRunner(store, process, workers=1, spool_dir=str(tmp_path))
+        await runner.start()
+        await runner.sweep()
+        results = [await finished(runner, job_id) for job_id in ("running", "queued")]
+        await runner.stop()
+        return results
+
+    assert [job["status"] for job in run(scenario())] == ["done", "done"]
+
+
+def test_sweep_renews_leases_of_jobs_running_here(tmp_path):
+    release = None
+
+    async def process(path, filename, options, progress):
+        await release.wait()
+        return {"ok": True}
+
+    async def scenario():
+        nonlocal release
+        release = asyncio.Event()
+        store = MemoryJobStore()
+        runner = JobRunner(store, process, workers=1, spool_dir=str(tmp_path))
+        await runner.start()
+        job, _ = await runner.submit("k", [make_upload()], {})
+        await asyncio.sleep(0.01)
+        store._jobs[job["job_id"]]["lease_until"] = 0
+        await runner.sweep()
+        lease = store.get(job["job_id"])["lease_until"]
+        # Not requeued: it is still running here
+        assert runner.queued == 0
+        release.set()
+        await finished(runner, job["job_id"])
+        await runner.stop()
+        return lease
+
+    assert run(scenario()) > time.time()
+
+
+def test_pruning_removes_spooled_files(tmp_path, monkeypatch):
+    spooled = tmp_path / "job.png"
+    spooled.write_bytes(b"x")
+    store = MemoryJobStore(ttl=10)
+    store.create(jobs.new_job("j", "k", ["job.png"], [str(spooled)], {}))
+    store._jobs["j"]["updated_at"] -= 11
+    store._prune()
+    assert store.get("j") is None
+    assert not spooled.exists()
+
+
+def test_job_store_defaults_to_memory_and_mongo_needs_a_shared_spool(monkeypatch):
+    class Database(dict):
+        def __missing__(self, name):
+            return name
+
+    monkeypatch.setattr(jobs, "JOB_STORE", "memory")
+    assert isinstance(jobs.create_job_store(Database()), MemoryJobStore)
+    monkeypatch.setattr(jobs, "JOB_STORE", "mongo")
+    monkeypatch.setattr(jobs, "JOB_SPOOL_DIR", "")
+    with pytest.raises(RuntimeError):
+        jobs.create_job_store(Database())
+    monkeypatch.setattr(jobs, "JOB_SPOOL_DIR", "/mnt/shared/medilink-jobs")
+    assert isinstance(jobs.create_job_store(Database()), jobs.MongoJobStore)
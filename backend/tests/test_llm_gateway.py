@@ -0,0 +1,132 @@
+import asyncio
+import time
+
+import pytest
+
+import llm_gateway
+from llm_gateway import FakeBackend, LLMGateway, LLMUnavailable
+
+
+class RetryableFake(FakeBackend):
+    """Treats ConnectionError like a rate limit or a dropped connection"""
+
+    def is_retryable(self, error):
+        return isinstance(error, ConnectionError)
+
+
+def failing(times, reply="hello there"):
+    """Responder that raises ConnectionError the first `times` calls"""
+    remaining = [times]
+
+    def respond(kwargs):
+        if remaining[0]:
+            remaining[0] -= 1
+            raise ConnectionError("service unavailable")
+        return reply
+    return respond
+
+
+def make_gateway(backend, backoff=0.0, **kwargs):
+    gateway = LLMGateway(backend, route_limits={}, **kwargs)
+    gateway._backoff = lambda attempt, retry_after: backoff
+    return gateway
+
+
+async def collect(stream):
+    return [token async for token in stream]
+
+
+def test_complete_retries_retryable_errors():
+    backend = RetryableFake(failing(2))
+    gateway = make_gateway(backend, max_retries=3)
+    assert asyncio.run(gateway.complete("chat", messages=[])) == "hello there"
+    assert len(backend.calls) == 3
+
+
+def test_complete_gives_up_after_max_retries():
+    gateway = make_gateway(RetryableFake(failing(5)), max_retries=2)
+    with pytest.raises(LLMUnavailable):
+        asyncio.run(gateway.complete("chat", messages=[]))
+
+
+def test_non_retryable_errors_are_raised_at_once():
+    backend = FakeBackend(failing(1))
+    gateway = make_gateway(backend)
+    with pytest.raises(ConnectionError):
+        asyncio.run(gateway.complete("chat", messages=[]))
+    assert len(backend.calls) == 1
+
+
+def test_permits_are_released_while_backing_off():
+    gateway = make_gateway(RetryableFake(failing(1)), backoff=0.3, max_concurrency=1)
+
+    async def scenario():
+        retrying = asyncio.ensure_future(gateway.complete("extract_text", messages=[]))
+        await asyncio.sleep(0.05)
+        started = time.monotonic()
+        # Would wait out the whole backoff if the retrying call kept its permit
+        await gateway.complete("chat", messages=[])
+        waited = time.monotonic() - started
+        await retrying
+        return waited
+
+    assert asyncio.run(scenario()) < 0.2
+
+
+def test_stream_retries_before_the_first_token_and_closes_every_attempt():
+    backend = RetryableFake(failing(2))
+    gateway = make_gateway(backend, max_retries=3)
+    assert "".join(asyncio.run(collect(gateway.stream("chat", messages=[])))) == "hello there"
+    assert backend.streams_opened == 3
+    assert backend.streams_closed == 3
+
+
+def test_stream_closed_when_the_caller_stops_early():
+    backend = FakeBackend(lambda kwargs: "one two three four")
+    gateway = make_gateway(backend, max_concurrency=1)
+
+    async def scenario():
+        tokens = gateway.stream("chat", messages=[])
+        first = await tokens.__anext__()
+        await tokens.aclose()
+        # The permit is back: another call doesn't wait for it
+        await asyncio.wait_for(gateway.complete("chat", messages=[]), 0.5)
+        return first
+
+    assert asyncio.run(scenario()) == "one"
+    assert backend.streams_closed == 1
+
+
+class StallingFake(FakeBackend):
+    """Sends one token, then nothing"""
+
+    async def stream(self, **kwargs):
+        self.streams_opened += 1
+        try:
+            yield "first"
+            await asyncio.sleep(10)
+        finally:
+            self.streams_closed += 1
+
+
+def test_stream_stalling_after_first_token_is_closed():
+    backend = StallingFake()
+    gateway = make_gateway(backend, timeout=0.1)
+
+    async def scenario():
+        tokens = []
+        with pytest.raises(LLMUnavailable):
+            async for token in gateway.stream("chat", messages=[]):
+                tokens.append(token)
+        return tokens
+
+    assert asyncio.run(scenario()) == ["first"]
+    assert backend.streams_closed == 1
+
+
+def test_groq_backend_needs_an_api_key(monkeypatch):
+    monkeypatch.setattr(llm_gateway, "LLM_BACKEND", "groq")
+    with pytest.raises(RuntimeError, match="GROQ_API_KEY"):
+        llm_gateway.create_backend(api_key=None)
+    monkeypatch.setattr(llm_gateway, "LLM_BACKEND", "fake")
+    assert isinstance(llm_gateway.create_backend(api_key=None), FakeBackend)
@@ -0,0 +1,15 @@
+import asyncio
+
+import metrics
+
+
+def test_stages_recorded_in_worker_threads_count_for_the_request():
+    async def handle():
+        timings = metrics.begin_request()
+        # What the pymongo listener does for a query run off the event loop
+        await asyncio.to_thread(metrics.record, "mongo_find", 2.0)
+        await asyncio.to_thread(metrics.record, "mongo_find", 3.0)
+        return timings
+
+    assert asyncio.run(handle()) == {"mongo_find": 5.0}
+
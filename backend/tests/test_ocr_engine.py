@@ -0,0 +1,97 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from ocr_engine import OCREngine, OCRQueueFull, OCRTimeout, choose_profile, measure_quality
+
+
+def make_engine(workers=1, queue_size=2, job_timeout=5.0):
+    engine = OCREngine(workers=workers, queue_size=queue_size, job_timeout=job_timeout)
+    # Threads stand in for the worker processes, which need the OCR model
+    engine._pool = ThreadPoolExecutor(max_workers=workers)
+    return engine
+
+
+def text_page(ink=0, paper=255, noise=0.0):
+    """A page of dark text lines on paper, as a grayscale array"""
+    page = np.full((1100, 850), float(paper))
+    for top in range(100, 1000, 60):
+        for left in range(80, 760, 40):
+            page[top:top + 24, left:left + 28] = ink
+    page += np.random.default_rng(0).normal(0, noise, page.shape)
+    return np.clip(page, 0, 255).astype(np.uint8)
+
+
+def test_measures_noise_and_contrast():
+    assert measure_quality(text_page(ink=150, paper=225)) == (0.0, 75)
+    noise, _ = measure_quality(text_page(paper=225, noise=6))
+    assert 5 < noise < 6.5
+
+
+def test_auto_profile_uses_resolution_for_clean_pages():
+    assert choose_profile(text_page(), dpi=300) == "fast"
+    assert choose_profile(text_page(), dpi=200) == "balanced"
+    assert choose_profile(text_page(), dpi=96) == "max"
+
+
+def test_auto_profile_picks_max_for_noisy_or_faded_pages():
+    assert choose_profile(text_page(noise=8), dpi=300) == "max"
+    assert choose_profile(text_page(ink=150, paper=225), dpi=300) == "max"
+    assert choose_profile(text_page(noise=8), dpi=200) == "max"
+
+
+def test_sparse_text_is_not_mistaken_for_low_contrast():
+    page = np.full((3300, 2550), 255, dtype=np.uint8)
+    page[300:330, 200:1400] = 0
+    assert choose_profile(page, dpi=300) == "fast"
+
+
+def test_admits_documents_up_to_queue_size():
+    engine = make_engine(queue_size=2)
+    engine.admit()
+    engine.admit()
+    with pytest.raises(OCRQueueFull):
+        engine.admit()
+    engine.release()
+    engine.admit()
+    assert engine.admitted == 2
+
+
+def test_pages_of_an_admitted_document_wait_for_a_worker():
+    engine = make_engine(workers=1, queue_size=1)
+
+    async def scenario():
+        engine.admit()
+        results = await asyncio.gather(*(engine.run(lambda n=n: n) for n in range(10)))
+        engine.release()
+        return results
+
+    assert asyncio.run(scenario()) == list(range(10))
+
+
+def test_timeout_does_not_count_time_waiting_for_a_worker():
+    engine = make_engine(workers=1, job_timeout=0.3)
+
+    async def scenario():
+        return await asyncio.gather(*(engine.run(time.sleep, 0.2) for _ in range(3)))
+
+    # The last job waits 0.4s for the worker but only runs for 0.2s
+    assert asyncio.run(scenario()) == [None, None, None]
+
+
+def test_timed_out_job_keeps_its_worker_until_it_finishes():
+    engine = make_engine(workers=1)
+
+    async def scenario():
+        with pytest.raises(OCRTimeout):
+            await engine.run(time.sleep, 0.3, timeout=0.05)
+        assert engine.pending == 1
+        started = time.monotonic()
+        await engine.run(lambda: None)
+        return time.monotonic() - started
+
+    assert asyncio.run(scenario()) >= 0.2
+    assert engine.pending == 0
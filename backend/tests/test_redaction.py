@@ -0,0 +1,81 @@
+import importlib.util
+import os
+import time
+
+import pytest
+
+from redaction import redact
+
+_BENCH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                      "benchmarks", "bench_redaction.py")
+_spec = importlib.util.spec_from_file_location("bench_redaction", _BENCH)
+bench = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(bench)
+
+# Inputs the previous implementation redacted correctly; the engine must agree
+SAME_AS_LEGACY = [
+    "DOB: 04/12/1985",
+    "Date of Birth:\n12/03/1980",
+    "Date of Birth:  12-03-80",
+    "Birth Date; March 3, 1980",
+    "DOB: Jan 5, 1990",
+    "Call 555.123.4567 today",
+    "Phone 555-123-4567",
+    "SSN 123-45-6789",
+    "Email: john.doe@example.com",
+    "Lives at 12 Oak\nAvenue",
+    "1600 Pennsylvania Ave",
+    "Hemoglobin 13.5 g/dL 12.0 - 15.5",
+    "Rx: Paracetamol 650 mg, take 1 tablet twice daily",
+    "Collected 12/03/2024",
+]
+
+
+@pytest.mark.parametrize("text", SAME_AS_LEGACY)
+def test_matches_legacy_redaction(text):
+    assert redact(text).text == bench.legacy_redact(text)
+
+
+@pytest.mark.parametrize("text, expected", [
+    # The old patterns left part of the number behind
+    ("Phone: (555) 123-4567", "Phone: [PHONE REDACTED]"),
+    ("+1 555-123-4567", "[PHONE REDACTED]"),
+    # ... and the unit number
+    ("Address: 221 Baker Street, Apt 4B", "Address: [ADDRESS REDACTED]"),
+    # ... and only matched the labels' exact case
+    ("dob: Jan 5, 1990", "[DOB REDACTED]"),
+])
+def test_redacts_what_legacy_missed(text, expected):
+    assert redact(text).text == expected
+
+
+@pytest.mark.parametrize("text", [
+    "Date of Birth:\n12/03/1980",
+    "DOB:\r\n04/12/1985",
+    "Birth Date:\n\tMarch 3, 1980",
+])
+def test_dob_value_on_next_line(text):
+    result = redact(text)
+    assert result.text == "[DOB REDACTED]"
+    assert result.counts["DOB"] == 1 and sum(result.counts.values()) == 1
+
+
+def test_address_broken_over_lines():
+    assert redact("221 Baker\nStreet,\nApt 4B").text == "[ADDRESS REDACTED]"
+
+
+def test_spans_point_into_original_text():
+    text = bench.OCR_PAGE
+    result = redact(text)
+    labels = [label for _, _, label in result.spans]
+    assert {"DOB", "PHONE", "EMAIL", "ADDRESS"} <= set(labels)
+    assert sum(result.counts.values()) == len(result.spans)
+    assert "04/12/1985" not in result.text and "john.doe@example.com" not in result.text
+
+
+@pytest.mark.parametrize("name", sorted(bench.ADVERSARIAL))
+def test_adversarial_input_is_linear(name):
+    text = bench.ADVERSARIAL[name](100_000)
+    started = time.perf_counter()
+    redact(text)
+    assert time.perf_counter() - started < 1.0
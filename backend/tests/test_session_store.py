@@ -0,0 +1,95 @@
+import asyncio
+import threading
+
+from session_store import MemorySessionStore, call_store
+
+
+def make_session(turns=0):
+    return {
+        "extracted_text": "text",
+        "document_type": "lab_report",
+        "system_prompt": "prompt",
+        "conversation": [{"role": "user", "content": str(i)} for i in range(turns)],
+    }
+
+
+def test_get_returns_requested_tail_only():
+    store = MemorySessionStore()
+    store.create("s", make_session(turns=5))
+    session = store.get("s", conversation_tail=2)
+    assert [m["content"] for m in session["conversation"]] == ["3", "4"]
+    assert session["message_count"] == 5
+    assert store.get("s")["conversation"] == []
+
+
+def test_get_returns_a_copy():
+    store = MemorySessionStore()
+    store.create("s", make_session(turns=1))
+    store.get("s", conversation_tail=1)["conversation"][0]["content"] = "changed"
+    assert store.get("s", conversation_tail=1)["conversation"][0]["content"] == "0"
+
+
+def test_append_keeps_the_last_max_messages():
+    store = MemorySessionStore(max_messages=3)
+    store.create("s", make_session(turns=2))
+    store.append_messages("s", [{"role": "user", "content": "a"}, {"role": "assistant", "content": "b"}])
+    session = store.get("s", conversation_tail=10)
+    assert [m["content"] for m in session["conversation"]] == ["1", "a", "b"]
+    assert session["message_count"] == 4
+
+
+def test_least_recently_used_session_is_evicted():
+    store = MemorySessionStore(max_sessions=2)
+    store.create("a", make_session())
+    store.create("b", make_session())
+    store.get("a")
+    store.create("c", make_session())
+    assert store.get("b") is None
+    assert store.get("a") is not None and store.get("c") is not None
+
+
+def test_idle_sessions_expire(monkeypatch):
+    store = MemorySessionStore(ttl=10)
+    now = [1000.0]
+    monkeypatch.setattr("session_store.time.time", lambda: now[0])
+    store.create("s", make_session())
+    now[0] += 9
+    assert store.get("s") is not None  # touching slides the expiry
+    now[0] += 9
+    assert store.get("s") is not None
+    now[0] += 11
+    assert store.get("s") is None
+
+
+def test_update_and_delete():
+    store = MemorySessionStore()
+    store.create("s", make_session())
+    store.update("s", {"history_summary": "earlier"})
+    assert store.get("s")["history_summary"] == "earlier"
+    store.delete("s")
+    assert store.get("s") is None
+
+
+class RecordingStore:
+    def __init__(self, blocking):
+        self.blocking = blocking
+        self.threads = []
+
+    def get(self, session_id, conversation_tail=0):
+        self.threads.append(threading.get_ident())
+        return {"id": session_id, "tail": conversation_tail}
+
+
+def test_call_store_runs_blocking_stores_off_the_event_loop():
+    async def run(store):
+        result = await call_store(store, "get", "s", conversation_tail=3)
+        return result, threading.get_ident()
+
+    blocking = RecordingStore(blocking=True)
+    result, loop_thread = asyncio.run(run(blocking))
+    assert result == {"id": "s", "tail": 3}
+    assert blocking.threads[0] != loop_thread
+
+    in_memory = RecordingStore(blocking=False)
+    _, loop_thread = asyncio.run(run(in_memory))
+    assert in_memory.threads[0] == loop_thread
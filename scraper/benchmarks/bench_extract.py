@@ -0,0 +1,95 @@
+"""Benchmark drug page extraction: the old CSS selectors against extraction.DRUG_SPEC.
+
+Runs both over a corpus of saved product pages (by default the fixture site
+under scraper/fixtures/site) and reports microseconds per page for parsing and
+for extraction, plus the fields each approach could not fill. The page tree is
+parsed once and shared, as in Scrapy.
+
+    python benchmarks/bench_extract.py [html_dir ...] [--repeat N]
+"""
+import argparse
+import os
+import sys
+import time
+
+from parsel import Selector
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extraction import DRUG_SPEC, extract
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fixtures", "site")
+
+
+def css_extract(selector):
+    """parse_drug before the extraction spec: six CSS queries plus full-subtree fallbacks"""
+    item = {
+        'title': selector.css('.DrugHeader__title-content___2ZaPo::text').get('').strip(),
+        'price': selector.css('.DrugPriceBox__price___dj2lv::text').get('').strip(),
+        'meta': selector.css('.DrugHeader__meta-value___vqYM0::text').get('').strip(),
+        'desc': selector.css('.DrugOverview__content___22ZBX::text').get('').strip(),
+        'detail': selector.css('.DrugPriceBox__quantity___2LGBX::text').get('').strip(),
+        'sideEffect': selector.css('.DrugOverview__container___CqA8x::text').get('').strip(),
+    }
+    if not item['title']:
+        item['title'] = selector.css('h1::text').get('').strip()
+    if not item['desc'] and selector.css('div.DrugOverview__content___22ZBX'):
+        item['desc'] = ' '.join(selector.css('div.DrugOverview__content___22ZBX ::text').getall()).strip()
+    if not item['sideEffect'] and selector.css('div.DrugOverview__container___CqA8x'):
+        item['sideEffect'] = ' '.join(selector.css('div.DrugOverview__container___CqA8x ::text').getall()).strip()
+    return item
+
+
+def load_pages(directories):
+    pages = []
+    for directory in directories:
+        for dirpath, _, filenames in os.walk(directory):
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                if filename.endswith(('.xml', '.py', '.txt')):
+                    continue
+                with open(path, encoding="utf-8") as f:
+                    text = f.read()
+                if "<html" in text.lower():
+                    pages.append((os.path.relpath(path, directory), text))
+    return pages
+
+
+def timed(fn, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - started) / repeat * 1e6, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("dirs", nargs="*", default=[FIXTURE_DIR])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    pages = load_pages(args.dirs)
+    if not pages:
+        sys.exit("No HTML pages found")
+
+    totals = {"parse": 0.0, "css": 0.0, "spec": 0.0}
+    print(f"{'page':<45} {'parse us':>9} {'css us':>8} {'spec us':>8}  fields missed (css / spec)")
+    for name, text in pages:
+        parse_us, selector = timed(lambda: Selector(text=text), args.repeat)
+        css_us, css_item = timed(lambda: css_extract(selector), args.repeat)
+        spec_us, (spec_item, _) = timed(lambda: extract(selector.root), args.repeat)
+        totals["parse"] += parse_us
+        totals["css"] += css_us
+        totals["spec"] += spec_us
+        css_missed = [f for f in DRUG_SPEC if not css_item.get(f)] or "-"
+        spec_missed = [f for f in DRUG_SPEC if not spec_item.get(f)] or "-"
+        print(f"{name:<45} {parse_us:>9.0f} {css_us:>8.0f} {spec_us:>8.0f}  {css_missed} / {spec_missed}")
+
+    n = len(pages)
+    print(f"\nmean over {n} pages: parse {totals['parse'] / n:.0f} us, "
+          f"css {totals['css'] / n:.0f} us, spec {totals['spec'] / n:.0f} us "
+          f"({totals['css'] / max(totals['spec'], 1e-9):.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
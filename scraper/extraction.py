@@ -0,0 +1,242 @@
+"""Declarative extraction of drug fields from product pages.
+
+Each field has an ordered list of rules and the first rule that yields a value
+wins. Embedded JSON state (JSON-LD, window.__INITIAL_STATE__) is tried first:
+it is parsed at most once per page and is far cheaper than walking the DOM.
+Class rules are served from an index built in one walk over the tree, keyed by
+the stable prefix of hashed CSS-module class names (DrugHeader__title-content___2ZaPo
+is indexed as DrugHeader__title-content___), so a site rebuild that changes the
+hashes no longer breaks the crawl. Other DOM rules are XPath compiled at import.
+
+Works on the lxml tree Scrapy has already parsed (response.selector.root).
+"""
+import json
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from lxml import etree
+
+JSON_LD_TYPES = ("Drug", "Product", "MedicalEntity")
+_STATE_MARKER = re.compile(r'__INITIAL_STATE__\s*=\s*')
+_WHITESPACE = re.compile(r'\s+')
+
+HASH_SEPARATOR = "___"
+
+
+def _lookup(data: Any, path: str) -> Any:
+    """Follow a dotted path through dicts (and the first item of lists)"""
+    for key in path.split("."):
+        if isinstance(data, list):
+            data = data[0] if data else None
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+
+def _text(value: Any) -> str:
+    if value is None or isinstance(value, (dict, list)):
+        return ""
+    return str(value).strip()
+
+
+def class_key(token: str) -> str:
+    """Index key of a class token: hashed CSS-module classes lose their hash"""
+    head, separator, _ = token.partition(HASH_SEPARATOR)
+    return head + separator
+
+
+class PageState:
+    """What the rules need from one page, gathered in a single walk of the tree.
+
+    Elements are indexed by class key, and script bodies are kept for the
+    embedded JSON, which is itself parsed lazily and only once.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.classes = {}
+        self.json_ld_scripts = []
+        self.scripts = []
+        for element in root.iter():
+            tag = element.tag
+            if tag == "script":
+                if element.text:
+                    if element.get("type") == "application/ld+json":
+                        self.json_ld_scripts.append(element.text)
+                    else:
+                        self.scripts.append(element.text)
+                continue
+            classes = element.get("class")
+            if classes:
+                for token in classes.split():
+                    self.classes.setdefault(class_key(token), []).append(element)
+        self._json_ld = None
+        self._initial_state = None
+
+    @property
+    def json_ld(self) -> Dict[str, Any]:
+        """First JSON-LD object describing a drug or product ({} if none)"""
+        if self._json_ld is None:
+            self._json_ld = {}
+            for script in self.json_ld_scripts:
+                try:
+                    data = json.loads(script)
+                except ValueError:
+                    continue
+                candidates = data.get("@graph", [data]) if isinstance(data, dict) else data
+                for candidate in candidates if isinstance(candidates, list) else []:
+                    types = candidate.get("@type") if isinstance(candidate, dict) else None
+                    types = types if isinstance(types, list) else [types]
+                    if any(t in JSON_LD_TYPES for t in types):
+                        self._json_ld = candidate
+                        return self._json_ld
+        return self._json_ld
+
+    @property
+    def initial_state(self) -> Dict[str, Any]:
+        """The window.__INITIAL_STATE__ object ({} if none)"""
+        if self._initial_state is None:
+            self._initial_state = {}
+            for script in self.scripts:
+                marker = _STATE_MARKER.search(script)
+                if marker is None:
+                    continue
+                try:
+                    # raw_decode stops at the end of the object, ignoring trailing JS
+                    state, _ = json.JSONDecoder().raw_decode(script, marker.end())
+                except ValueError:
+                    continue
+                if isinstance(state, dict):
+                    self._initial_state = state
+                    break
+        return self._initial_state
+
+
+class JsonLd:
+    """Value at a dotted path of the page's JSON-LD drug/product object"""
+
+    def __init__(self, path: str, convert: Optional[Callable[[Any], Any]] = None):
+        self.path = path
+        self.convert = convert
+        self.name = f"json-ld:{path}"
+
+    def __call__(self, root, state: PageState) -> str:
+        value = _lookup(state.json_ld, self.path)
+        if value is not None and self.convert is not None:
+            value = self.convert(value)
+        return _text(value)
+
+
+class InitialState:
+    """Value at a dotted path of window.__INITIAL_STATE__"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.name = f"state:{path}"
+
+    def __call__(self, root, state: PageState) -> str:
+        return _text(_lookup(state.initial_state, self.path))
+
+
+class XPath:
+    """Text of a precompiled XPath: the first non-blank text node, or all text joined"""
+
+    def __init__(self, expression: str, all_text: bool = False, name: Optional[str] = None):
+        self.all_text = all_text
+        self.name = name or f"xpath:{expression}"
+        if all_text:
+            self._xpath = etree.XPath(f"{expression}//text()")
+        else:
+            self._xpath = etree.XPath(f"({expression}/text()[normalize-space()])[1]")
+
+    def __call__(self, root, state: PageState) -> str:
+        texts = self._xpath(root)
+        if not texts:
+            return ""
+        if self.all_text:
+            return _WHITESPACE.sub(" ", " ".join(texts)).strip()
+        return texts[0].strip()
+
+
+class ByClass:
+    """Text of the elements carrying a class (hash suffix ignored).
+
+    Like the CSS `.cls::text` it takes the first non-blank text node directly
+    inside a matching element; with all_text, all text beneath them joined.
+    """
+
+    def __init__(self, key: str, all_text: bool = False):
+        self.key = key
+        self.all_text = all_text
+        self.name = f"class:{key}{'*' if all_text else ''}"
+
+    def __call__(self, root, state: PageState) -> str:
+        elements = state.classes.get(self.key, ())
+        if self.all_text:
+            return _WHITESPACE.sub(" ", " ".join(t for e in elements for t in e.itertext())).strip()
+        for element in elements:
+            for text in [element.text] + [child.tail for child in element]:
+                if text and not text.isspace():
+                    return text.strip()
+        return ""
+
+
+def format_offer_price(offers: Any) -> Any:
+    """schema.org offers -> the price as the product page shows it"""
+    offer = offers[0] if isinstance(offers, list) and offers else offers
+    if not isinstance(offer, dict) or offer.get("price") in (None, ""):
+        return None
+    price = offer["price"]
+    return f"₹{price}" if offer.get("priceCurrency", "INR") == "INR" else f"{price} {offer['priceCurrency']}"
+
+
+# Ordered rules per field: the page's embedded state first (only the drug name
+# is known to be in __INITIAL_STATE__), then JSON-LD, then the DOM
+DRUG_SPEC = {
+    'title': [
+        InitialState('drugPage.name'),
+        JsonLd('name'),
+        ByClass('DrugHeader__title-content___'),
+        XPath('//h1', name='h1'),
+    ],
+    'price': [
+        JsonLd('offers', convert=format_offer_price),
+        ByClass('DrugPriceBox__price___'),
+    ],
+    'meta': [
+        JsonLd('manufacturer.name'),
+        ByClass('DrugHeader__meta-value___'),
+    ],
+    'desc': [
+        JsonLd('description'),
+        ByClass('DrugOverview__content___'),
+        ByClass('DrugOverview__content___', all_text=True),
+    ],
+    'detail': [
+        ByClass('DrugPriceBox__quantity___'),
+    ],
+    'sideEffect': [
+        ByClass('DrugOverview__container___'),
+        ByClass('DrugOverview__container___', all_text=True),
+    ],
+}
+
+
+def extract(root, spec: Dict[str, List[Any]] = DRUG_SPEC) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """Apply a spec to a parsed page.
+
+    Returns the field values ("" when no rule matched) and, per field, the
+    name of the rule that produced it, so selector breakage shows in the stats.
+    """
+    state = PageState(root)
+    values, sources = {}, {}
+    for field, rules in spec.items():
+        values[field] = ""
+        for rule in rules:
+            value = rule(root, state)
+            if value:
+                values[field] = value
+                sources[field] = rule.name
+                break
+    return values, sources
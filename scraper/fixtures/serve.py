@@ -0,0 +1,70 @@
+"""Serve the fixture drug site for local crawls.
+
+Sitemaps get the server's own base URL filled in, and every response carries
+an ETag and Last-Modified so conditional requests can be answered with 304.
+Touch or edit a page under site/ (and bump its <lastmod>) to simulate a change.
+
+    python scraper/fixtures/serve.py --port 8765
+    SITEMAP_URL=http://localhost:8765/sitemap.xml CRAWL_INCREMENTAL=1 python scraper/main.py
+"""
+import argparse
+import hashlib
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+SITE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "site")
+
+
+class FixtureHandler(SimpleHTTPRequestHandler):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, directory=SITE_DIR, **kwargs)
+
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, "rb") as f:
+            body = f.read()
+        if path.endswith(".xml"):
+            base = f"http://{self.headers.get('Host', 'localhost')}"
+            body = body.replace(b"{{base}}", base.encode("ascii"))
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        mtime = int(os.path.getmtime(path))
+
+        if self.not_modified(etag, mtime):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/xml" if path.endswith(".xml") else "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", formatdate(mtime, usegmt=True))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def not_modified(self, etag, mtime):
+        if self.headers.get("If-None-Match"):
+            return self.headers["If-None-Match"] == etag
+        if self.headers.get("If-Modified-Since"):
+            try:
+                return mtime <= parsedate_to_datetime(self.headers["If-Modified-Since"]).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), FixtureHandler)
+    print(f"Serving fixture site on http://localhost:{args.port}/sitemap.xml")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
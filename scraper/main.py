@@ -1,16 +1,62 @@
 import scrapy
 from scrapy.crawler import CrawlerProcess
 from scrapy.spiders import SitemapSpider
+from scrapy.utils.defer import maybe_deferred_to_future
 from scrapy.utils.project import get_project_settings
+from scrapy.utils.sitemap import Sitemap
 import re
-from pymongo import MongoClient
-from scrapy.exceptions import DropItem
+import os
+import json
+import hashlib
+import datetime
+import time
+import unicodedata
+from pymongo import MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import OperationFailure
+from scrapy import signals
+from scrapy.exceptions import DropItem, IgnoreRequest, NotConfigured
+from twisted.internet import defer, task, threads
+from extraction import extract
 import logging
+import sys
+
+# Items are written in bulk: a batch is flushed once it has this many items,
+# or every MONGO_FLUSH_INTERVAL seconds, whichever comes first
+MONGO_BATCH_SIZE = int(os.environ.get("MONGO_BATCH_SIZE", 500))
+MONGO_FLUSH_INTERVAL = float(os.environ.get("MONGO_FLUSH_INTERVAL", 5))
+# Batches allowed to wait for the writer thread; past that, process_item holds
+# items until their batch is stored, which makes Scrapy slow the crawl down
+MONGO_MAX_PENDING_BATCHES = int(os.environ.get("MONGO_MAX_PENDING_BATCHES", 2))
+
+MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017/")
+SITEMAP_URL = os.environ.get("SITEMAP_URL", "https://www.1mg.com/sitemap.xml")
+# Incremental mode skips unchanged sitemap entries and sends conditional requests
+CRAWL_INCREMENTAL = os.environ.get("CRAWL_INCREMENTAL", "") not in ("", "0", "false")
+# Drug pages of a sitemap whose stored lastmod and validators are fetched in one query
+CRAWL_STATE_BATCH_SIZE = int(os.environ.get("CRAWL_STATE_BATCH_SIZE", 1000))
+# Most drug ids announced in one change feed entry
+CHANGES_ENTRY_SIZE = 1000
+
+# Adaptive throughput: per-domain concurrency starts here and is tuned from
+# latency and error/429 rates, never above the politeness ceiling
+CRAWL_START_CONCURRENCY = int(os.environ.get("CRAWL_START_CONCURRENCY", 4))
+CRAWL_MAX_CONCURRENCY = int(os.environ.get("CRAWL_MAX_CONCURRENCY", 16))
+CRAWL_MIN_DELAY = float(os.environ.get("CRAWL_MIN_DELAY", 0.05))
+CRAWL_MAX_DELAY = float(os.environ.get("CRAWL_MAX_DELAY", 10))
+CRAWL_TARGET_LATENCY = float(os.environ.get("CRAWL_TARGET_LATENCY", 2.0))
+# Where the end-of-crawl stats report is written (logged only when unset)
+CRAWL_REPORT_PATH = os.environ.get("CRAWL_REPORT_PATH", "")
 
 # MongoDB connection
-client = MongoClient("mongodb://localhost:27017/")
+client = MongoClient(MONGO_URI)
 db = client["MediLink"]
 collection = db["Drugs"]
+# Last seen lastmod of each sub-sitemap, for incremental crawls
+crawl_state_collection = db["CrawlState"]
+# The backend caches drugs and counts; every write bumps the catalogue version
+# and lands in the change feed so the backend can evict what changed
+meta_collection = db["Meta"]
+changes_collection = db["DrugChanges"]
 
 # Define the Item class to structure the scraped data
 class DrugItem(scrapy.Item):
@@ -21,85 +67,497 @@ class DrugItem(scrapy.Item):
     desc = scrapy.Field()
     detail = scrapy.Field()
     sideEffect = scrapy.Field()
+    # Crawl validators, stored with the drug for the next incremental crawl
+    lastmod = scrapy.Field()
+    etag = scrapy.Field()
+    last_modified = scrapy.Field()
+
+# Fields that make up a drug; the validators above may legitimately be missing
+CONTENT_FIELDS = ('link', 'title', 'price', 'meta', 'desc', 'detail', 'sideEffect')
+CRAWL_FIELDS = ('lastmod', 'etag', 'last_modified')
+
+def normalize_title(title):
+    """Search key for a title; must match normalize() in backend/drug_search.py"""
+    title = unicodedata.normalize('NFKD', title).encode('ascii', 'ignore').decode('ascii')
+    return re.sub(r'[^a-z0-9]+', ' ', title.lower()).strip()
+
+def content_hash(document):
+    """Hash of the scraped fields, used to skip rewriting unchanged drugs"""
+    fields = {k: document[k] for k in CONTENT_FIELDS if k in document}
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode('utf-8')).hexdigest()
 
 # Create a MongoDB pipeline for storing data
 class MongoDBPipeline:
+    """Buffered, idempotent pipeline: drugs are upserted in bulk keyed on their link.
+
+    Writes (and the index setup) run in a thread so the reactor keeps
+    crawling, one batch at a time; when the writer falls behind, items wait
+    for it. Re-crawling the same pages is safe and only writes drugs whose
+    content changed.
+    """
+
+    def open_spider(self, spider):
+        self.buffer = {}  # link -> document; a page seen twice in a batch is written once
+        self.counts = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'failed': 0}
+        self.write_lock = defer.DeferredLock()
+        self.pending_batches = 0
+        # Scrapy waits for the returned Deferred before crawling
+        d = threads.deferToThread(self.ensure_unique_links, spider)
+        d.addCallback(lambda _: self.start_flush_loop(spider))
+        return d
+
+    def start_flush_loop(self, spider):
+        self.flush_loop = task.LoopingCall(self.flush, spider)
+        self.flush_loop.start(MONGO_FLUSH_INTERVAL, now=False)
+
+    def ensure_unique_links(self, spider):
+        """Create the unique index on link, removing duplicates first (runs in a thread)"""
+        try:
+            collection.create_index('link', unique=True)
+        except OperationFailure:
+            # Earlier insert-only crawls left duplicates; keep the oldest copy of each
+            removed = []
+            for group in collection.aggregate([
+                {'$sort': {'_id': 1}},
+                {'$group': {'_id': '$link', 'ids': {'$push': '$_id'}, 'n': {'$sum': 1}}},
+                {'$match': {'n': {'$gt': 1}}},
+            ], allowDiskUse=True):
+                collection.delete_many({'_id': {'$in': group['ids'][1:]}})
+                removed.extend(group['ids'][1:])
+            spider.logger.info(f"Removed {len(removed)} duplicate drugs before indexing links")
+            if removed:
+                self.notify_changed(removed)
+            collection.create_index('link', unique=True)
+
+    def notify_changed(self, drug_ids):
+        """Invalidation hook: tell the backend caches these drugs changed.
+
+        Each entry of the change feed carries the catalogue version its $inc
+        returned as seq, so the backend reads the feed in an order MongoDB
+        assigned rather than by client-generated ObjectIds.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for start in range(0, len(drug_ids), CHANGES_ENTRY_SIZE):
+            meta = meta_collection.find_one_and_update(
+                {'_id': 'drugs'}, {'$inc': {'version': 1}}, upsert=True, return_document=ReturnDocument.AFTER)
+            changes_collection.insert_one(
+                {'seq': meta['version'], 'drug_ids': list(drug_ids[start:start + CHANGES_ENTRY_SIZE]), 'at': now})
+
     def process_item(self, item, spider):
-        if not all(item.values()):
+        started = time.perf_counter()
+        if not all(item.get(field) for field in CONTENT_FIELDS):
             raise DropItem("Missing values in item")
-        try:
-            collection.insert_one(dict(item))
-            spider.logger.info(f"Drug item saved to MongoDB: {item['title']}")
-            return item
-        except Exception as e:
-            spider.logger.error(f"MongoDB insertion error: {e}")
-            raise DropItem(f"Failed to insert item: {e}")
+        document = dict(item)
+        document['title_norm'] = normalize_title(item['title'])
+        document['content_hash'] = content_hash(document)
+        self.buffer[document['link']] = document
+        written = None
+        if len(self.buffer) >= MONGO_BATCH_SIZE:
+            written = self.flush(spider)
+        spider.crawler.stats.inc_value('timing/pipeline_ms', (time.perf_counter() - started) * 1000)
+        if written is not None and self.pending_batches > MONGO_MAX_PENDING_BATCHES:
+            # The writer is behind: hold this item until its batch is stored
+            spider.crawler.stats.inc_value('mongodb/backpressure_waits')
+            return written.addCallback(lambda _: item)
+        return item
+
+    def flush(self, spider):
+        if not self.buffer:
+            return defer.succeed(None)
+        batch, self.buffer = list(self.buffer.values()), {}
+        self.pending_batches += 1
+        d = self.write_lock.run(threads.deferToThread, self.write_batch, batch)
+        d.addCallback(self.batch_written, spider)
+        d.addErrback(self.batch_failed, spider, len(batch))
+        d.addBoth(self.batch_done)
+        return d
+
+    def batch_done(self, result):
+        self.pending_batches -= 1
+        return result
+
+    def write_batch(self, batch):
+        """Upsert a batch (runs in a thread); returns counts per outcome"""
+        started = time.perf_counter()
+        now = datetime.datetime.now(datetime.timezone.utc)
+        existing = {
+            doc['link']: doc
+            for doc in collection.find({'link': {'$in': [d['link'] for d in batch]}},
+                                       {'link': 1, 'content_hash': 1, 'title_norm': 1,
+                                        **{f: 1 for f in CRAWL_FIELDS}})
+        }
+        requests, changed_ids = [], []
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        for document in batch:
+            current = existing.get(document['link'])
+            if current is not None and current.get('content_hash') == document['content_hash']:
+                counts['unchanged'] += 1
+                # Same content: at most refresh the validators for the next crawl
+                # and the search key of drugs stored before it was written
+                refresh = {f: document[f] for f in CRAWL_FIELDS if document.get(f)}
+                refresh['title_norm'] = document['title_norm']
+                if any(current.get(f) != v for f, v in refresh.items()):
+                    requests.append(UpdateOne({'link': document['link']}, {'$set': refresh}))
+                continue
+            if current is not None:
+                changed_ids.append(current['_id'])
+            requests.append(UpdateOne(
+                {'link': document['link']},
+                {'$set': dict(document, updated_at=now), '$setOnInsert': {'created_at': now}},
+                upsert=True
+            ))
+        counts['updated'] = len(changed_ids)
+        if requests:
+            result = collection.bulk_write(requests, ordered=False)
+            counts['inserted'] = result.upserted_count
+            changed_ids.extend(result.upserted_ids.values())
+        if changed_ids:
+            self.notify_changed(changed_ids)
+        counts['write_ms'] = (time.perf_counter() - started) * 1000
+        return counts
+
+    def batch_written(self, counts, spider):
+        spider.crawler.stats.inc_value('timing/mongo_write_ms', counts.pop('write_ms'))
+        for outcome, n in counts.items():
+            self.counts[outcome] += n
+            spider.crawler.stats.inc_value(f'mongodb/{outcome}', n)
+        spider.logger.info(f"Saved drug batch to MongoDB: {counts}")
+
+    def batch_failed(self, failure, spider, size):
+        self.counts['failed'] += size
+        spider.crawler.stats.inc_value('mongodb/failed', size)
+        spider.logger.error(f"MongoDB bulk write error: {failure.getErrorMessage()}")
+
+    def close_spider(self, spider):
+        if getattr(self, 'flush_loop', None) is not None and self.flush_loop.running:
+            self.flush_loop.stop()
+        d = self.flush(spider)
+        # Wait for the last batch, and any still queued behind the lock
+        d.addCallback(lambda _: self.write_lock.run(defer.succeed, None))
+        d.addCallback(lambda _: spider.logger.info(f"MongoDB pipeline totals: {self.counts}"))
+        return d
+
+class ConditionalRequestMiddleware:
+    """Downloader middleware for incremental crawls.
+
+    Drug page requests carry the ETag/Last-Modified stored with the drug, and
+    a 304 Not Modified answer drops the request before it reaches the parser.
+    """
+
+    def process_request(self, request, spider):
+        # Retries and redirects copy the headers, so the validators are needed only once
+        validators = getattr(spider, 'validators', {}).pop(request.url, None)
+        if validators:
+            if validators.get('etag'):
+                request.headers.setdefault('If-None-Match', validators['etag'])
+            if validators.get('last_modified'):
+                request.headers.setdefault('If-Modified-Since', validators['last_modified'])
+        return None
+
+    def process_response(self, request, response, spider):
+        if response.status == 304:
+            spider.crawler.stats.inc_value('incremental/not_modified')
+            raise IgnoreRequest(f"Not modified: {request.url}")
+        return response
+
+class AdaptiveThroughputMiddleware:
+    """Downloader middleware tuning each download slot (domain) with AIMD.
+
+    Every ADAPTIVE_WINDOW outcomes a slot is re-evaluated: a 429/503 or a high
+    error rate halves its concurrency and doubles its delay; slow responses
+    take one request away; otherwise it gains one request and sheds delay,
+    up to the ADAPTIVE_MAX_CONCURRENCY politeness ceiling.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool('ADAPTIVE_ENABLED'):
+            raise NotConfigured
+        self.crawler = crawler
+        self.window = settings.getint('ADAPTIVE_WINDOW', 20)
+        self.max_concurrency = settings.getint('ADAPTIVE_MAX_CONCURRENCY', CRAWL_MAX_CONCURRENCY)
+        self.min_delay = settings.getfloat('ADAPTIVE_MIN_DELAY', CRAWL_MIN_DELAY)
+        self.max_delay = settings.getfloat('ADAPTIVE_MAX_DELAY', CRAWL_MAX_DELAY)
+        self.target_latency = settings.getfloat('ADAPTIVE_TARGET_LATENCY', CRAWL_TARGET_LATENCY)
+        self.max_error_rate = settings.getfloat('ADAPTIVE_MAX_ERROR_RATE', 0.1)
+        self.windows = {}  # slot key -> [responses, errors, throttled, latency sum]
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def process_response(self, request, response, spider):
+        throttled = response.status in (429, 503)
+        self.record(request, error=response.status >= 500, throttled=throttled)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        self.record(request, error=True, throttled=False)
+        return None
+
+    def record(self, request, error, throttled):
+        key = request.meta.get('download_slot')
+        if key is None:
+            return
+        window = self.windows.setdefault(key, [0, 0, 0, 0.0])
+        window[0] += 1
+        window[1] += error
+        window[2] += throttled
+        window[3] += request.meta.get('download_latency', 0.0)
+        # Back off at once when throttled; otherwise wait for a full window
+        if throttled or window[0] >= self.window:
+            self.adjust(key, *window)
+            self.windows[key] = [0, 0, 0, 0.0]
+
+    def adjust(self, key, responses, errors, throttled, latency):
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is None:
+            return
+        if throttled or errors / responses > self.max_error_rate:
+            slot.concurrency = max(1, slot.concurrency // 2)
+            slot.delay = min(self.max_delay, max(slot.delay * 2, self.min_delay, 0.25))
+        elif latency / responses > self.target_latency:
+            slot.concurrency = max(1, slot.concurrency - 1)
+        else:
+            slot.concurrency = min(self.max_concurrency, slot.concurrency + 1)
+            slot.delay = max(self.min_delay, slot.delay * 0.75)
+        stats = self.crawler.stats
+        stats.set_value(f'adaptive/{key}/concurrency', slot.concurrency)
+        stats.set_value(f'adaptive/{key}/delay', round(slot.delay, 3))
+        stats.max_value('adaptive/max_concurrency', slot.concurrency)
+
+class CrawlStatsReport:
+    """Extension logging pages/sec, bytes, parse and pipeline time during and after a crawl"""
+
+    def __init__(self, stats, interval):
+        self.stats = stats
+        self.interval = interval
+        self.started = None
+        self.loop = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        extension = cls(crawler.stats, crawler.settings.getfloat('CRAWL_REPORT_INTERVAL', 60))
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def spider_opened(self, spider):
+        self.started = time.monotonic()
+        self.loop = task.LoopingCall(self.log_report, spider)
+        self.loop.start(self.interval, now=False)
+
+    def report(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        get = self.stats.get_value
+        pages = get('response_received_count', 0)
+        items = get('item_scraped_count', 0)
+        return {
+            'elapsed_s': round(elapsed, 1),
+            'pages': pages,
+            'pages_per_sec': round(pages / elapsed, 2),
+            'bytes': get('downloader/response_bytes', 0),
+            'not_modified': get('incremental/not_modified', 0),
+            'skipped_unchanged': get('incremental/skipped_unchanged', 0),
+            'items': items,
+            'parse_ms_per_page': round(get('timing/parse_ms', 0) / max(get('timing/parsed_pages', 0), 1), 2),
+            'pipeline_ms_per_item': round(get('timing/pipeline_ms', 0) / max(items, 1), 3),
+            'mongo_write_ms': round(get('timing/mongo_write_ms', 0), 1),
+            'max_concurrency': get('adaptive/max_concurrency'),
+        }
+
+    def log_report(self, spider):
+        spider.logger.info(f"Crawl stats: {self.report()}")
+
+    def spider_closed(self, spider, reason):
+        if self.loop and self.loop.running:
+            self.loop.stop()
+        report = dict(self.report(), finish_reason=reason)
+        spider.logger.info(f"Crawl report: {report}")
+        if CRAWL_REPORT_PATH:
+            with open(CRAWL_REPORT_PATH, 'w') as f:
+                json.dump(report, f, indent=2)
 
 # Create the spider class for drug data extraction
 class DrugSpider(SitemapSpider):
     name = 'drug_spider'
-    sitemap_urls = ['https://www.1mg.com/sitemap.xml']
+    sitemap_urls = [SITEMAP_URL]
     sitemap_follow = [r'sitemap']
     sitemap_rules = [
         (r'/drugs/', 'parse_drug'),
         (r'/otc/', 'parse_drug'),
     ]
 
+    def __init__(self, *args, incremental=CRAWL_INCREMENTAL, sitemap_url=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if sitemap_url:
+            self.sitemap_urls = [sitemap_url]
+        self.incremental = incremental
+        self.page_lastmod = {}     # drug page URL -> lastmod from the sitemap
+        self.sitemap_lastmod = {}  # sub-sitemap URL -> lastmod seen this run
+        self.known_lastmod = {}    # sub-sitemap URL -> lastmod of the last finished crawl
+        self.stored = {}           # drug page URL -> stored state, from its sitemap until filtered
+        self.validators = {}       # drug page URL -> stored ETag/Last-Modified, until requested
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        if spider.incremental:
+            crawler.signals.connect(spider.load_crawl_state, signal=signals.spider_opened)
+        return spider
+
+    def load_crawl_state(self, spider):
+        """Read the sub-sitemap lastmods of the last finished crawl; Scrapy waits for the Deferred"""
+        d = threads.deferToThread(lambda: {state['_id']: state.get('lastmod')
+                                           for state in crawl_state_collection.find({}, {'lastmod': 1})})
+
+        def loaded(known_lastmod):
+            self.known_lastmod = known_lastmod
+            self.logger.info(f"Incremental crawl: {len(known_lastmod)} known sitemap lastmods")
+
+        return d.addCallback(loaded)
+
+    def lookup_stored_pages(self, body):
+        """Stored lastmod and validators of the drug pages in a sitemap, by link (runs in a thread)"""
+        links = [entry['loc'] for entry in Sitemap(body) if self.is_drug_page(entry['loc'])]
+        projection = {'link': 1, 'lastmod': 1, 'etag': 1, 'last_modified': 1, '_id': 0}
+        stored = {}
+        for start in range(0, len(links), CRAWL_STATE_BATCH_SIZE):
+            batch = links[start:start + CRAWL_STATE_BATCH_SIZE]
+            stored.update((drug['link'], drug) for drug in collection.find({'link': {'$in': batch}}, projection))
+        return stored
+
+    async def _parse_sitemap(self, response):
+        # Look up the sitemap's drug pages in a thread before SitemapSpider
+        # filters its entries, so MongoDB never blocks the reactor
+        if self.incremental:
+            body = self._get_sitemap_body(response)
+            if body:
+                d = threads.deferToThread(self.lookup_stored_pages, body)
+                self.stored.update(await maybe_deferred_to_future(d))
+        for request in super()._parse_sitemap(response):
+            yield request
+
+    def is_drug_page(self, url):
+        return any(re.search(pattern, url) for pattern, _ in self.sitemap_rules)
+
+    def sitemap_filter(self, entries):
+        for entry in entries:
+            loc, lastmod = entry['loc'], entry.get('lastmod')
+            drug = {}
+            if self.is_drug_page(loc):
+                self.page_lastmod[loc] = lastmod
+                drug = self.stored.pop(loc, None) or {}
+                known = drug.get('lastmod')
+            else:
+                if lastmod:
+                    self.sitemap_lastmod[loc] = lastmod
+                known = self.known_lastmod.get(loc)
+            # An entry whose lastmod has not moved since the last crawl is skipped
+            if self.incremental and lastmod and known == lastmod:
+                self.crawler.stats.inc_value('incremental/skipped_unchanged')
+                continue
+            if drug.get('etag') or drug.get('last_modified'):
+                self.validators[loc] = drug
+            yield entry
+
+    def closed(self, reason):
+        # Sub-sitemaps only count as done when the whole crawl finished; Scrapy
+        # waits for the returned Deferred before shutting down
+        if self.incremental and reason == 'finished' and self.sitemap_lastmod:
+            return threads.deferToThread(crawl_state_collection.bulk_write, [
+                UpdateOne({'_id': loc}, {'$set': {'lastmod': lastmod}}, upsert=True)
+                for loc, lastmod in self.sitemap_lastmod.items()
+            ])
+
     def parse_drug(self, response):
         self.logger.info(f"Processing drug page: {response.url}")
+        started = time.perf_counter()
         try:
             item = DrugItem()
             item['link'] = response.url
             
-            # Extract data using CSS selectors
-            item['title'] = response.css('.DrugHeader__title-content___2ZaPo::text').get('').strip()
-            item['price'] = response.css('.DrugPriceBox__price___dj2lv::text').get('').strip()
-            item['meta'] = response.css('.DrugHeader__meta-value___vqYM0::text').get('').strip()
-            item['desc'] = response.css('.DrugOverview__content___22ZBX::text').get('').strip()
-            item['detail'] = response.css('.DrugPriceBox__quantity___2LGBX::text').get('').strip()
-            item['sideEffect'] = response.css('.DrugOverview__container___CqA8x::text').get('').strip()
-            
-            # Fallbacks using more generic selectors if specific classes aren't found
-            if not item['title']:
-                item['title'] = response.css('h1::text').get('').strip()
-            if not item['desc'] and response.css('div.DrugOverview__content___22ZBX'):
-                item['desc'] = ' '.join(response.css('div.DrugOverview__content___22ZBX ::text').getall()).strip()
-            if not item['sideEffect'] and response.css('div.DrugOverview__container___CqA8x'):
-                item['sideEffect'] = ' '.join(response.css('div.DrugOverview__container___CqA8x ::text').getall()).strip()
+            # Embedded JSON first, then precompiled DOM rules (see extraction.DRUG_SPEC)
+            values, sources = extract(response.selector.root)
+            for field, value in values.items():
+                item[field] = value
+                # Which rule served each field; a shift towards fallbacks means the layout changed
+                self.crawler.stats.inc_value(f"extraction/{field}/{sources.get(field, 'missing')}")
+
+            # Validators for the next incremental crawl
+            if self.page_lastmod.get(response.url):
+                item['lastmod'] = self.page_lastmod[response.url]
+            if response.headers.get('ETag'):
+                item['etag'] = response.headers.get('ETag').decode('latin-1')
+            if response.headers.get('Last-Modified'):
+                item['last_modified'] = response.headers.get('Last-Modified').decode('latin-1')
             
             return item
             
         except Exception as e:
             self.logger.error(f"Error parsing {response.url}: {e}")
             return None
+        finally:
+            self.crawler.stats.inc_value('timing/parse_ms', (time.perf_counter() - started) * 1000)
+            self.crawler.stats.inc_value('timing/parsed_pages')
 
 # Configure Scrapy settings
-def get_settings():
+def get_settings(incremental=CRAWL_INCREMENTAL):
     settings = {
         'BOT_NAME': 'MediLink',
         'ROBOTSTXT_OBEY': True,
-        'CONCURRENT_REQUESTS': 32,  # Adjust based on your system capacity
-        'DOWNLOAD_DELAY': 0.25,     # Adjust to avoid overloading the site
+        # Global cap; each domain starts lower and is tuned by AdaptiveThroughputMiddleware
+        'CONCURRENT_REQUESTS': 64,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': CRAWL_START_CONCURRENCY,
+        'DOWNLOAD_DELAY': 0.25,
+        'RANDOMIZE_DOWNLOAD_DELAY': False,
+        'ADAPTIVE_ENABLED': True,
+        'ADAPTIVE_MAX_CONCURRENCY': CRAWL_MAX_CONCURRENCY,
+        'EXTENSIONS': {
+            '__main__.CrawlStatsReport': 500,
+        },
         'ITEM_PIPELINES': {
             '__main__.MongoDBPipeline': 300,
         },
         'LOG_LEVEL': 'INFO',
         'RETRY_TIMES': 3,
-        'HTTPCACHE_ENABLED': True,
+        # Incremental crawls revalidate against the site; a local cache would answer instead
+        'HTTPCACHE_ENABLED': not incremental,
+        'DOWNLOADER_MIDDLEWARES': {
+            '__main__.AdaptiveThroughputMiddleware': 850,
+            **({'__main__.ConditionalRequestMiddleware': 950} if incremental else {}),
+        },
         'USER_AGENT': 'MediLink Drug Information Spider (+http://www.yourdomain.com)',
     }
     return settings
 
-def run_spider():
-    settings = get_settings()
+def backfill_title_norm(batch_size=1000):
+    """One-off migration: set title_norm on drugs stored before the pipeline wrote it"""
+    updates, updated = [], 0
+    for doc in collection.find({}, {'title': 1, 'title_norm': 1}):
+        title_norm = normalize_title(doc.get('title') or '')
+        if doc.get('title_norm') != title_norm:
+            updates.append(UpdateOne({'_id': doc['_id']}, {'$set': {'title_norm': title_norm}}))
+        if len(updates) >= batch_size:
+            updated += collection.bulk_write(updates, ordered=False).modified_count
+            updates = []
+    if updates:
+        updated += collection.bulk_write(updates, ordered=False).modified_count
+    return updated
+
+def run_spider(incremental=CRAWL_INCREMENTAL):
+    settings = get_settings(incremental)
     process = CrawlerProcess(settings)
-    process.crawl(DrugSpider)
+    process.crawl(DrugSpider, incremental=incremental)
     process.start()  # The script will block here until the crawling is finished
 
 if __name__ == "__main__":
     try:
-        run_spider()
-        print("Crawling completed")
+        if '--backfill-title-norm' in sys.argv:
+            print(f"Set title_norm on {backfill_title_norm()} drugs")
+        else:
+            run_spider(incremental=CRAWL_INCREMENTAL or '--incremental' in sys.argv)
+            print("Crawling completed")
     except KeyboardInterrupt:
         print("Crawling interrupted by user")
     finally:
@@ -0,0 +1,99 @@
+import os
+
+import lxml.html
+
+from extraction import DRUG_SPEC, ByClass, InitialState, JsonLd, XPath, class_key, extract, format_offer_price
+
+SITE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fixtures", "site")
+
+
+def fixture_page(path):
+    with open(os.path.join(SITE_DIR, path), encoding="utf-8") as f:
+        return lxml.html.document_fromstring(f.read())
+
+
+def page(body, head=""):
+    return lxml.html.document_fromstring(f"<html><head>{head}</head><body>{body}</body></html>")
+
+
+def test_class_key_drops_the_css_module_hash():
+    assert class_key("DrugHeader__title-content___2ZaPo") == "DrugHeader__title-content___"
+    assert class_key("plain") == "plain"
+
+
+def test_extracts_fixture_page_from_dom_rules():
+    values, sources = extract(fixture_page("drugs/dolo-650-tablet-74467"))
+    assert values == {
+        'title': "Dolo 650 Tablet",
+        'price': "₹30.91",
+        'meta': "Micro Labs Ltd",
+        'desc': "Dolo 650 Tablet helps relieve pain and fever by blocking the release of "
+                "certain chemical messengers responsible for fever and pain.",
+        'detail': "strip of 15 tablets",
+        'sideEffect': "Nausea, Vomiting, Stomach pain",
+    }
+    assert sources['title'] == "class:DrugHeader__title-content___"
+    assert sources['sideEffect'] == "class:DrugOverview__container___"
+
+
+def test_embedded_state_is_preferred_over_the_dom():
+    values, sources = extract(fixture_page("drugs/pan-40-tablet-10418"))
+    assert values['title'] == "Pan 40 Tablet"
+    assert values['price'] == "₹155.10"
+    assert values['meta'] == "Alkem Laboratories Ltd"
+    assert sources['title'] == "state:drugPage.name"
+    assert sources['price'] == "json-ld:offers"
+    # Not in the JSON-LD, so served by the DOM rules
+    assert values['detail'] == "strip of 15 tablets"
+    assert values['sideEffect'] == "Headache, Diarrhea, Flatulence"
+
+
+def test_class_rules_survive_rebuilt_hashes():
+    dom_only = {field: [rule for rule in rules if not isinstance(rule, (InitialState, JsonLd))]
+                for field, rules in DRUG_SPEC.items()}
+    values, sources = extract(fixture_page("drugs/pan-40-tablet-10418"), dom_only)
+    assert values['title'] == "Pan 40 Tablet"
+    assert values['price'] == "₹155.10"
+    assert sources['meta'] == "class:DrugHeader__meta-value___"
+
+
+def test_falls_back_in_rule_order():
+    values, sources = extract(page('<h1>Crocin Advance</h1>'
+                                   '<div class="DrugOverview__content___x"><p>Relieves </p><p>pain</p></div>'))
+    assert values['title'] == "Crocin Advance"
+    assert sources['title'] == "h1"
+    assert values['desc'] == "Relieves pain"
+    assert sources['desc'] == "class:DrugOverview__content___*"
+    assert values['price'] == ""
+    assert 'price' not in sources
+
+
+def test_ignores_broken_and_unrelated_json_ld():
+    head = ('<script type="application/ld+json">{not json</script>'
+            '<script type="application/ld+json">{"@type": "Organization", "name": "Pharmacy"}</script>'
+            '<script type="application/ld+json">[{"@type": "Drug", "name": "Shelcal 500"}]</script>')
+    values, sources = extract(page('<h1>Ignored</h1>', head))
+    assert values['title'] == "Shelcal 500"
+    assert sources['title'] == "json-ld:name"
+
+
+def test_offer_price_formatting():
+    assert format_offer_price({"price": "30.91", "priceCurrency": "INR"}) == "₹30.91"
+    assert format_offer_price([{"price": 12, "priceCurrency": "USD"}]) == "12 USD"
+    assert format_offer_price({"price": ""}) is None
+    assert format_offer_price([]) is None
+
+
+def test_initial_state_ignores_trailing_script():
+    head = ('<script>var x = 1;</script>'
+            '<script>window.__INITIAL_STATE__ = {"drugPage": {"name": "Pan 40"}}; window.ready = true;</script>')
+    spec = {'title': [InitialState('drugPage.name'), XPath('//h1', name='h1')]}
+    values, sources = extract(page('<h1>Fallback</h1>', head), spec)
+    assert values == {'title': "Pan 40"}
+    assert sources == {'title': "state:drugPage.name"}
+
+
+def test_by_class_reads_text_after_child_elements():
+    spec = {'sideEffect': [ByClass('Overview___')]}
+    values, _ = extract(page('<div class="Overview___a1"><span> </span> Rash, Itching <b>x</b></div>'), spec)
+    assert values['sideEffect'] == "Rash, Itching"
@@ -0,0 +1,189 @@
+import asyncio
+import os
+import threading
+
+import pytest
+
+scrapy = pytest.importorskip("scrapy")
+from scrapy.exceptions import IgnoreRequest
+from scrapy.http import HtmlResponse, Request, Response, XmlResponse
+from scrapy.utils.sitemap import Sitemap
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer
+
+import main
+from main import ConditionalRequestMiddleware, DrugSpider
+
+SITE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fixtures", "site")
+BASE = "http://fixtures.test"
+
+
+class FakeCollection:
+    """Just enough of a pymongo collection for the crawl state queries"""
+
+    def __init__(self, documents=()):
+        self.documents = list(documents)
+        self.queries = []
+        self.threads = []
+        self.writes = []
+
+    def find(self, query=None, projection=None):
+        self.queries.append(query)
+        self.threads.append(threading.current_thread())
+        links = (query or {}).get('link', {}).get('$in')
+        return [dict(doc) for doc in self.documents if links is None or doc.get('link') in links]
+
+    def bulk_write(self, requests):
+        self.threads.append(threading.current_thread())
+        self.writes.extend(requests)
+
+
+def in_worker_thread(fn, *args, **kwargs):
+    """deferToThread stand-in: runs fn in a fresh thread and returns a fired Deferred"""
+    result = {}
+    worker = threading.Thread(target=lambda: result.update(value=fn(*args, **kwargs)))
+    worker.start()
+    worker.join()
+    return defer.succeed(result['value'])
+
+
+def sitemap_body(name):
+    with open(os.path.join(SITE_DIR, name), "rb") as f:
+        return f.read().replace(b"{{base}}", BASE.encode())
+
+
+def sitemap_entries(name):
+    return list(Sitemap(sitemap_body(name)))
+
+
+def make_spider(monkeypatch, drugs=(), sitemaps=(), incremental=True):
+    monkeypatch.setattr(main, "collection", FakeCollection(drugs))
+    monkeypatch.setattr(main, "crawl_state_collection", FakeCollection(sitemaps))
+    monkeypatch.setattr(main.threads, "deferToThread", in_worker_thread)
+    crawler = get_crawler(DrugSpider)
+    spider = DrugSpider.from_crawler(crawler, incremental=incremental)
+    if incremental:
+        spider.load_crawl_state(spider)
+    return spider
+
+
+def filter_sitemap(spider, name):
+    """What the sitemap callback does: look up the stored pages, then filter"""
+    if spider.incremental:
+        spider.stored.update(spider.lookup_stored_pages(sitemap_body(name)))
+    return [entry['loc'] for entry in spider.sitemap_filter(sitemap_entries(name))]
+
+
+def test_skips_drug_pages_whose_lastmod_has_not_moved(monkeypatch):
+    spider = make_spider(monkeypatch, drugs=[
+        {'link': f"{BASE}/drugs/dolo-650-tablet-74467", 'lastmod': "2024-05-01", 'etag': '"a"'},
+        {'link': f"{BASE}/drugs/pan-40-tablet-10418", 'lastmod': "2024-04-20", 'etag': '"b"'},
+    ])
+    kept = filter_sitemap(spider, "sitemap-drugs.xml")
+
+    assert kept == [f"{BASE}/drugs/augmentin-625-duo-tablet-138629", f"{BASE}/drugs/pan-40-tablet-10418"]
+    assert spider.crawler.stats.get_value('incremental/skipped_unchanged') == 1
+    # Only the pages about to be requested keep their validators
+    assert list(spider.validators) == [f"{BASE}/drugs/pan-40-tablet-10418"]
+    assert spider.stored == {}
+    assert spider.page_lastmod[f"{BASE}/drugs/dolo-650-tablet-74467"] == "2024-05-01"
+
+
+def test_looks_drug_pages_up_in_batches(monkeypatch):
+    monkeypatch.setattr(main, "CRAWL_STATE_BATCH_SIZE", 2)
+    spider = make_spider(monkeypatch)
+    assert main.collection.queries == []
+
+    filter_sitemap(spider, "sitemap-drugs.xml")
+    assert [len(query['link']['$in']) for query in main.collection.queries] == [2, 1]
+
+
+def test_sitemap_callback_queries_mongo_off_the_calling_thread(monkeypatch):
+    spider = make_spider(monkeypatch, drugs=[
+        {'link': f"{BASE}/drugs/dolo-650-tablet-74467", 'lastmod': "2024-05-01"},
+    ])
+    response = XmlResponse(f"{BASE}/sitemap-drugs.xml", body=sitemap_body("sitemap-drugs.xml"))
+
+    async def collect():
+        return [request.url async for request in spider._parse_sitemap(response)]
+
+    urls = asyncio.run(collect())
+    assert urls == [f"{BASE}/drugs/augmentin-625-duo-tablet-138629", f"{BASE}/drugs/pan-40-tablet-10418"]
+    assert threading.current_thread() not in main.collection.threads
+    assert threading.current_thread() not in main.crawl_state_collection.threads
+
+
+def test_skips_sub_sitemaps_seen_by_the_last_finished_crawl(monkeypatch):
+    spider = make_spider(monkeypatch, sitemaps=[{'_id': f"{BASE}/sitemap-otc.xml", 'lastmod': "2024-04-01"}])
+    kept = filter_sitemap(spider, "sitemap.xml")
+
+    assert kept == [f"{BASE}/sitemap-drugs.xml"]
+    assert spider.sitemap_lastmod == {f"{BASE}/sitemap-drugs.xml": "2024-05-02",
+                                      f"{BASE}/sitemap-otc.xml": "2024-04-01"}
+    assert main.collection.queries == []
+
+
+def test_finished_crawl_saves_sitemap_lastmods_in_a_thread(monkeypatch):
+    spider = make_spider(monkeypatch)
+    filter_sitemap(spider, "sitemap.xml")
+
+    results = []
+    spider.closed('finished').addCallback(results.append)
+    assert results
+    assert len(main.crawl_state_collection.writes) == 2
+    assert threading.current_thread() not in main.crawl_state_collection.threads
+    assert spider.closed('shutdown') is None
+
+
+def test_full_crawl_keeps_every_entry(monkeypatch):
+    spider = make_spider(monkeypatch, drugs=[
+        {'link': f"{BASE}/drugs/dolo-650-tablet-74467", 'lastmod': "2024-05-01", 'etag': '"a"'},
+    ], incremental=False)
+    assert len(filter_sitemap(spider, "sitemap-drugs.xml")) == 3
+    assert spider.validators == {}
+    assert main.collection.queries == []
+
+
+def test_sends_stored_validators_once(monkeypatch):
+    spider = make_spider(monkeypatch)
+    url = f"{BASE}/drugs/pan-40-tablet-10418"
+    spider.validators[url] = {'etag': '"b"', 'last_modified': "Wed, 01 May 2024 10:00:00 GMT"}
+    middleware = ConditionalRequestMiddleware()
+
+    request = Request(url)
+    assert middleware.process_request(request, spider) is None
+    assert request.headers['If-None-Match'] == b'"b"'
+    assert request.headers['If-Modified-Since'] == b"Wed, 01 May 2024 10:00:00 GMT"
+    assert url not in spider.validators
+
+    unknown = Request(f"{BASE}/drugs/dolo-650-tablet-74467")
+    middleware.process_request(unknown, spider)
+    assert b'If-None-Match' not in unknown.headers
+
+
+def test_not_modified_response_is_dropped(monkeypatch):
+    spider = make_spider(monkeypatch)
+    middleware = ConditionalRequestMiddleware()
+    request = Request(f"{BASE}/drugs/pan-40-tablet-10418")
+
+    with pytest.raises(IgnoreRequest):
+        middleware.process_response(request, Response(request.url, status=304, request=request), spider)
+    assert spider.crawler.stats.get_value('incremental/not_modified') == 1
+
+    ok = Response(request.url, status=200, request=request)
+    assert middleware.process_response(request, ok, spider) is ok
+
+
+def test_parsed_item_carries_validators_for_the_next_crawl(monkeypatch):
+    spider = make_spider(monkeypatch)
+    url = f"{BASE}/drugs/dolo-650-tablet-74467"
+    spider.page_lastmod[url] = "2024-05-01"
+    with open(os.path.join(SITE_DIR, "drugs", "dolo-650-tablet-74467"), "rb") as f:
+        response = HtmlResponse(url, body=f.read(), encoding="utf-8", headers={
+            'ETag': '"abc"', 'Last-Modified': "Wed, 01 May 2024 10:00:00 GMT"})
+
+    item = spider.parse_drug(response)
+    assert item['lastmod'] == "2024-05-01"
+    assert item['etag'] == '"abc"'
+    assert item['last_modified'] == "Wed, 01 May 2024 10:00:00 GMT"
+    assert item['title'] == "Dolo 650 Tablet"